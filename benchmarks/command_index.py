@@ -0,0 +1,76 @@
+"""
+Typo suggestions: scoring every name vs the bigram index.
+
+    python -m benchmarks.command_index [commands] [lookups]
+"""
+import random
+import string
+import sys
+import time
+
+from core.helpers import CommandIndex
+from core.utils import get_similarity_coefficient
+
+
+def fake_commands(count: int) -> list:
+    """
+    (name, aliases, hidden) entries shaped like the bot's commands.
+    """
+    random.seed(0)
+    entries = []
+    for i in range(count):
+        name = ''.join(random.choices(string.ascii_lowercase, k=random.randint(3, 10)))
+        aliases = [name[:random.randint(1, len(name))] + str(j) for j in range(random.randint(0, 3))]
+        entries.append((f'{name}{i}', aliases, i % 10 == 0))
+    return entries
+
+
+def typo(name: str) -> str:
+    pos = random.randrange(len(name))
+    return name[:pos] + random.choice(string.ascii_lowercase) + name[pos + 1:]
+
+
+def linear_suggest(entries: list, query: str) -> str:
+    """
+    What correct_command_name did before the index: rebuild the name list and score every name.
+    """
+    names = []
+    for name, aliases, hidden in entries:
+        if not hidden:
+            names.append(name)
+            names.extend(aliases)
+    best, best_score = None, 0
+    for name in names:
+        score = get_similarity_coefficient(query, name)
+        if score > best_score:
+            best, best_score = name, score
+    return best
+
+
+def main(count: int = 300, lookups: int = 2000):
+    entries = fake_commands(count)
+    names = sum(1 + len(aliases) for _, aliases, _ in entries)
+    queries = [typo(random.choice(entries)[0]) for _ in range(lookups)]
+
+    start = time.perf_counter()
+    index = CommandIndex(entries)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for query in queries:
+        linear_suggest(entries, query)
+    linear = (time.perf_counter() - start) / lookups
+
+    start = time.perf_counter()
+    for query in queries:
+        index.suggest(query, k=3)
+    indexed = (time.perf_counter() - start) / lookups
+
+    print(f'{count} commands, {names} names and aliases, {lookups} lookups')
+    print(f'index build:     {build * 1e3:.2f} ms')
+    print(f'linear scan:     {linear * 1e6:.1f} us/lookup')
+    print(f'bigram index:    {indexed * 1e6:.1f} us/lookup (top 3)')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:3]))
@@ -0,0 +1,457 @@
+"""
+Offline stand-ins for yt-dlp and Discord, so the bot can be driven end-to-end without network.
+
+    with isolated_storage(), FakeExtractor(latency=0.2).installed():
+        bot = FakeBot()
+        cog = Music(bot)
+        ctx = FakeContext(bot, FakeGuild(speed=50), cog)
+        await ctx.invoke(cog._play, search=FakeExtractor.video_url(0))
+
+The fake voice client consumes sources on a thread of its own, like discord.py's audio player,
+at real-time pace or accelerated by `speed`.
+"""
+import asyncio
+import contextlib
+import itertools
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import discord
+
+from core.audio import FRAME_LENGTH, TrackSource
+from core.cache import stream_cache, search_cache
+from core.journal import session_journal
+from core.metadata_store import metadata_store
+from core.resolver import YoutubeDLPool, ytdl_pool
+from core.settings import settings_store
+
+PCM_FRAME = b'\x00' * discord.opus.Encoder.FRAME_SIZE
+OPUS_FRAME = b'\xf8\xff\xfe'  # Opus packet of 20ms silence
+
+_ids = itertools.count(10 ** 17)
+
+
+class FakeYoutubeDL:
+    """
+    The part of yt_dlp.YoutubeDL the resolver uses, answering from the extractor's canned infos.
+    """
+    __slots__ = ('params', 'extractor')
+
+    def __init__(self, params: dict, extractor: 'FakeExtractor'):
+        self.params = params
+        self.extractor = extractor
+
+    def extract_info(self, url: str, download: bool = False, process: bool = True) -> dict:
+        extractor = self.extractor
+        extractor.calls += 1
+        time.sleep(extractor.latency)
+        if 'list=' in url:
+            entries = extractor.playlist_entries(url)
+            if process:
+                start = (self.params.get('playliststart') or 1) - 1
+                entries = list(itertools.islice(entries, start, self.params.get('playlistend')))
+            return {'_type': 'playlist', 'id': url.rsplit('=', 1)[-1], 'title': 'Fake playlist', 'entries': entries}
+        if '://' not in url:
+            # Search query
+            return {'_type': 'playlist', 'entries': [extractor.info(abs(hash(url)) % 10 ** 6)]}
+        return extractor.info(int(url.rsplit('=', 1)[-1]))
+
+    @staticmethod
+    def sanitize_info(info: dict) -> dict:
+        return info
+
+    def close(self):
+        pass
+
+
+class FakeExtractor:
+    """
+    Canned info dicts with configurable latency.
+
+    `latency` is slept once per extract_info call, `entry_latency` once per playlist entry
+    (yt-dlp pages through long playlists while the entries are consumed).
+    Video ids are numbers, playlist ids the first video id and the entry count: `...playlist?list=1000-500`.
+    """
+    __slots__ = ('latency', 'entry_latency', 'duration', 'codec', 'calls')
+
+    def __init__(self, latency: float = 0.2, entry_latency: float = 0.002, duration: float = 180,
+                 codec: str = 'opus'):
+        self.latency = latency
+        self.entry_latency = entry_latency
+        self.duration = duration
+        self.codec = codec
+        self.calls = 0
+
+    @staticmethod
+    def video_url(video_id: int) -> str:
+        return f'https://www.youtube.com/watch?v={video_id}'
+
+    @staticmethod
+    def playlist_url(entries: int, first: int = 0) -> str:
+        return f'https://www.youtube.com/playlist?list={first}-{entries}'
+
+    def info(self, video_id: int) -> dict:
+        return {
+            'id': str(video_id),
+            'title': f'Fake song {video_id}',
+            'uploader': 'Fake uploader',
+            'duration': self.duration,
+            'webpage_url': self.video_url(video_id),
+            'url': f'https://rr1.fake.invalid/videoplayback?expire={int(time.time()) + 6 * 3600}&id={video_id}',
+            'acodec': self.codec,
+            'thumbnails': [{'url': f'https://i.fake.invalid/{video_id}.jpg'}],
+        }
+
+    def playlist_entries(self, url: str):
+        first, entries = map(int, url.rsplit('=', 1)[-1].split('-'))
+        for video_id in range(first, first + entries):
+            time.sleep(self.entry_latency)
+            yield {'_type': 'url', 'url': self.video_url(video_id), 'title': f'Fake song {video_id}',
+                   'duration': self.duration, 'uploader': 'Fake uploader'}
+
+    @contextlib.contextmanager
+    def installed(self):
+        """
+        Make the shared YoutubeDL pool hand out fake instances.
+        """
+        create = YoutubeDLPool._create
+
+        def fake_create(pool, profile):
+            pool.created += 1
+            return FakeYoutubeDL({}, self)
+
+        ytdl_pool.close()
+        YoutubeDLPool._create = fake_create
+        try:
+            yield self
+        finally:
+            YoutubeDLPool._create = create
+            ytdl_pool.close()
+
+
+@contextlib.contextmanager
+def isolated_storage():
+    """
+    Point settings, queue journals and the metadata database to a temporary directory and start with empty caches.
+
+    Enter it before anything touches the metadata store, its connections are kept per thread.
+    """
+    saved = settings_store.path, metadata_store.path, session_journal.path
+    with tempfile.TemporaryDirectory() as tmp:
+        settings_store.path = os.path.join(tmp, 'settings.json')
+        settings_store.load()
+        metadata_store.path = os.path.join(tmp, 'metadata.sqlite3')
+        session_journal.path = Path(tmp, 'journal')
+        stream_cache.clear()
+        search_cache.clear()
+        try:
+            yield tmp
+        finally:
+            session_journal.close()
+            settings_store.path, metadata_store.path, session_journal.path = saved
+            settings_store.load()
+            stream_cache.clear()
+            search_cache.clear()
+
+
+class FakeAudio(discord.AudioSource):
+    """
+    Silence of the track's duration. `startup` is the delay of the first read, like ffmpeg connecting.
+    """
+
+    def __init__(self, frames: int, opus: bool = True, startup: float = 0.0):
+        self.remaining = frames
+        self.opus = opus
+        self.startup = startup
+
+    def read(self) -> bytes:
+        if self.startup:
+            time.sleep(self.startup)
+            self.startup = 0.0
+        if self.remaining <= 0:
+            return b''
+        self.remaining -= 1
+        return OPUS_FRAME if self.opus else PCM_FRAME
+
+    def is_opus(self) -> bool:
+        return self.opus
+
+
+def fake_source_factory(startup: float = 0.05):
+    """
+    Replacement of core.audio.create_source that does not spawn ffmpeg.
+    """
+    async def create_source(track, offset: float = 0.0) -> TrackSource:
+        frames = max(0, int(((track.info.duration or 0) - offset) / FRAME_LENGTH))
+        return TrackSource(track, FakeAudio(frames, opus=track.codec in ('opus', 'libopus'), startup=startup),
+                           offset=offset)
+    return create_source
+
+
+class FakeVoiceClient:
+    """
+    Plays sources like discord.py's AudioPlayer: one thread reading a frame every 20ms / speed,
+    `after` called from that thread once the source ends or is stopped.
+    """
+
+    def __init__(self, channel: 'FakeVoiceChannel', speed: float = 1.0):
+        self.channel = channel
+        self.guild = channel.guild
+        self.speed = speed
+        self.frames = 0
+        self.first_frame_at = None  # perf_counter() of the first frame of the current source
+        self.started = asyncio.Event()  # Set once the current source delivered its first frame
+        self._loop = asyncio.get_running_loop()
+        self._connected = True
+        self._thread = None
+        self._source = None
+        self._end = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+        self._play_waiters = []
+
+    def play(self, source, *, after=None):
+        if self.is_playing() or self.is_paused():
+            raise discord.ClientException('Already playing audio.')
+        waiters, self._play_waiters = self._play_waiters, []
+        for waiter in waiters:
+            # Gapless switches call play() from the audio thread
+            self._loop.call_soon_threadsafe(lambda future=waiter: future.done() or future.set_result(None))
+        self._source = source
+        self.first_frame_at = None
+        self.started.clear()
+        self._end = threading.Event()
+        self._resumed.set()
+        self._thread = threading.Thread(target=self._run, args=(source, after, self._end), daemon=True)
+        self._thread.start()
+
+    def _run(self, source, after, end: threading.Event):
+        interval = FRAME_LENGTH / self.speed
+        next_at = time.perf_counter()
+        error = None
+        try:
+            while not end.is_set():
+                self._resumed.wait()
+                data = source.read()
+                if not data:
+                    break
+                if self.first_frame_at is None:
+                    self.first_frame_at = time.perf_counter()
+                    self._loop.call_soon_threadsafe(self.started.set)
+                self.frames += 1
+                next_at += interval
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        except Exception as ex:
+            error = ex
+        finally:
+            if self._source is source:
+                self._source = None
+            if after is not None:
+                after(error)
+            source.cleanup()
+
+    async def wait_play(self):
+        """
+        Wait for the next play() call.
+        """
+        waiter = self._loop.create_future()
+        self._play_waiters.append(waiter)
+        await waiter
+
+    def is_playing(self) -> bool:
+        return self._source is not None and self._resumed.is_set()
+
+    def is_paused(self) -> bool:
+        return self._source is not None and not self._resumed.is_set()
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+    def pause(self):
+        self._resumed.clear()
+
+    def resume(self):
+        self._resumed.set()
+
+    def stop(self):
+        self._end.set()
+        self._resumed.set()
+
+    async def move_to(self, channel):
+        self.channel = channel
+
+    async def disconnect(self, *, force: bool = False):
+        self.stop()
+        self._connected = False
+        self.guild.voice_client = None
+        # `after` has to reach the event loop before it may close
+        while self._thread is not None and self._thread.is_alive():
+            await asyncio.sleep(0.005)
+
+
+class FakeMessage:
+    __slots__ = ('id', 'channel', 'content', 'embed', 'created_at')
+
+    def __init__(self, channel: 'FakeChannel', content: str = None, embed=None):
+        self.id = next(_ids)
+        self.channel = channel
+        self.content = content
+        self.embed = embed
+        self.created_at = discord.utils.utcnow()
+
+    async def edit(self, content=None, embed=None, **kwargs):
+        self.channel.edits += 1
+        if content is not None:
+            self.content = content
+        if embed is not None:
+            self.embed = embed
+        return self
+
+    async def delete(self):
+        self.channel.deleted += 1
+
+
+class FakePermissions:
+    manage_messages = True
+
+
+class FakeChannel:
+    """
+    Text channel that keeps count of what was sent instead of sending it.
+    """
+
+    def __init__(self, guild: 'FakeGuild'):
+        self.id = next(_ids)
+        self.guild = guild
+        self.sent = 0
+        self.edits = 0
+        self.deleted = 0
+        self.last_message = None
+
+    async def send(self, content: str = None, *, embed=None, **kwargs) -> FakeMessage:
+        self.sent += 1
+        self.last_message = FakeMessage(self, content, embed)
+        return self.last_message
+
+    async def delete_messages(self, messages):
+        self.deleted += len(messages)
+
+    def permissions_for(self, member) -> FakePermissions:
+        return FakePermissions()
+
+    def __str__(self):
+        return f'#fake-{self.id}'
+
+
+class FakeVoiceChannel:
+    def __init__(self, guild: 'FakeGuild', speed: float = 1.0):
+        self.id = next(_ids)
+        self.guild = guild
+        self.speed = speed
+        self.voice_states = {}
+
+    async def connect(self, **kwargs) -> FakeVoiceClient:
+        self.guild.voice_client = FakeVoiceClient(self, self.speed)
+        self.voice_states[self.guild.me.id] = None
+        return self.guild.voice_client
+
+    @property
+    def members(self) -> list:
+        return [member for member in (self.guild.member, self.guild.me) if member.id in self.voice_states]
+
+
+class FakeMember:
+    __slots__ = ('id', 'name', 'bot', 'voice')
+
+    def __init__(self, name: str = 'listener', voice_channel: FakeVoiceChannel = None, bot: bool = False):
+        self.id = next(_ids)
+        self.name = name
+        self.bot = bot
+        self.voice = type('VoiceState', (), {'channel': voice_channel})() if voice_channel else None
+
+    @property
+    def mention(self) -> str:
+        return f'<@{self.id}>'
+
+    def __str__(self):
+        return self.name
+
+
+class FakeGuild:
+    """
+    Guild with one text channel, one voice channel and a listener in it.
+    """
+
+    def __init__(self, guild_id: int = None, speed: float = 1.0):
+        self.id = guild_id or next(_ids)
+        self.name = f'guild-{self.id}'
+        self.me = FakeMember('bot', bot=True)
+        self.voice_client = None
+        self.text_channel = FakeChannel(self)
+        self.voice_channel = FakeVoiceChannel(self, speed)
+        self.member = FakeMember(voice_channel=self.voice_channel)
+        self.voice_channel.voice_states[self.member.id] = None
+
+    def __str__(self):
+        return self.name
+
+    def get_channel(self, channel_id: int):
+        return next((channel for channel in (self.text_channel, self.voice_channel) if channel.id == channel_id), None)
+
+    def get_member(self, user_id: int) -> FakeMember or None:
+        return next((member for member in (self.member, self.me) if member.id == user_id), None)
+
+
+class FakeBot:
+    """
+    What the players and cogs use of commands.Bot.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.owner_id = None
+        self.owner_ids = set()
+        self.all_commands = {}
+
+    async def is_owner(self, user) -> bool:
+        return False
+
+
+class FakeContext:
+    """
+    Invocation context of a command sent by the guild's listener in its text channel.
+    """
+
+    def __init__(self, bot: FakeBot, guild: FakeGuild, cog=None):
+        self.bot = bot
+        self.guild = guild
+        self.cog = cog
+        self.channel = guild.text_channel
+        self.author = guild.member
+        self.message = type('Message', (), {'author': guild.member})()
+        self.command = None
+
+    @property
+    def voice_client(self) -> FakeVoiceClient or None:
+        return self.guild.voice_client
+
+    async def typing(self):
+        pass
+
+    async def send(self, content: str = None, **kwargs) -> FakeMessage:
+        return await self.channel.send(content, **kwargs)
+
+    async def invoke(self, command, *args, **kwargs):
+        """
+        Run the command's callback directly, skipping checks and cooldowns.
+        """
+        invoked, self.command = self.command, command
+        try:
+            return await command.callback(self.cog, self, *args, **kwargs)
+        finally:
+            self.command = invoked
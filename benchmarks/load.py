@@ -0,0 +1,247 @@
+"""
+Capacity of one bot process: many guilds issuing a mix of music commands against the fake extractor
+and fake voice clients of benchmarks.fakes.
+
+    python -m benchmarks.load [--steps 100,250,500,1000] [--duration S] [--rate N] [--mix play=35,...]
+                              [--latency S] [--catalog N] [--slo S]
+
+Every step runs its amount of guilds for `duration` seconds, each guild sending commands at random
+(Poisson) intervals averaging `rate` per minute. Songs are drawn log-uniformly from a catalog of `catalog`
+videos, so popular ones hit the caches. Voice clients play at real-time pace, one thread each like discord.py.
+
+A step is saturated once less than 95% of its commands are answered by 10 seconds after its end,
+its p99 command latency is above `slo` or the event loop lags by more than 100 ms at p99.
+The fake voice client does not encode and there is no ffmpeg, add the per-stream CPU of a real deployment
+(musicbot_cpu_seconds encoder + ffmpeg over audio) to the CPU per playing guild.
+
+~play and playlist links count as answered once the song is queued or starts playing,
+the command itself stays pending until the song ends.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import core.music_player
+import general
+from benchmarks.fakes import FakeBot, FakeContext, FakeExtractor, FakeGuild, fake_source_factory, isolated_storage
+from benchmarks.pipeline import percentile, release
+from bot_cogs.music import Music
+from core import utils
+from core.metrics import metrics, Histogram
+from core.watchdog import LoopWatchdog
+
+DEFAULT_MIX = 'play=35,queue=20,skip=10,delete=10,shuffle=5,playlist=5,np=15'
+PLAYLIST_LENGTHS = (20, 100, 300)
+MAX_LOOP_LAG = 0.1  # Seconds of p99 event loop lag considered saturated
+MIN_COMPLETED = 0.95  # Share of offered commands a healthy step completes
+DRAIN = 10  # Seconds commands still running at the end of a step get to complete
+
+
+class Simulation:
+    """
+    One step: `guild_count` guilds sending commands for `duration` seconds.
+    """
+
+    def __init__(self, bot: FakeBot, cog: Music, guild_count: int, args):
+        self.bot = bot
+        self.cog = cog
+        self.guild_count = guild_count
+        self.args = args
+        self.mix = {name: int(weight) for name, weight in (pair.split('=') for pair in args.mix.split(','))}
+        self.latencies = {name: [] for name in self.mix}
+        self.issued = 0
+        self.errors = {}  # exception type name -> count
+        self.playing = []  # Samples of the amount of playing guilds
+        self._next_playlist = 10 ** 7
+
+    def pick_video(self) -> str:
+        # Log-uniform, a few songs are requested much more often than the rest
+        return FakeExtractor.video_url(int(self.args.catalog ** random.random()) - 1)
+
+    def pick_playlist(self) -> str:
+        entries = random.choice(PLAYLIST_LENGTHS)
+        self._next_playlist += entries
+        return FakeExtractor.playlist_url(entries, first=self._next_playlist - entries)
+
+    def invoke(self, ctx: FakeContext, name: str):
+        cog = self.cog
+        player = general.guild_to_audioplayer.get(ctx.guild.id)
+        queued = len(player.playlist) if player is not None else 0
+        if name == 'play':
+            return ctx.invoke(cog._play, search=self.pick_video())
+        if name == 'playlist':
+            return ctx.invoke(cog._play, search=self.pick_playlist())
+        if name == 'queue':
+            return ctx.invoke(cog._queue_info)
+        if name == 'skip':
+            return ctx.invoke(cog._skip)
+        if name == 'delete':
+            return ctx.invoke(cog._delete, position=random.randint(1, max(queued, 1)))
+        if name == 'shuffle':
+            return ctx.invoke(cog._shuffle)
+        if name == 'np':
+            return ctx.invoke(cog._now_playing)
+        raise ValueError(f'Unknown command {name}')
+
+    def _finished(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            name = type(task.exception()).__name__
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    async def timed(self, ctx: FakeContext, name: str):
+        start = time.perf_counter()
+        task = asyncio.create_task(self.invoke(ctx, name))
+        task.add_done_callback(self._finished)
+        if name in ('play', 'playlist'):
+            started = asyncio.create_task(ctx.voice_client.wait_play())
+            try:
+                await asyncio.wait((task, started), return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                started.cancel()
+        else:
+            await asyncio.wait((task,))
+        if task.done() and not task.cancelled() and task.exception() is not None:
+            return
+        self.latencies[name].append(time.perf_counter() - start)
+
+    async def session(self, guild: FakeGuild, stop_at: float):
+        ctx = FakeContext(self.bot, guild, self.cog)
+        await guild.voice_channel.connect()
+        names, weights = zip(*self.mix.items())
+        rate = self.args.rate / 60
+        commands = []
+        # Guilds do not start in lockstep
+        await asyncio.sleep(random.uniform(0, 1 / rate))
+        while time.perf_counter() < stop_at:
+            self.issued += 1
+            commands.append(asyncio.create_task(self.timed(ctx, random.choices(names, weights)[0])))
+            await asyncio.sleep(min(random.expovariate(rate), max(0.0, stop_at - time.perf_counter())))
+        return commands
+
+    async def sample_playing(self, guilds: list, stop_at: float):
+        while time.perf_counter() < stop_at:
+            self.playing.append(sum(1 for guild in guilds
+                                    if guild.voice_client is not None and guild.voice_client.is_playing()))
+            await asyncio.sleep(0.5)
+
+    async def run(self) -> dict:
+        metrics.lag = Histogram(metrics.lag.name, metrics.lag.help, metrics.lag.buckets)
+        guilds = [FakeGuild() for _ in range(self.guild_count)]
+        rss_before = utils.process_rss()
+        cpu_before = time.process_time()
+        start = time.perf_counter()
+        stop_at = start + self.args.duration
+        sampler = asyncio.create_task(self.sample_playing(guilds, stop_at))
+        sessions = await asyncio.gather(*(self.session(guild, stop_at) for guild in guilds))
+        elapsed = time.perf_counter() - start
+        cpu = (time.process_time() - cpu_before) / elapsed
+        rss_after = utils.process_rss()
+        await sampler
+        playing = statistics.mean(self.playing) if self.playing else 0
+        commands = [command for session in sessions for command in session]
+        # Commands not answered after the drain count as not completed
+        await asyncio.wait(commands, timeout=DRAIN)
+
+        for command in commands:
+            command.cancel()
+        await asyncio.gather(*(release(guild) for guild in guilds))
+
+        latencies = [value for values in self.latencies.values() for value in values]
+        return {
+            'guilds': self.guild_count,
+            'offered': self.issued / elapsed,
+            'completed': len(latencies) / elapsed,
+            'completed_share': len(latencies) / self.issued if self.issued else 1.0,
+            'errors': self.errors,
+            'p50': statistics.median(latencies) if latencies else None,
+            'p99': percentile(latencies, 0.99) if latencies else None,
+            'by_command': {name: (len(values), statistics.median(values), percentile(values, 0.99))
+                           for name, values in self.latencies.items() if values},
+            'playing': playing,
+            'cpu_per_playing': cpu / playing if playing else None,
+            'rss_per_playing': (rss_after - rss_before) / playing if playing and rss_before and rss_after else None,
+            'loop_lag_p99': metrics.lag.quantile(0.99),
+        }
+
+
+def saturation(step: dict, slo: float) -> str or None:
+    """
+    Why the step counts as saturated, None if it does not.
+    """
+    if step['completed_share'] < MIN_COMPLETED:
+        return f'{step["completed_share"]:.0%} of commands completed'
+    if step['p99'] is None or step['p99'] > slo:
+        return f'p99 latency above {slo * 1000:.0f} ms'
+    if step['loop_lag_p99'] is not None and step['loop_lag_p99'] > MAX_LOOP_LAG:
+        return f'event loop lag p99 above {MAX_LOOP_LAG * 1000:.0f} ms'
+    return None
+
+
+def ms(value: float or None) -> str:
+    return f'{value * 1000:.0f}' if value is not None else '-'
+
+
+async def run(args) -> list:
+    core.music_player.create_source = fake_source_factory(args.startup)
+    bot = FakeBot()
+    cog = Music(bot)
+    watchdog = LoopWatchdog(threshold=1, interval=0.05)
+    watchdog.start(asyncio.get_running_loop())
+    print(f'{"guilds":>7}{"offered/s":>11}{"done/s":>9}{"p50 ms":>9}{"p99 ms":>9}{"playing":>9}'
+          f'{"CPU %/g":>9}{"RSS KB/g":>10}{"lag ms":>8}')
+    steps = []
+    for guild_count in map(int, args.steps.split(',')):
+        step = await Simulation(bot, cog, guild_count, args).run()
+        steps.append(step)
+        print(f'{step["guilds"]:>7}{step["offered"]:>11.1f}{step["completed"]:>9.1f}{ms(step["p50"]):>9}'
+              f'{ms(step["p99"]):>9}{step["playing"]:>9.0f}'
+              f'{(step["cpu_per_playing"] or 0) * 100:>9.2f}{(step["rss_per_playing"] or 0) / 1024:>10.0f}'
+              f'{ms(step["loop_lag_p99"]):>8}')
+        if saturation(step, args.slo) and not args.keep_going:
+            break
+    watchdog.stop()
+    return steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate many guilds to find the capacity of one bot process.')
+    parser.add_argument('--steps', default='100,250,500,1000', help='comma separated guild counts to run')
+    parser.add_argument('--duration', type=float, default=20, help='seconds per step')
+    parser.add_argument('--rate', type=float, default=4, help='commands per guild per minute')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='command weights')
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds per fake extract_info call')
+    parser.add_argument('--startup', type=float, default=0.05, help='seconds to the first frame of a fake ffmpeg')
+    parser.add_argument('--catalog', type=int, default=5000, help='distinct songs requested')
+    parser.add_argument('--slo', type=float, default=2.0, help='acceptable p99 command latency in seconds')
+    parser.add_argument('--keep-going', action='store_true', help='run every step even after saturation')
+    args = parser.parse_args()
+
+    extractor = FakeExtractor(latency=args.latency)
+    with isolated_storage(), extractor.installed():
+        steps = asyncio.run(run(args))
+
+    last = steps[-1]
+    print(f'\nPer command at {last["guilds"]} guilds: count, p50 ms, p99 ms')
+    for name, (count, p50, p99) in sorted(last['by_command'].items()):
+        print(f'  {name:<10}{count:>7}{ms(p50):>9}{ms(p99):>9}')
+    for name, count in sorted(last['errors'].items()):
+        print(f'  {count} failed with {name}')
+
+    healthy = None
+    for step in steps:
+        reason = saturation(step, args.slo)
+        if reason is not None:
+            print(f'\nSaturation starts at {step["guilds"]} guilds: {reason}')
+            break
+        healthy = step
+    else:
+        print(f'\nNot saturated up to {steps[-1]["guilds"]} guilds')
+    if healthy is not None:
+        print(f'Largest healthy step: {healthy["guilds"]} guilds, {healthy["completed"]:.1f} commands/s, '
+              f'{healthy["playing"]:.0f} playing')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+"""
+End-to-end playback pipeline offline: Music cog -> MusicPlayer -> resolver -> voice client.
+
+yt-dlp is replaced by a fake extractor with fixed latency and the voice client by a fake one
+playing silence at `speed` times real time, so only the bot's own overhead varies between runs.
+
+    python -m benchmarks.pipeline [--latency S] [--startup S] [--speed X] [--runs N] [--entries N]
+                                  [--queue N] [--guilds N] [--only first_frame,playlist,queue,memory]
+
+Reports ~play to first frame latency (cold and cached), playlist ingestion throughput,
+the cost of queue commands on a long queue and memory per guild.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from config import MAX_PLAYLIST_LEN
+import core.music_player
+import general
+from benchmarks.fakes import FakeBot, FakeContext, FakeExtractor, FakeGuild, FakeMember, FakeVoiceClient, \
+    fake_source_factory, isolated_storage
+from bot_cogs.music import Music
+from core import utils
+from core.outbox import outboxes
+from core.settings import settings_store
+from core.track import Track
+
+# Referenced by every player without belonging to one
+SHARED = (FakeBot, FakeGuild, FakeMember, FakeVoiceClient, asyncio.Task, asyncio.AbstractEventLoop)
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def fake_track(video_id: int, requester, duration: float = 180) -> Track:
+    return Track(url=f'https://rr1.fake.invalid/videoplayback?expire={int(time.time()) + 6 * 3600}&id={video_id}',
+                 codec='opus', requester=requester, uploader='Fake uploader', title=f'Fake song {video_id}',
+                 duration=duration, webpage_url=FakeExtractor.video_url(video_id),
+                 thumbnail=f'https://i.fake.invalid/{video_id}.jpg')
+
+
+async def until(condition, timeout: float = 60):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise asyncio.TimeoutError
+        await asyncio.sleep(0.001)
+
+
+async def release(guild: FakeGuild, task: asyncio.Task = None):
+    """
+    Stop playback and drop the guild's player.
+    """
+    player = general.guild_to_audioplayer.pop(guild.id, None)
+    if player is not None:
+        if guild.voice_client is not None:
+            await player.stop_player()
+        player.close()
+    if guild.voice_client is not None:
+        await guild.voice_client.disconnect()
+    if task is not None:
+        try:
+            await asyncio.wait_for(task, 5)
+        except asyncio.TimeoutError:
+            task.cancel()
+
+
+async def play_to_first_frame(bot: FakeBot, cog: Music, search: str, speed: float) -> float:
+    guild = FakeGuild(speed=speed)
+    ctx = FakeContext(bot, guild, cog)
+    start = time.perf_counter()
+    task = asyncio.create_task(ctx.invoke(cog._play, search=search))
+    await until(lambda: guild.voice_client is not None)
+    await asyncio.wait_for(guild.voice_client.started.wait(), 60)
+    elapsed = guild.voice_client.first_frame_at - start
+    await release(guild, task)
+    return elapsed
+
+
+async def bench_first_frame(bot: FakeBot, cog: Music, runs: int, speed: float) -> dict:
+    results = {'cold': [], 'cached': []}
+    for i in range(runs):
+        # First request of a song goes through the extractor, the second one is served from the stream cache
+        results['cold'].append(await play_to_first_frame(bot, cog, FakeExtractor.video_url(i), speed))
+        results['cached'].append(await play_to_first_frame(bot, cog, FakeExtractor.video_url(i), speed))
+    return results
+
+
+async def bench_playlist(bot: FakeBot, cog: Music, entries: int, speed: float) -> tuple:
+    """
+    Seconds to the first frame and to the whole first window being queued.
+    """
+    guild = FakeGuild(speed=speed)
+    ctx = FakeContext(bot, guild, cog)
+    expected = min(entries, MAX_PLAYLIST_LEN)
+    ingested = None
+
+    def done() -> bool:
+        nonlocal ingested
+        player = general.guild_to_audioplayer.get(guild.id)
+        if ingested is None and player is not None \
+                and len(player.playlist) + len(player.playlist.play_history) >= expected:
+            ingested = time.perf_counter() - start
+        return ingested is not None and guild.voice_client is not None and guild.voice_client.started.is_set()
+
+    start = time.perf_counter()
+    task = asyncio.create_task(ctx.invoke(cog._play, search=FakeExtractor.playlist_url(entries, first=10 ** 6)))
+    await until(done)
+    first_frame = guild.voice_client.first_frame_at - start
+    await release(guild, task)
+    return first_frame, ingested, expected
+
+
+async def bench_queue(bot: FakeBot, cog: Music, queue_size: int, operations: int) -> dict:
+    """
+    Microseconds per command on a queue of `queue_size` songs.
+    """
+    guild = FakeGuild(speed=1)
+    ctx = FakeContext(bot, guild, cog)
+    await guild.voice_channel.connect()
+    player = general.get_player(bot, guild)
+    player.channel = ctx.channel
+    for i in range(queue_size):
+        player.playlist.add(fake_track(i, guild.member))
+    random.seed(0)
+    next_id = queue_size
+
+    def refill():
+        nonlocal next_id
+        while len(player.playlist) < queue_size:
+            player.playlist.add(fake_track(next_id, guild.member))
+            next_id += 1
+
+    commands = {
+        'queue': lambda: ctx.invoke(cog._queue_info),
+        'queue (last page)': lambda: ctx.invoke(cog._queue_info, player.playlist.pages),
+        'delete': lambda: ctx.invoke(cog._delete, position=random.randint(1, len(player.playlist))),
+        'move': lambda: ctx.invoke(cog._move, random.randint(1, len(player.playlist)),
+                                   random.randint(1, len(player.playlist))),
+        'queued': lambda: ctx.invoke(cog._queued, url=FakeExtractor.video_url(random.randrange(next_id))),
+        'shuffle': lambda: ctx.invoke(cog._shuffle),
+    }
+    results = {}
+    for name, command in commands.items():
+        elapsed = 0.0
+        for _ in range(operations):
+            refill()
+            start = time.perf_counter()
+            await command()
+            elapsed += time.perf_counter() - start
+        results[name] = elapsed / operations * 1e6
+
+    start = time.perf_counter()
+    for i in range(operations):
+        player.playlist.add(fake_track(next_id + i, guild.member))
+    results['add (playlist)'] = (time.perf_counter() - start) / operations * 1e6
+    await release(guild)
+    return results
+
+
+async def bench_memory(bot: FakeBot, guild_count: int, queue_size: int) -> dict:
+    """
+    Players of `guild_count` guilds with `queue_size` songs queued each.
+    """
+    rss_before = utils.process_rss()
+    guilds = [FakeGuild() for _ in range(guild_count)]
+    for guild in guilds:
+        player = general.get_player(bot, guild)
+        for i in range(queue_size):
+            player.playlist.add(fake_track(i, guild.member))
+    rss_after = utils.process_rss()
+    player_bytes = sum(utils.deep_sizeof(general.guild_to_audioplayer[guild.id], exclude=SHARED) for guild in guilds)
+
+    start = time.perf_counter()
+    settings_store.flush()
+    flush = time.perf_counter() - start
+    for guild in guilds:
+        await release(guild)
+    return {
+        'player_bytes': player_bytes // guild_count,
+        'rss_bytes': (rss_after - rss_before) // guild_count if rss_before and rss_after else None,
+        'settings_flush': flush,
+    }
+
+
+async def run(args):
+    core.music_player.create_source = fake_source_factory(args.startup)
+    bot = FakeBot()
+    cog = Music(bot)
+    only = set(args.only.split(',')) if args.only else None
+    print(f'extractor latency {args.latency * 1000:.0f} ms, ffmpeg startup {args.startup * 1000:.0f} ms, '
+          f'playback x{args.speed:g}')
+
+    if not only or 'first_frame' in only:
+        results = await bench_first_frame(bot, cog, args.runs, args.speed)
+        print(f'\n~play to first frame, {args.runs} runs, ms')
+        print(f'{"":<10}{"p50":>10}{"p95":>10}{"max":>10}')
+        for name, values in results.items():
+            print(f'{name:<10}{statistics.median(values) * 1000:>10.1f}'
+                  f'{percentile(values, 0.95) * 1000:>10.1f}{max(values) * 1000:>10.1f}')
+
+    if not only or 'playlist' in only:
+        first_frame, ingested, queued = await bench_playlist(bot, cog, args.entries, args.speed)
+        print(f'\nPlaylist of {args.entries} entries')
+        print(f'  {"first frame:":<16}{first_frame * 1000:>10.1f} ms')
+        print(f'  {f"{queued} queued:":<16}{ingested * 1000:>10.1f} ms  ({queued / ingested:.0f} entries/s)')
+
+    if not only or 'queue' in only:
+        results = await bench_queue(bot, cog, args.queue, 200)
+        print(f'\nQueue commands on {args.queue} songs, us/op')
+        for name, value in results.items():
+            print(f'  {name:<20}{value:>10.1f}')
+
+    if not only or 'memory' in only:
+        results = await bench_memory(bot, args.guilds, args.queue // 10)
+        print(f'\nMemory of {args.guilds} guilds with {args.queue // 10} queued songs each')
+        print(f'  player:         {results["player_bytes"]:>10} bytes/guild')
+        if results['rss_bytes'] is not None:
+            print(f'  RSS growth:     {results["rss_bytes"]:>10} bytes/guild')
+        print(f'  settings flush: {results["settings_flush"] * 1000:>10.1f} ms')
+
+    # Let the outboxes send and delete what the commands posted
+    await until(lambda: outboxes.stats()['channels'] == 0, timeout=120)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline end-to-end benchmark of the playback pipeline.')
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds per fake extract_info call')
+    parser.add_argument('--entry-latency', type=float, default=0.002, help='seconds per fake playlist entry')
+    parser.add_argument('--startup', type=float, default=0.05, help='seconds to the first frame of a fake ffmpeg')
+    parser.add_argument('--speed', type=float, default=20, help='playback speed, 1 for real time')
+    parser.add_argument('--runs', type=int, default=20, help='~play runs')
+    parser.add_argument('--entries', type=int, default=200, help='playlist length')
+    parser.add_argument('--queue', type=int, default=5000, help='queue length for the queue commands')
+    parser.add_argument('--guilds', type=int, default=1000, help='guilds for the memory report')
+    parser.add_argument('--only', help='comma separated sections: first_frame,playlist,queue,memory')
+    args = parser.parse_args()
+
+    extractor = FakeExtractor(latency=args.latency, entry_latency=args.entry_latency)
+    with isolated_storage(), extractor.installed():
+        asyncio.run(run(args))
+    print(f'\n{extractor.calls} extract_info calls')
+
+
+if __name__ == '__main__':
+    main()
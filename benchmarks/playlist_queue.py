@@ -0,0 +1,66 @@
+"""
+Queue operations on large playlists: deque vs TrackQueue.
+
+    python -m benchmarks.playlist_queue [entries] [operations]
+"""
+import random
+import sys
+import time
+from collections import deque
+from itertools import islice
+
+from core.track_queue import TrackQueue
+
+PAGE = 15
+
+
+def deque_move(queue: deque, src: int, dst: int):
+    value = queue[src]
+    del queue[src]
+    queue.insert(dst, value)
+
+
+OPERATIONS = {
+    'delete(pos)': (lambda q, n: q.__delitem__(random.randrange(n)), lambda q, n: q.__delitem__(random.randrange(n))),
+    'insert(1)': (lambda q, n: q.insert(1, n), lambda q, n: q.insert(1, n)),
+    'move(a, b)': (lambda q, n: deque_move(q, random.randrange(n), random.randrange(n)),
+                   lambda q, n: q.move(random.randrange(n), random.randrange(n))),
+    'page(last)': (lambda q, n: list(islice(q, n - PAGE, n)), lambda q, n: list(q.slice(n - PAGE, n))),
+    'getitem(mid)': (lambda q, n: q[n // 2], lambda q, n: q[n // 2]),
+}
+
+
+def bench(factory, operation, entries: int, operations: int) -> float:
+    random.seed(0)
+    queue = factory(range(entries))
+    start = time.perf_counter()
+    for _ in range(operations):
+        # Keep the size roughly constant
+        if len(queue) < entries:
+            queue.append(len(queue))
+        operation(queue, len(queue))
+    return time.perf_counter() - start
+
+
+def bench_shuffle(factory, shuffle, entries: int, repeats: int = 10) -> float:
+    queue = factory(range(entries))
+    start = time.perf_counter()
+    for _ in range(repeats):
+        shuffle(queue)
+    return (time.perf_counter() - start) / repeats
+
+
+def main(entries: int = 10000, operations: int = 2000):
+    print(f'{entries} entries, {operations} operations each, us/op')
+    print(f'{"operation":<15}{"deque":>12}{"TrackQueue":>12}')
+    for name, (deque_op, queue_op) in OPERATIONS.items():
+        d = bench(deque, deque_op, entries, operations) / operations * 1e6
+        t = bench(TrackQueue, queue_op, entries, operations) / operations * 1e6
+        print(f'{name:<15}{d:>12.2f}{t:>12.2f}')
+    d = bench_shuffle(deque, random.shuffle, entries) * 1e6
+    t = bench_shuffle(TrackQueue, TrackQueue.shuffle, entries) * 1e6
+    print(f'{"shuffle":<15}{d:>12.2f}{t:>12.2f}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:3]))
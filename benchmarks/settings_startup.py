@@ -0,0 +1,79 @@
+"""
+Startup cost of guild settings with thousands of synthetic guilds.
+
+Compares the indexed store with the previous approach
+(parse the whole file and scan every entry once per guild).
+
+    python -m benchmarks.settings_startup [guilds]
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+from core.settings import Settings, SettingsStore
+
+
+class FakeGuild:
+    __slots__ = ('id', 'name')
+
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.name = f'guild-{guild_id}'
+
+
+def write_settings(path: str, guilds: list, known: float = 0.9):
+    """
+    Settings file where `known` share of the guilds already has an entry.
+    """
+    data = {str(guild.id): {'id': guild.id, 'timeout': 300} for guild in guilds[:int(len(guilds) * known)]}
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+
+def bench_legacy(path: str, guilds: list) -> float:
+    start = time.perf_counter()
+    for guild in guilds:
+        with open(path, 'r') as f:
+            json_data = json.load(f)
+        config = None
+        for key in json_data:
+            if json_data[key]['id'] == guild.id:
+                config = json_data[key]
+        if config is None:
+            json_data[guild.id] = {'id': guild.id, 'timeout': 300}
+            with open(path, 'w') as f:
+                json.dump(json_data, f, indent=2)
+    return time.perf_counter() - start
+
+
+def bench_store(path: str, guilds: list) -> float:
+    start = time.perf_counter()
+    store = SettingsStore(path)
+    store.load()
+    for guild in guilds:
+        Settings(guild, store)
+    store.flush()
+    return time.perf_counter() - start
+
+
+def main(guild_count: int = 5000):
+    guilds = [FakeGuild(10 ** 17 + i) for i in range(guild_count)]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'settings.json')
+
+        write_settings(path, guilds)
+        store = bench_store(path, guilds)
+
+        # The old approach is quadratic, keep it bounded
+        legacy_count = min(guild_count, 1000)
+        write_settings(path, guilds[:legacy_count])
+        legacy = bench_legacy(path, guilds[:legacy_count])
+
+    print(f'store:  {guild_count:6} guilds {store * 1000:10.2f} ms')
+    print(f'legacy: {legacy_count:6} guilds {legacy * 1000:10.2f} ms')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:2]))
@@ -0,0 +1,48 @@
+"""
+Fresh YoutubeDL per lookup vs pooled instances.
+
+Measures only the per-call setup cost, no network is used.
+
+    python -m benchmarks.ytdl_pool [iterations]
+"""
+import sys
+import time
+
+import yt_dlp
+
+from core.resolver import YTDL_PROFILES, YoutubeDLPool
+
+
+def bench_fresh(iterations: int) -> float:
+    start = time.perf_counter()
+    for i in range(iterations):
+        profile = list(YTDL_PROFILES)[i % len(YTDL_PROFILES)]
+        with yt_dlp.YoutubeDL(dict(YTDL_PROFILES[profile], playliststart=i)):
+            pass
+    return time.perf_counter() - start
+
+
+def bench_pooled(iterations: int) -> float:
+    pool = YoutubeDLPool()
+    pool.warm_up()
+    start = time.perf_counter()
+    for i in range(iterations):
+        profile = list(YTDL_PROFILES)[i % len(YTDL_PROFILES)]
+        with pool.checkout(profile, {'playliststart': i}):
+            pass
+    elapsed = time.perf_counter() - start
+    pool.close()
+    return elapsed
+
+
+def main(iterations: int = 200):
+    fresh = bench_fresh(iterations)
+    pooled = bench_pooled(iterations)
+    print(f'{iterations} lookups setup')
+    print(f'  fresh:  {fresh * 1000:10.2f} ms total  {fresh / iterations * 1e6:10.1f} us/op')
+    print(f'  pooled: {pooled * 1000:10.2f} ms total  {pooled / iterations * 1e6:10.1f} us/op')
+    print(f'  speedup: x{fresh / pooled:.1f}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:2]))
@@ -4,7 +4,8 @@ import discord
 from discord.ext import commands
 
 from config import CODE_BLOCK
-from core.helpers import correct_command_name
+from core.helpers import get_owner_id, suggest_commands
+from core.metrics import metrics
 
 
 class Errors(commands.Cog):
@@ -46,15 +47,17 @@ class Errors(commands.Cog):
                                      delete_after=error.retry_after)
         elif isinstance(error, commands.CommandNotFound):
             message = await ctx.send(*error.args, delete_after=10)
-            similar_command = await correct_command_name(self.bot, ctx, ctx.invoked_with)
-            if similar_command:
-                await ctx.send(f'Maybe you mean **`{similar_command}`** ?', delete_after=15)
+            similar_commands = await suggest_commands(self.bot, ctx, ctx.invoked_with)
+            if similar_commands:
+                await ctx.send(f'Maybe you mean {" or ".join(f"**`{name}`**" for name in similar_commands)} ?',
+                               delete_after=15)
         elif isinstance(error, commands.errors.BadArgument):
             pass
         else:
+            metrics.error('command')
             tb = traceback.format_exception(error, value=error, tb=error.__traceback__)
             traceback_fmt = ''.join(tb)
-            owner_id = self.bot.owner_id or (await self.bot.application_info()).owner.id
+            owner_id = await get_owner_id(self.bot)
             owner = self.bot.get_user(owner_id)
             await owner.send(f'{ctx.guild.id = }\n'
                              f'{ctx.guild.name = }\n\n'
@@ -3,8 +3,9 @@ import asyncio
 import discord
 from discord.ext import commands
 
-from core import utils
-from general import guild_to_audioplayer
+from core.outbox import outboxes
+from core.queue_view import QueueView
+from general import get_player, get_settings
 
 
 class Music(commands.Cog):
@@ -48,14 +49,14 @@ class Music(commands.Cog):
             except asyncio.TimeoutError:
                 await ctx.send(f'Connecting to channel: <#{channel.id}> timed out.')
 
-        await ctx.send(f'Connected to <#{channel.id}>', delete_after=10)
+        outboxes.post(ctx.channel, f'Connected to <#{channel.id}>', delete_after=10)
 
     @commands.command(name='leave', aliases=['disconnect', 'dc', 'off'])
     async def _leave(self, ctx: commands.Context):
         """Disconnect from Voice Channel."""
         if not ctx.voice_client:
-            return await ctx.send("I'm not not connected to any voice channel.", delete_after=20)
-        player = guild_to_audioplayer[ctx.guild]
+            return outboxes.post(ctx.channel, "I'm not not connected to any voice channel.", delete_after=20)
+        player = get_player(self.bot, ctx.guild)
         await player.stop_player()
         await ctx.voice_client.disconnect()
 
@@ -75,31 +76,31 @@ class Music(commands.Cog):
         if not ctx.voice_client:
             await ctx.invoke(self._join)
 
-        player = guild_to_audioplayer[ctx.guild]
+        player = get_player(self.bot, ctx.guild)
         player.channel = ctx.channel
 
-        player.timer.cancel()
-        player.timer = utils.Timer(player.timeout_handler)
+        player.reset_timeout()
 
         if player.playlist.loop:
-            await ctx.send("Loop is enabled!  :repeat:")
+            outboxes.post(ctx.channel, 'Loop is enabled!  :repeat:')
 
         await player.process_track(ctx, search)
 
     @commands.command(name='loop', aliases=['l'])
     async def _loop(self, ctx: commands.Context):
         """Repeat the currently playing song."""
-        player = guild_to_audioplayer[ctx.guild]
+        player = get_player(self.bot, ctx.guild)
         player.playlist.loop = not player.playlist.loop
-        await ctx.send(f'**`{ctx.author}`**: Loop {"enabled  :repeat:" if player.playlist.loop else "disabled  :x:"}')
+        state = 'enabled  :repeat:' if player.playlist.loop else 'disabled  :x:'
+        outboxes.post(ctx.channel, f'**`{ctx.author}`**: Loop {state}')
 
     @commands.cooldown(1, 60)
     @commands.command(name='shuffle')
     async def _shuffle(self, ctx):
         """Shuffle the playlist."""
-        player = guild_to_audioplayer[ctx.guild]
+        player = get_player(self.bot, ctx.guild)
         player.playlist.shuffle()
-        await ctx.send(f'**`{ctx.author}`**: Shuffled the queue.')
+        outboxes.post(ctx.channel, f'**`{ctx.author}`**: Shuffled the queue.')
 
     @commands.command(name='pause')
     async def _pause(self, ctx: commands.Context):
@@ -107,12 +108,12 @@ class Music(commands.Cog):
         vc = ctx.voice_client
 
         if not vc or not vc.is_playing():
-            return await ctx.send("I'm not currently playing anything.", delete_after=20)
+            return outboxes.post(ctx.channel, "I'm not currently playing anything.", delete_after=20)
         elif vc.is_paused():
             return
 
         vc.pause()
-        await ctx.send(f'**`{ctx.author}`**: Paused the song.')
+        outboxes.post(ctx.channel, f'**`{ctx.author}`**: Paused the song.')
 
     @commands.command(name='resume')
     async def _resume(self, ctx: commands.Context):
@@ -120,12 +121,12 @@ class Music(commands.Cog):
         vc = ctx.voice_client
 
         if not vc or not vc.is_connected():
-            return await ctx.send("I'm not currently connected to voice.", delete_after=20)
+            return outboxes.post(ctx.channel, "I'm not currently connected to voice.", delete_after=20)
         elif vc.is_playing():
             return
 
         vc.resume()
-        await ctx.send(f'**`{ctx.author}`**: Resumed the song.')
+        outboxes.post(ctx.channel, f'**`{ctx.author}`**: Resumed the song.')
 
     @commands.command(name='stop')
     async def _stop(self, ctx: commands.Context):
@@ -137,10 +138,10 @@ class Music(commands.Cog):
         vc = ctx.voice_client
 
         if not vc or not vc.is_connected():
-            return await ctx.send("I'm not currently playing anything.", delete_after=20)
-        player = guild_to_audioplayer[ctx.guild]
+            return outboxes.post(ctx.channel, "I'm not currently playing anything.", delete_after=20)
+        player = get_player(self.bot, ctx.guild)
         await player.stop_player()
-        await ctx.send(f'**`{ctx.author}`**: Stopped the player.')
+        outboxes.post(ctx.channel, f'**`{ctx.author}`**: Stopped the player.')
 
     @commands.cooldown(1, 5)
     @commands.command(name='skip', aliases=['next'])
@@ -152,21 +153,20 @@ class Music(commands.Cog):
         vc = ctx.voice_client
 
         if not vc or not vc.is_connected():
-            return await ctx.send("I'm not currently connected to voice.", delete_after=20)
+            return outboxes.post(ctx.channel, "I'm not currently connected to voice.", delete_after=20)
 
         if vc.is_paused():
             pass
         elif not vc.is_playing():
             return
 
-        player = guild_to_audioplayer[ctx.guild]
+        player = get_player(self.bot, ctx.guild)
         player.playlist.loop = False
 
-        player.timer.cancel()
-        player.timer = utils.Timer(player.timeout_handler)
+        player.reset_timeout()
 
         vc.stop()
-        await ctx.send(f'**`{ctx.author}`**: Skipped the song.')
+        outboxes.post(ctx.channel, f'**`{ctx.author}`**: Skipped the song.')
 
     @commands.command(name='queue', aliases=['q', 'playlist'])
     async def _queue_info(self, ctx: commands.Context, page_num: int = None):
@@ -179,23 +179,25 @@ class Music(commands.Cog):
         """
         vc = ctx.voice_client
         if not vc or not vc.is_connected():
-            return await ctx.send("I'm not currently connected to voice.", delete_after=20)
+            return outboxes.post(ctx.channel, "I'm not currently connected to voice.", delete_after=20)
 
-        player = guild_to_audioplayer[ctx.guild]
+        player = get_player(self.bot, ctx.guild)
+        if player.queue_view is not None:
+            player.queue_view.stop()
 
-        embed = player.playlist.create_embed(title='Playlist', page_num=page_num)
-
-        if embed is None:
+        view = QueueView(player.playlist, title='Playlist', page=(page_num or 1) - 1)
+        if await view.send(ctx) is None:
+            player.queue_view = None
             return await ctx.send('There are currently no more queued songs.')
-        await ctx.send(embed=embed)
+        player.queue_view = view
 
     @commands.command(name='clear')
     async def _clear(self, ctx: commands.Context):
         """Clear the current playlist."""
-        player = guild_to_audioplayer[ctx.guild]
+        player = get_player(self.bot, ctx.guild)
         player.playlist.clear()
 
-        await ctx.send(f'**`{ctx.author}`**: Cleared the queue.')
+        outboxes.post(ctx.channel, f'**`{ctx.author}`**: Cleared the queue.')
         # # ToDo: Do I need to stop now playing track?
         # ctx.guild.voice_client.stop()
         # player.playlist.loop = False
@@ -205,13 +207,12 @@ class Music(commands.Cog):
         """Play the last song."""
         vc = ctx.voice_client
         if not vc or not vc.is_connected():
-            return await ctx.send("I'm not currently connected to voice.", delete_after=20)
+            return outboxes.post(ctx.channel, "I'm not currently connected to voice.", delete_after=20)
 
-        player = guild_to_audioplayer[ctx.guild]
+        player = get_player(self.bot, ctx.guild)
         player.playlist.loop = False
 
-        player.timer.cancel()
-        player.timer = utils.Timer(player.timeout_handler)
+        player.reset_timeout()
 
         await player.prev_track()
         await ctx.send('Playing previous song.')
@@ -222,24 +223,21 @@ class Music(commands.Cog):
         vc = ctx.voice_client
 
         if not vc or not vc.is_connected():
-            return await ctx.send("I'm not currently connected to voice.", delete_after=20)
+            return outboxes.post(ctx.channel, "I'm not currently connected to voice.", delete_after=20)
 
-        player = guild_to_audioplayer[ctx.guild]
+        player = get_player(self.bot, ctx.guild)
         if not player.current_track:
-            return await ctx.send("I'm not currently playing anything.", delete_after=20)
-
-        try:
-            # Remove "Now Playing" message of the song that ended
-            await player.np_message.delete()
-        except discord.HTTPException:
-            pass
+            return outboxes.post(ctx.channel, "I'm not currently playing anything.", delete_after=20)
 
+        if player.np_message is not None:
+            # Remove the previous "Now Playing" message
+            outboxes.delete_later(player.np_message)
         player.np_message = await ctx.send(embed=player.current_track.create_embed())
 
     @commands.command(name='history', aliases=['h'])
     async def _history(self, ctx: commands.Context):
         """Retrieve a basic list of recently played songs."""
-        player = guild_to_audioplayer[ctx.guild]
+        player = get_player(self.bot, ctx.guild)
 
         embed = player.playlist.create_embed(title='Recently played')
 
@@ -256,7 +254,7 @@ class Music(commands.Cog):
         position: int [Required]
             Song index in the queue to remove.
         """
-        player = guild_to_audioplayer[ctx.guild]
+        player = get_player(self.bot, ctx.guild)
         playlist = player.playlist
         try:
             if len(playlist) == 0:
@@ -265,29 +263,142 @@ class Music(commands.Cog):
             position = position - 1
 
             if not 0 <= position < len(playlist):
-                await ctx.send(f'Please specify the correct index of a song to remove.', delete_after=15)
+                outboxes.post(ctx.channel, f'Please specify the correct index of a song to remove.', delete_after=15)
                 return
 
             removed_track = playlist.delete(position)
-            await ctx.send(f'**`{ctx.author}`**: Removed `{removed_track.info.title}`.')
+            outboxes.post(ctx.channel, f'**`{ctx.author}`**: Removed `{removed_track.info.title}`.')
         finally:
-            await ctx.invoke(self._queue_info)
+            view = player.queue_view
+            if view is not None and view.message is not None and not view.is_finished():
+                # Edit the queue message already on screen instead of sending a new one
+                await view.refresh()
+            else:
+                await ctx.invoke(self._queue_info)
+
+    @commands.command(name='move', aliases=['mv'])
+    async def _move(self, ctx: commands.Context, position: int, new_position: int):
+        """Move song to another place in the queue.
+
+        Parameters
+        -----------
+        position: int [Required]
+            Song index in the queue to move.
+        new_position: int [Required]
+            Index the song should end up at.
+        """
+        player = get_player(self.bot, ctx.guild)
+        playlist = player.playlist
+        if not 0 < position <= len(playlist) or not 0 < new_position <= len(playlist):
+            return outboxes.post(ctx.channel, 'Please specify the correct indexes of a song to move.', delete_after=15)
+
+        moved_track = playlist.move(position - 1, new_position - 1)
+        outboxes.post(ctx.channel, f'**`{ctx.author}`**: Moved `{moved_track.info.title}` to position {new_position}.')
+
+    @commands.command(name='jump', aliases=['skipto'])
+    async def _jump(self, ctx: commands.Context, position: int):
+        """Skip straight to the song by index, keeping the rest of the queue.
+
+        Parameters
+        -----------
+        position: int [Required]
+            Song index in the queue to play now.
+        """
+        vc = ctx.voice_client
+
+        if not vc or not vc.is_connected():
+            return outboxes.post(ctx.channel, "I'm not currently connected to voice.", delete_after=20)
+
+        player = get_player(self.bot, ctx.guild)
+        playlist = player.playlist
+        if not 0 < position <= len(playlist):
+            return outboxes.post(ctx.channel, 'Please specify the correct index of a song to jump to.',
+                                 delete_after=15)
+
+        track = playlist.jump(position - 1)
+        player.playlist.loop = False
+        player.reset_timeout()
+
+        outboxes.post(ctx.channel, f'**`{ctx.author}`**: Jumped to `{track.info.title}`.')
+        if vc.is_playing() or vc.is_paused():
+            vc.stop()
+        elif player.current_track is None:
+            # A track that is still starting plays first, the jumped one follows
+            await player.play_track(track)
+
+    @commands.command(name='removeuser', aliases=['rmuser'])
+    async def _remove_user(self, ctx: commands.Context, *, member: discord.Member = None):
+        """Remove every queued song of a user.
+
+        Parameters
+        -----------
+        member: discord.Member [Optional]
+            User whose songs to remove. Defaults to you.
+        """
+        member = member or ctx.author
+        player = get_player(self.bot, ctx.guild)
+
+        removed = player.playlist.remove_by_requester(member.id)
+        if not removed:
+            return outboxes.post(ctx.channel, f'`{member}` has no queued songs.', delete_after=15)
+        outboxes.post(ctx.channel, f'**`{ctx.author}`**: Removed {removed} song(s) of `{member}`.')
+
+    @commands.command(name='dedupe', aliases=['dedup'])
+    async def _dedupe(self, ctx: commands.Context):
+        """Remove repeated songs from the queue, keeping the first one."""
+        player = get_player(self.bot, ctx.guild)
+
+        removed = player.playlist.dedupe()
+        outboxes.post(ctx.channel, f'**`{ctx.author}`**: Removed {removed} duplicate(s).')
+
+    @commands.command(name='queued', aliases=['inqueue'])
+    async def _queued(self, ctx: commands.Context, *, url: str):
+        """Check whether a song is already in the queue.
+
+        Parameters
+        -----------
+        url: str [Required]
+            Link to the song.
+        """
+        player = get_player(self.bot, ctx.guild)
+
+        positions = player.playlist.positions_of(url.strip('<>'))
+        if not positions:
+            return outboxes.post(ctx.channel, 'This song is not queued.', delete_after=15)
+        outboxes.post(ctx.channel, f'Queued at position(s) {", ".join(str(pos + 1) for pos in positions)}.',
+                      delete_after=15)
+
+    @commands.command(name='skipdupes', aliases=['nodupes'])
+    async def _skip_duplicates(self, ctx: commands.Context):
+        """Toggle skipping of songs that are already queued."""
+        settings = get_settings(ctx.guild)
+        settings.config['skip_duplicates'] = not settings.config.get('skip_duplicates')
+        settings.store.mark_dirty(ctx.guild.id)
+
+        state = 'enabled' if settings.config['skip_duplicates'] else 'disabled'
+        outboxes.post(ctx.channel, f'**`{ctx.author}`**: Skipping of already queued songs {state}.')
+
+    @_move.error
+    @_jump.error
+    async def _move__error(self, ctx, error):
+        if isinstance(error, commands.errors.BadArgument):
+            outboxes.post(ctx.channel, 'Please specify the correct index of a song.', delete_after=15)
 
     @_delete.error
     async def _delete__error(self, ctx, error):
         if isinstance(error, commands.errors.BadArgument):
-            await ctx.send(f'Please specify the correct index of a song to remove.', delete_after=15)
+            outboxes.post(ctx.channel, f'Please specify the correct index of a song to remove.', delete_after=15)
 
     @_queue_info.error
     async def _queue_info__error(self, ctx, error):
         if isinstance(error, commands.errors.BadArgument):
-            await ctx.send('Nice try you rascal :knife:', delete_after=5)
+            outboxes.post(ctx.channel, 'Nice try you rascal :knife:', delete_after=5)
             await ctx.invoke(self._queue_info)
 
     @_history.error
     async def _history__error(self, ctx, error):
         if isinstance(error, commands.errors.BadArgument):
-            await ctx.send('Nice try you rascal :knife:', delete_after=5)
+            outboxes.post(ctx.channel, 'Nice try you rascal :knife:', delete_after=5)
             await ctx.invoke(self._history)
 
     @_join.before_invoke
@@ -295,7 +406,7 @@ class Music(commands.Cog):
     @_delete.before_invoke
     async def ensure_voice_state(self, ctx: commands.Context):
         if not ctx.author.voice or not ctx.author.voice.channel:
-            await ctx.send('You are not connected to any voice channel.', delete_after=20)
+            outboxes.post(ctx.channel, 'You are not connected to any voice channel.', delete_after=20)
             return
 
         if ctx.voice_client:
@@ -4,7 +4,10 @@ import discord
 from discord.ext import commands
 
 from config import CODE_BLOCK
-from core.helpers import correct_command_name
+from core.helpers import get_owner_id, suggest_commands
+from core.metrics import metrics
+from core.outbox import outboxes
+from general import memory_report
 
 
 class Utility(commands.Cog):
@@ -22,9 +25,10 @@ class Utility(commands.Cog):
         command = self.bot.get_command(cmd)
         if not command:
             await ctx.send('Can\'t find that command. Sorry.', delete_after=10)
-            similar_command = await correct_command_name(self.bot, ctx, cmd)
-            if similar_command:
-                await ctx.send(f'Maybe you mean **`{similar_command}`** ?', delete_after=15)
+            similar_commands = await suggest_commands(self.bot, ctx, cmd)
+            if similar_commands:
+                await ctx.send(f'Maybe you mean {" or ".join(f"**`{name}`**" for name in similar_commands)} ?',
+                               delete_after=15)
             return
         source_code = inspect.getsource(command.callback)
         # Output
@@ -51,14 +55,76 @@ class Utility(commands.Cog):
         await self.bot.change_presence(status=discord.Status.invisible)
         await self.bot.close()
 
+    @commands.command(name='memory', aliases=['mem'])
+    @commands.is_owner()
+    async def _memory(self, ctx: commands.Context):
+        """Show memory used by music players.
+
+        Owner only.
+        """
+        report = memory_report()
+        rss = f'{report["rss"] / 2 ** 20:.1f} MiB' if report['rss'] else 'n/a'
+        await ctx.send(f'{CODE_BLOCK}\n'
+                       f'Guilds:          {len(self.bot.guilds)}\n'
+                       f'Active players:  {report["players"]}\n'
+                       f'Loaded settings: {report["settings"]}\n'
+                       f'Asyncio tasks:   {report["tasks"]}\n'
+                       f'Idle deadlines:  {report["deadlines"]}\n'
+                       f'Per player:      {report["bytes_per_player"] / 1024:.1f} KiB\n'
+                       f'Process RSS:     {rss}\n'
+                       f'{CODE_BLOCK}')
+
+    @commands.command(name='outbox')
+    @commands.is_owner()
+    async def _outbox(self, ctx: commands.Context):
+        """Show outbound message queue statistics.
+
+        Owner only.
+        """
+        stats = outboxes.stats()
+        await ctx.send(f'{CODE_BLOCK}\n'
+                       f'Active channels: {stats["channels"]}\n'
+                       f'Queue depth:     {stats["depth"]}\n'
+                       f'Sent:            {stats["sent"]}\n'
+                       f'Merged:          {stats["merged"]}\n'
+                       f'Edited in place: {stats["edited"]}\n'
+                       f'Deleted:         {stats["deleted"]}\n'
+                       f'429 responses:   {stats["rate_limited"]}\n'
+                       f'{CODE_BLOCK}')
+
+    @commands.command(name='stats')
+    @commands.is_owner()
+    async def _stats(self, ctx: commands.Context):
+        """Show latency of playback stages and event counters.
+
+        Owner only.
+        """
+        lines = [f'{"stage":<18}{"count":>7}{"p50 ms":>9}{"p95 ms":>9}']
+        for labels in sorted(metrics.stages.series(), key=lambda labels: labels['stage']):
+            count = metrics.stages.count(**labels)
+            p50 = metrics.stages.quantile(0.5, **labels) or 0
+            p95 = metrics.stages.quantile(0.95, **labels) or 0
+            lines.append(f'{labels["stage"]:<18}{count:>7}{p50 * 1000:>9.0f}{p95 * 1000:>9.0f}')
+        if metrics.gaps.count():
+            lines.append(f'{"gap between songs":<18}{metrics.gaps.count():>7}'
+                         f'{metrics.gaps.quantile(0.5) * 1000:>9.0f}{metrics.gaps.quantile(0.95) * 1000:>9.0f}')
+        if metrics.lag.count():
+            lines.append(f'{"event loop lag":<18}{metrics.lag.count():>7}'
+                         f'{metrics.lag.quantile(0.5) * 1000:>9.1f}{metrics.lag.quantile(0.95) * 1000:>9.1f}')
+        lines.append('')
+        for counter in (metrics.events, metrics.errors):
+            for key, value in sorted(counter.items()):
+                lines.append(f'{" ".join(str(label) for _, label in key):<34}{value:>7}')
+        await ctx.send(f'{CODE_BLOCK}\n' + '\n'.join(lines)[:1980] + f'\n{CODE_BLOCK}')
+
     @commands.command(name='owner', aliases=['owners', 'ownership'])
     async def _owner(self, ctx: commands.Context):
         """Tag Bot's owner(s)."""
-        owner_id = self.bot.owner_id or (await self.bot.application_info()).owner.id
+        owner_id = await get_owner_id(self.bot)
         composed_msg = f'Creator: <@{owner_id}>\n'
         owner_ids = self.bot.owner_ids
         if owner_ids:
-            composed_msg += f'Owners: '
+            composed_msg += 'Owners: '
             for owner_id in owner_ids:
                 composed_msg += f'<@{owner_id}>\n'
         await ctx.send(composed_msg)
@@ -1,6 +1,61 @@
 BOT_CMD_PREFIX = '~'  # Bot command prefix (Alternative to mention)
 MAX_SONG_DURATION = 1.5 * 60 * 60  # Maximum song duration to play in seconds
-MAX_PLAYLIST_LEN = 50  # Maximum songs in YT playlist to enqueue
+MAX_PLAYLIST_LEN = 50  # Songs of a YT playlist to enqueue at once, the next ones follow when the queue runs low
+MAX_QUEUE_LEN = 5000  # Songs a guild can have queued
+PLAYLIST_SUMMARY_INTERVAL = 2  # Seconds between edits of the playlist progress message
 MAX_PRELOAD = 2  # Amount of song to preload
+PREFETCH_WORKERS = 4  # Simultaneous preloads across all guilds
+PREFETCH_MAX_LOOKAHEAD = 10  # Upper bound of adaptive preload window
+
+PLAYER_IDLE_TIMEOUT = 30 * 60  # Seconds before an unused, disconnected player is dropped from memory
+DEFAULT_TIMEOUT = 5 * 60  # Seconds of inactivity before leaving voice, unless the guild sets its own
+SCHEDULER_RESOLUTION = 1  # Precision of inactivity timeouts in seconds
+SCHEDULER_SLOTS = 512  # Timing wheel size, deadlines further than SLOTS * RESOLUTION take extra turns
+
+GAPLESS = True  # Start the next song's ffmpeg before the current one ends
+GAPLESS_PREWARM = 10  # Seconds before the end of a song to prepare the next one
+GAPLESS_BUFFER_FRAMES = 50  # 20ms audio frames of the next song to buffer in memory
+OPUS_PASSTHROUGH = True  # Send Opus streams as is instead of decoding and re-encoding them
+
+AUDIO_CACHE_BYTES = 0  # Disk budget of local copies of popular songs, 0 disables the cache
+AUDIO_CACHE_DIR = 'config/generated/audio_cache'  # Local copies location, relative to the project root
+AUDIO_CACHE_POLICY = 'lru'  # Which songs to evict first: 'lru' or 'lfu'
+AUDIO_CACHE_MIN_PLAYS = 3  # Plays of a song before it is stored locally
+
+RESOLVER_BACKEND = 'thread'  # yt-dlp worker pool type: 'thread' or 'process'
+RESOLVER_WORKERS = 4  # Maximum amount of simultaneous yt-dlp lookups
+RESOLVER_TIMEOUT = 30  # Seconds before a yt-dlp lookup is abandoned
+YTDL_POOL_SIZE = 4  # Idle YoutubeDL instances kept per option profile
+
+STREAM_CACHE_BYTES = 16 * 1024 * 1024  # Memory budget of resolved stream url cache
+STREAM_CACHE_TTL = 60 * 60  # Stream url lifetime in seconds if the url has no 'expire' param
+SEARCH_CACHE_BYTES = 2 * 1024 * 1024  # Memory budget of search query cache
+SEARCH_CACHE_TTL = 24 * 60 * 60  # Seconds a search query keeps pointing to the same video
+METADATA_DB_PATH = 'config/generated/metadata.sqlite3'  # Track metadata store, relative to the project root
+
+OUTBOX_COALESCE_WINDOW = 0.5  # Seconds to collect status messages of a channel into one
+OUTBOX_EDIT_WINDOW = 5  # Seconds a status message may still be extended by an edit instead of a new message
+OUTBOX_DELETE_SLACK = 2  # Seconds a deletion may be brought forward to join a bulk delete
+OUTBOX_BACKOFF = 10  # Seconds of slower coalescing in a channel after a rate limit hit
+
+SETTINGS_FLUSH_DELAY = 5  # Seconds to collect settings changes before writing them to disk
+
+JOURNAL_DIR = 'config/generated/journal'  # Queue journals restored after a restart, relative to the project root
+JOURNAL_COMPACT_RECORDS = 500  # Records appended to a guild's journal before it is rewritten as one snapshot
+JOURNAL_POSITION_INTERVAL = 10  # Seconds between playback position records, how far behind a resume can start
+JOURNAL_MAX_AGE = 60 * 60  # Seconds after which a journal is too old to restore
+RESUME_CONCURRENCY = 10  # Guilds reconnecting to voice or respawning an interrupted stream at once
+RESUME_ATTEMPTS = 3  # Respawns of an interrupted track without progress before it is skipped
+RESUME_JITTER = 3  # Seconds over which the resumes of many guilds interrupted together are spread
+RESUME_VOICE_TIMEOUT = 60  # Seconds to wait for a dropped voice connection before giving up on the track
+
+SHARD_PROCESSES = 0  # Bot processes started by launcher.py, 0 for one per CPU core
+SHARD_COUNT = 0  # Total shards split between the processes, 0 for Discord's recommendation
+SHARD_RESTART_DELAY = 10  # Seconds before the launcher restarts a crashed process
+
+METRICS_HOST = '127.0.0.1'  # Interface of the Prometheus endpoint
+METRICS_PORT = 0  # Port of the /metrics endpoint, 0 disables it. Shard processes add their first shard id
+LOOP_WATCHDOG_INTERVAL = 1  # Seconds between event loop lag measurements
+LOOP_STALL_THRESHOLD = 0.5  # Seconds of lag after which the blocked stack is logged, 0 disables the watchdog
 
 CODE_BLOCK = '```'  # Used to avoid formatting breaks in source command (thanks, Discord Markdown)
@@ -0,0 +1,175 @@
+import logging
+import os
+import time
+from collections import deque
+
+import discord
+
+from config import GAPLESS_BUFFER_FRAMES, OPUS_PASSTHROUGH
+from core.audio_cache import audio_cache
+from core.metrics import metrics
+
+FFMPEG_BEFORE_OPTIONS = '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
+FRAME_LENGTH = discord.opus.Encoder.FRAME_LENGTH / 1000  # Seconds of audio per read()
+OPUS_CODECS = ('opus', 'libopus')
+
+try:
+    CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+except (AttributeError, ValueError, OSError):
+    CLOCK_TICKS = None
+
+
+async def create_source(track, offset: float = 0.0) -> 'TrackSource':
+    """
+    Opus passthrough when the stream already is Opus, decoding to PCM otherwise.
+    Tracks in the local audio cache are played from disk. Playback starts `offset` seconds into the track.
+    """
+    seek = f'-ss {offset:.2f}' if offset else ''
+    cached = audio_cache.lookup(track)
+    if cached is not None:
+        metrics.event('audio_cache_hit')
+        if OPUS_PASSTHROUGH and cached.codec in OPUS_CODECS:
+            source = discord.FFmpegOpusAudio(str(cached.path), codec='copy', before_options=seek or None)
+        else:
+            source = discord.FFmpegPCMAudio(str(cached.path), before_options=seek or None)
+        return TrackSource(track, source, offset=offset)
+
+    if OPUS_PASSTHROUGH and track.codec is None:
+        try:
+            track.codec, _ = await discord.FFmpegOpusAudio.probe(track.url)
+        except Exception as ex:
+            logging.warning(f'Audio: failed to probe {track.info.webpage_url}\n{ex}')
+            metrics.error('probe')
+            track.codec = 'unknown'
+
+    before_options = f'{FFMPEG_BEFORE_OPTIONS} {seek}'.rstrip()
+    if OPUS_PASSTHROUGH and track.codec in OPUS_CODECS:
+        source = discord.FFmpegOpusAudio(track.url, codec='copy', before_options=before_options)
+    else:
+        source = discord.FFmpegPCMAudio(track.url, before_options=before_options)
+    return TrackSource(track, source, offset=offset)
+
+
+def process_cpu_time(pid: int) -> float or None:
+    """
+    CPU seconds (user + system) used by a process so far. Linux only.
+    """
+    if CLOCK_TICKS is None:
+        return None
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # Fields after the parenthesized command name, utime and stime are 14th and 15th overall
+    fields = stat[stat.rfind(b')') + 2:].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+class CpuUsage:
+    """
+    CPU cost of finished streams of one playback mode.
+    """
+    __slots__ = ('streams', 'audio', 'encoder', 'ffmpeg')
+
+    def __init__(self):
+        self.streams = 0
+        self.audio = 0.0  # Seconds of audio played
+        self.encoder = 0.0  # CPU seconds of the audio thread (read, encode, send)
+        self.ffmpeg = 0.0  # CPU seconds of ffmpeg subprocess
+
+    def add(self, audio: float, encoder: float, ffmpeg: float):
+        self.streams += 1
+        self.audio += audio
+        self.encoder += encoder
+        self.ffmpeg += ffmpeg or 0.0
+
+    def per_stream(self) -> float:
+        """
+        Average share of one CPU core used by a single stream.
+        """
+        return (self.encoder + self.ffmpeg) / self.audio if self.audio else 0.0
+
+
+cpu_usage = {'opus': CpuUsage(), 'pcm': CpuUsage()}
+
+
+class TrackSource(discord.AudioSource):
+    """
+    Audio source of a single track.
+
+    Counts frames to know the playback position and can read its first frames ahead of time,
+    so a source prepared in advance starts playing from memory instead of waiting for ffmpeg.
+    """
+
+    def __init__(self, track, source: discord.AudioSource, on_first_frame=None, offset: float = 0.0):
+        self.track = track
+        self.source = source
+        self.on_first_frame = on_first_frame
+        self.offset = offset  # Seconds into the track the source starts at
+        self.frames = 0
+        self.exhausted = False  # The stream reached its end, as opposed to being stopped
+        self._buffer = deque()
+        self._cpu_start = None
+        self._cpu_last = None
+        self._cleaned = False
+
+    @property
+    def mode(self) -> str:
+        return 'opus' if self.source.is_opus() else 'pcm'
+
+    @property
+    def played(self) -> float:
+        """
+        Seconds of audio handed to the voice client.
+        """
+        return self.frames * FRAME_LENGTH
+
+    @property
+    def elapsed(self) -> float:
+        """
+        Playback position in the track.
+        """
+        return self.offset + self.played
+
+    def prewarm(self, frames: int = GAPLESS_BUFFER_FRAMES):
+        """
+        Blocking read of the first frames into memory. Run it in an executor.
+        """
+        while len(self._buffer) < frames:
+            data = self.source.read()
+            if not data:
+                break
+            self._buffer.append(data)
+
+    def read(self) -> bytes:
+        # The audio thread is dedicated to this source, its CPU time between reads is the cost of the stream
+        self._cpu_last = time.thread_time()
+        if self._cpu_start is None:
+            self._cpu_start = self._cpu_last
+        data = self._buffer.popleft() if self._buffer else self.source.read()
+        if self.frames == 0 and self.on_first_frame is not None:
+            self.on_first_frame(time.perf_counter())
+        if data:
+            self.frames += 1
+        else:
+            self.exhausted = True
+        return data
+
+    def is_opus(self) -> bool:
+        return self.source.is_opus()
+
+    def cleanup(self):
+        # Called by the audio player and again by AudioSource.__del__, account the stream once
+        if self._cleaned:
+            return
+        self._cleaned = True
+        self._buffer.clear()
+        process = getattr(self.source, '_process', None)
+        ffmpeg_cpu = process_cpu_time(process.pid) if process else None
+        self.source.cleanup()
+        if self.frames and self._cpu_start is not None:
+            encoder_cpu = self._cpu_last - self._cpu_start
+            cpu_usage[self.mode].add(self.played, encoder_cpu, ffmpeg_cpu)
+            logging.debug(f'Audio: {self.mode} stream {self.played:.0f}s, '
+                          f'cpu {encoder_cpu:.2f}s in-process + {ffmpeg_cpu or 0:.2f}s ffmpeg')
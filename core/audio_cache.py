@@ -0,0 +1,237 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from yt_dlp.networking import Request
+from yt_dlp.networking.exceptions import HTTPError
+
+from config import AUDIO_CACHE_DIR, AUDIO_CACHE_BYTES, AUDIO_CACHE_POLICY, AUDIO_CACHE_MIN_PLAYS
+from core.resolver import ytdl_pool
+from core.utils import canonical_url
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+CHUNK_SIZE = 10 * 1024 * 1024  # googlevideo throttles responses bigger than ~10MB
+OPUS_SUFFIX = '.opus.webm'
+OTHER_SUFFIX = '.audio'
+RESCAN_INTERVAL = 10  # Seconds between directory scans, picking up files other processes added or evicted
+PART_MAX_AGE = 10 * 60  # Seconds without a write after which a partial file counts as abandoned
+
+
+class CacheEntry:
+    __slots__ = ('path', 'size', 'last_used', 'hits')
+
+    def __init__(self, path: Path, size: int, last_used: float, hits: int = 0):
+        self.path = path
+        self.size = size
+        self.last_used = last_used
+        self.hits = hits
+
+    @property
+    def codec(self) -> str or None:
+        return 'opus' if self.path.name.endswith(OPUS_SUFFIX) else None
+
+
+class AudioCache:
+    """
+    Local copies of the most requested tracks, so they play from disk instead of remote HTTP.
+
+    Files are written to a temporary name and renamed when complete, and eviction only unlinks,
+    so guilds still reading an evicted file keep playing it.
+
+    Processes sharing the directory (sharded mode) see each other's files: the index is rebuilt from the directory
+    every RESCAN_INTERVAL and before eviction, so the byte budget covers the files of all of them.
+    """
+    __slots__ = ('path', 'max_bytes', 'policy', 'min_plays', '_entries', '_scanned', '_plays', '_filling', '_lock',
+                 '_executor')
+
+    def __init__(self, path: str = AUDIO_CACHE_DIR, max_bytes: int = AUDIO_CACHE_BYTES,
+                 policy: str = AUDIO_CACHE_POLICY, min_plays: int = AUDIO_CACHE_MIN_PLAYS):
+        self.path = BASE_DIR.joinpath(path)
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.min_plays = min_plays
+        self._entries = None  # key -> CacheEntry, loaded on first use
+        self._scanned = 0.0  # monotonic() of the last directory scan
+        self._plays = {}  # key -> plays of tracks not cached yet
+        self._filling = set()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @property
+    def nbytes(self) -> int:
+        return sum(entry.size for entry in self._index().values())
+
+    @staticmethod
+    def key(webpage_url: str) -> str:
+        return hashlib.sha1(canonical_url(webpage_url).encode()).hexdigest()
+
+    def _stale(self) -> bool:
+        return self._entries is None or time.monotonic() - self._scanned > RESCAN_INTERVAL
+
+    def _index(self, rescan: bool = False) -> dict:
+        if rescan or self._stale():
+            with self._lock:
+                if rescan or self._stale():
+                    self._entries = self._scan(self._entries or {})
+                    self._scanned = time.monotonic()
+        return self._entries
+
+    def _scan(self, known: dict) -> dict:
+        """
+        Entries of the files in the directory. Hits counted by this process are kept.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        entries = {}
+        for file in self.path.iterdir():
+            key = file.name.split('.')[0]
+            try:
+                stat = file.stat()
+            except FileNotFoundError:
+                # Evicted by another process meanwhile
+                continue
+            if file.name.endswith('.part'):
+                # Fills of other processes keep writing, a file nobody wrote to for long is a leftover of a crash
+                if key not in self._filling and time.time() - stat.st_mtime > PART_MAX_AGE:
+                    file.unlink(missing_ok=True)
+                continue
+            entry = known.get(key)
+            if entry is not None and entry.path == file:
+                entry.size = stat.st_size
+                entry.last_used = max(entry.last_used, stat.st_mtime)
+                entries[key] = entry
+            else:
+                entries[key] = CacheEntry(file, stat.st_size, stat.st_mtime)
+        return entries
+
+    def lookup(self, track) -> CacheEntry or None:
+        """
+        Cached file of the track, if there is one.
+        """
+        if not self.enabled or not track.info.webpage_url:
+            return None
+        entry = self._index().get(self.key(track.info.webpage_url))
+        if entry is None:
+            return None
+        if not entry.path.exists():
+            # Evicted by another process sharing the directory
+            with self._lock:
+                self._entries.pop(self.key(track.info.webpage_url), None)
+            return None
+        entry.hits += 1
+        entry.last_used = time.time()
+        try:
+            # mtime keeps the LRU order across restarts
+            os.utime(entry.path, (entry.last_used, entry.last_used))
+        except OSError:
+            pass
+        return entry
+
+    def covers(self, track) -> bool:
+        """
+        Whether the track can be played without resolving its stream url.
+        """
+        return track.info.duration is not None and self.enabled and \
+            self._index().get(self.key(track.info.webpage_url or '')) is not None
+
+    def record_play(self, track):
+        if not self.enabled or not track.info.webpage_url:
+            return
+        key = self.key(track.info.webpage_url)
+        if key in self._index():
+            return
+        self._plays[key] = self._plays.get(key, 0) + 1
+        if len(self._plays) > 10000:
+            # Forget one-off plays
+            self._plays = {k: v for k, v in self._plays.items() if v > 1}
+
+    def maybe_fill(self, track):
+        """
+        Start a background download if the track is popular enough and its stream url is known.
+        """
+        if not self.enabled or not track.url or not track.info.webpage_url:
+            return
+        key = self.key(track.info.webpage_url)
+        if self._plays.get(key, 0) < self.min_plays or key in self._index() or key in self._filling:
+            return
+        self._filling.add(key)
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='audio-cache')
+        future = asyncio.get_running_loop().run_in_executor(
+            self._executor, self._fill, key, track.url, track.codec
+        )
+        future.add_done_callback(lambda f: self._filling.discard(key))
+
+    def _fill(self, key: str, url: str, codec: str):
+        path = self.path.joinpath(key + (OPUS_SUFFIX if codec in ('opus', 'libopus') else OTHER_SUFFIX))
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.part')
+        size = 0
+        try:
+            with ytdl_pool.checkout('track') as ytdl, open(tmp_path, 'wb') as f:
+                while True:
+                    byte_range = f'bytes={size}-{size + CHUNK_SIZE - 1}'
+                    try:
+                        response = ytdl.urlopen(Request(url, headers={'Range': byte_range}))
+                    except HTTPError as ex:
+                        # File size was a multiple of the chunk size
+                        if ex.status == 416 and size:
+                            break
+                        raise
+                    data = response.read()
+                    f.write(data)
+                    size += len(data)
+                    if len(data) < CHUNK_SIZE or size > self.max_bytes // 10:
+                        break
+            if size > self.max_bytes // 10:
+                raise ValueError(f'{size} bytes is too big to cache')
+            os.replace(tmp_path, path)
+        except Exception as ex:
+            logging.warning(f'Audio cache: failed to fill {key}\n{ex}')
+            tmp_path.unlink(missing_ok=True)
+            return
+
+        with self._lock:
+            self._plays.pop(key, None)
+        # The rescan picks up the new file
+        self._evict()
+
+    def _evict(self):
+        self._index(rescan=True)
+        with self._lock:
+            entries = self._entries
+            total = sum(entry.size for entry in entries.values())
+            if total <= self.max_bytes:
+                return
+            if self.policy == 'lfu':
+                order = sorted(entries.items(), key=lambda item: (item[1].hits, item[1].last_used))
+            else:
+                order = sorted(entries.items(), key=lambda item: item[1].last_used)
+            kept = dict(entries)
+            for key, entry in order:
+                if total <= self.max_bytes:
+                    break
+                entry.path.unlink(missing_ok=True)
+                del kept[key]
+                total -= entry.size
+            # The event loop iterates the index without the lock, it is replaced instead of edited
+            self._entries = kept
+
+    def stats(self) -> dict:
+        entries = self._index() if self.enabled else {}
+        return {
+            'files': len(entries),
+            'bytes': sum(entry.size for entry in entries.values()),
+            'filling': len(self._filling),
+        }
+
+
+audio_cache = AudioCache()
@@ -0,0 +1,195 @@
+import sys
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+from config import STREAM_CACHE_BYTES, STREAM_CACHE_TTL, SEARCH_CACHE_BYTES, SEARCH_CACHE_TTL
+from core.utils import canonical_url
+
+ENTRY_OVERHEAD = 256  # Rough size of the bookkeeping around every cached value in bytes
+
+
+def stream_expiry(url: str) -> float or None:
+    """
+    Unix time when a googlevideo stream url stops working, None if the url does not say.
+    """
+    if not url:
+        return None
+    path = urlparse(url)
+    expire = parse_qs(path.query).get('expire')
+    if expire is None:
+        # Some links carry their params in the path: /videoplayback/expire/1700000000/...
+        parts = path.path.split('/')
+        if 'expire' in parts and parts.index('expire') + 1 < len(parts):
+            expire = [parts[parts.index('expire') + 1]]
+    try:
+        return float(expire[0]) if expire else None
+    except ValueError:
+        return None
+
+
+def _sizeof(value) -> int:
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_sizeof(k) + _sizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_sizeof(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class TTLCache:
+    """
+    LRU cache with per-entry expiry time and a memory budget.
+    """
+    __slots__ = ('max_bytes', 'ttl', 'hits', 'misses', 'evictions', '_entries', '_nbytes')
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (value, expires_at, size)
+        self._nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def get(self, key, count: bool = True):
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] <= time.time():
+            self._discard(key)
+            entry = None
+        if entry is None:
+            if count:
+                self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        if count:
+            self.hits += 1
+        return entry[0]
+
+    def set(self, key, value, expires_at: float = None):
+        if expires_at is None:
+            expires_at = time.time() + self.ttl
+        if expires_at <= time.time():
+            return
+        self._discard(key)
+        size = _sizeof(key) + _sizeof(value) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (value, expires_at, size)
+        self._nbytes += size
+        while self._nbytes > self.max_bytes:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self._nbytes -= evicted_size
+            self.evictions += 1
+
+    def pop(self, key):
+        return self._discard(key)
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        self._nbytes -= entry[2]
+        return entry[0]
+
+    def clear(self):
+        self._entries.clear()
+        self._nbytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self._nbytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class StreamCache(TTLCache):
+    """
+    Resolved stream urls and track metadata keyed by webpage url.
+
+    Entries live until the googlevideo link expires,
+    minus the track duration so a cached link never dies mid-song.
+    """
+    __slots__ = ()
+
+    INFO_KEYS = ('url', 'acodec', 'uploader', 'title', 'duration', 'webpage_url')
+
+    def __init__(self, max_bytes: int = STREAM_CACHE_BYTES, ttl: float = STREAM_CACHE_TTL):
+        super().__init__(max_bytes, ttl)
+
+    def get(self, webpage_url: str, count: bool = True) -> dict or None:
+        return super().get(canonical_url(webpage_url), count=count)
+
+    def pop(self, webpage_url: str):
+        return super().pop(canonical_url(webpage_url))
+
+    def put(self, info: dict):
+        """
+        Store a slim copy of a yt-dlp info dict.
+        """
+        webpage_url = info.get('webpage_url')
+        if not webpage_url or not info.get('url'):
+            return
+        slim = {key: info.get(key) for key in self.INFO_KEYS}
+        thumbnails = info.get('thumbnails')
+        slim['thumbnails'] = [{'url': thumbnails[-1]['url']}] if thumbnails else None
+
+        expires_at = stream_expiry(slim['url'])
+        if expires_at is not None:
+            expires_at -= (slim['duration'] or 0) + 60
+        self.set(canonical_url(webpage_url), slim, expires_at)
+
+
+class SearchCache(TTLCache):
+    """
+    Free-text search queries mapped to the canonical webpage url of the first result.
+
+    The url is the key of the result in the stream cache,
+    so a hit skips the search and usually the extraction too.
+    """
+    __slots__ = ()
+
+    def __init__(self, max_bytes: int = SEARCH_CACHE_BYTES, ttl: float = SEARCH_CACHE_TTL):
+        super().__init__(max_bytes, ttl)
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return ' '.join(query.casefold().split())
+
+    def get(self, query: str, count: bool = True) -> str or None:
+        return super().get(self.normalize(query), count=count)
+
+    def pop(self, query: str):
+        return super().pop(self.normalize(query))
+
+    def put(self, query: str, webpage_url: str):
+        if webpage_url:
+            self.set(self.normalize(query), canonical_url(webpage_url))
+
+
+def stream_is_fresh(url: str, duration: float = None) -> bool:
+    """
+    Whether a stream url is still good enough to play a track of `duration` seconds through.
+    """
+    if not url:
+        return False
+    expires_at = stream_expiry(url)
+    return expires_at is None or expires_at - (duration or 0) - 60 > time.time()
+
+
+stream_cache = StreamCache()
+search_cache = SearchCache()
@@ -1,25 +1,95 @@
 import discord
 from discord.ext import commands
 
-from core.utils import get_similarity_coefficient
-
-
-async def correct_command_name(bot: discord.client, ctx: commands.Context, command_name: str) -> str:
-    tanimoto_max = 0
-    names_and_aliases = []
-    similar_command = None
-    owner_id = bot.owner_id or (await bot.application_info()).owner.id
-    if ctx.message.author.id == owner_id:
-        cmd_list = bot.commands
-    else:
-        cmd_list = list(filter(lambda cmd: not cmd.hidden, bot.commands))
-    for cmd in cmd_list:
-        names_and_aliases.append(cmd.name)
-        for alias in cmd.aliases:
-            names_and_aliases.append(alias)
-    for name in names_and_aliases:
-        tanimoto_curr = get_similarity_coefficient(command_name, name)
-        if tanimoto_curr > tanimoto_max:
-            tanimoto_max = tanimoto_curr
-            similar_command = name
-    return similar_command
+
+def _bigrams(name: str) -> frozenset:
+    """
+    Character bigrams of the name, padded so that single letters and word edges count too.
+    """
+    padded = f'^{name.lower()}$'
+    return frozenset(padded[i:i + 2] for i in range(len(padded) - 1))
+
+
+class CommandIndex:
+    """
+    Inverted index of command names and aliases by character bigram.
+
+    Built once from (name, aliases, hidden) entries. A lookup only scores names sharing a bigram with the query,
+    by Jaccard similarity of the bigram sets.
+    """
+    __slots__ = ('_names', '_hidden', '_sizes', '_postings', 'size')
+
+    def __init__(self, entries=()):
+        self.build(entries)
+
+    def build(self, entries):
+        self._names = []  # name or alias per id
+        self._hidden = []  # whether the command behind the id is hidden
+        self._sizes = []  # bigram set size per id
+        self._postings = {}  # bigram -> ids of names containing it
+        for name, aliases, hidden in entries:
+            for alias in (name, *aliases):
+                grams = _bigrams(alias)
+                name_id = len(self._names)
+                self._names.append(alias)
+                self._hidden.append(hidden)
+                self._sizes.append(len(grams))
+                for gram in grams:
+                    self._postings.setdefault(gram, []).append(name_id)
+        self.size = len(self._names)
+
+    def suggest(self, query: str, k: int = 1, include_hidden: bool = False) -> list:
+        """
+        Up to k names most similar to the query, best first. Names at least half as similar as the best one only.
+        """
+        grams = _bigrams(query)
+        shared = {}
+        for gram in grams:
+            for name_id in self._postings.get(gram, ()):
+                shared[name_id] = shared.get(name_id, 0) + 1
+
+        scored = []
+        for name_id, common in shared.items():
+            if self._hidden[name_id] and not include_hidden:
+                continue
+            # Earlier registered names win ties
+            scored.append((common / (len(grams) + self._sizes[name_id] - common), -name_id))
+        scored.sort(reverse=True)
+        # Runners-up far behind the best match are noise
+        return [self._names[-negated_id] for score, negated_id in scored[:k] if score >= scored[0][0] / 2]
+
+
+command_index = CommandIndex()
+_team_owner_id = None
+
+
+def index_commands(bot: commands.Bot):
+    """
+    (Re)build the command index, after cogs are loaded.
+    """
+    command_index.build((cmd.name, cmd.aliases, cmd.hidden) for cmd in bot.commands)
+
+
+async def get_owner_id(bot: commands.Bot) -> int:
+    """
+    Id of the application owner, asked from Discord only the first time.
+    """
+    global _team_owner_id
+    if bot.owner_id is not None:
+        return bot.owner_id
+    if _team_owner_id is not None:
+        return _team_owner_id
+    app = await bot.application_info()
+    if bot.owner_ids:
+        # Team owners are checked by owner_ids, owner_id has to stay unset for that
+        _team_owner_id = app.owner.id
+        return _team_owner_id
+    bot.owner_id = app.owner.id
+    return bot.owner_id
+
+
+async def suggest_commands(bot: discord.client, ctx: commands.Context, command_name: str, k: int = 3) -> list:
+    if command_index.size != len(bot.all_commands):
+        # A cog was loaded or unloaded since the index was built
+        index_commands(bot)
+    return command_index.suggest(command_name, k, include_hidden=await bot.is_owner(ctx.message.author))
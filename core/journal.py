@@ -0,0 +1,299 @@
+import asyncio
+import atexit
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from config import JOURNAL_DIR, JOURNAL_COMPACT_RECORDS, JOURNAL_MAX_AGE
+from core.track import Track
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+HISTORY_KEPT = 15  # Recently played tracks restored, the same amount Playlist keeps
+
+
+class Requester:
+    """
+    Stand-in for a requester who is not in the member cache after a restart.
+    """
+    __slots__ = ('id', 'name')
+
+    def __init__(self, user_id: int, name: str):
+        self.id = user_id
+        self.name = name
+
+    @property
+    def mention(self) -> str:
+        return f'<@{self.id}>'
+
+    def __str__(self):
+        return self.name
+
+
+def encode_track(track) -> list:
+    """
+    Everything needed to play the track again without a lookup. The stream url is only used while it is fresh.
+    """
+    info = track.info
+    requester = track.requester
+    return [info.webpage_url, info.title, info.duration, info.uploader, info.thumbnail,
+            getattr(requester, 'id', None), str(requester) if requester is not None else None, track.url, track.codec]
+
+
+def decode_track(fields: list, guild) -> Track:
+    webpage_url, title, duration, uploader, thumbnail, requester_id, requester_name, url, codec = fields
+    requester = guild.get_member(requester_id) if requester_id is not None else None
+    if requester is None and requester_id is not None:
+        requester = Requester(requester_id, requester_name)
+    return Track(url=url, codec=codec, requester=requester, uploader=uploader, title=title, duration=duration,
+                 webpage_url=webpage_url, thumbnail=thumbnail)
+
+
+def replay(lines) -> dict or None:
+    """
+    Player state after the journal's records. A torn last line (crash during a write) ends the replay.
+    """
+    state = None
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            break
+        op = record[0]
+        if op == 'S':
+            state = record[1]
+            continue
+        if state is None:
+            # Records without the snapshot they build on
+            return None
+        if op == 'a':
+            state['queue'].insert(record[1], record[2])
+        elif op == 'd':
+            if state['queue']:
+                state['queue'].pop(record[1])
+        elif op == 'm':
+            state['queue'].insert(record[2], state['queue'].pop(record[1]))
+        elif op == 'p':
+            _, track, state['text'], state['voice'], state['offset'] = record
+            state['current'] = track
+            state['history'] = (state['history'] + [track])[-HISTORY_KEPT:]
+        elif op == 's':
+            state['offset'] = record[1]
+        elif op == 'e':
+            state['current'] = None
+            state['offset'] = 0.0
+        elif op == 'l':
+            state['loop'] = record[1]
+    return state
+
+
+class GuildJournal:
+    """
+    Append-only record of one guild's queue mutations and playback position.
+
+    Bulk changes (shuffle, clear, ...) and every JOURNAL_COMPACT_RECORDS records rewrite the journal
+    as a single snapshot taken from `snapshot`, a function returning the player's state.
+    Records are taken after the change is applied, so the first one of a new journal is a snapshot as well.
+    """
+    __slots__ = ('journal', 'guild_id', 'snapshot', 'records', '_compact_handle')
+
+    def __init__(self, journal: 'SessionJournal', guild_id: int, snapshot):
+        self.journal = journal
+        self.guild_id = guild_id
+        self.snapshot = snapshot
+        self.records = None  # Appended since the last snapshot, None while there is no journal on disk
+        self._compact_handle = None
+
+    def _append(self, record: list):
+        if self.records is None or self.records >= JOURNAL_COMPACT_RECORDS:
+            self.compact()
+            return
+        self.journal.write(self.guild_id, json.dumps(record, separators=(',', ':')))
+        self.records += 1
+
+    def insert(self, pos: int, track):
+        self._append(['a', pos, encode_track(track)])
+
+    def remove(self, pos: int):
+        self._append(['d', pos])
+
+    def move(self, src: int, dst: int):
+        self._append(['m', src, dst])
+
+    def play(self, track, text_id: int or None, voice_id: int or None, offset: float = 0.0):
+        self._append(['p', encode_track(track), text_id, voice_id, offset])
+
+    def position(self, offset: float):
+        self._append(['s', round(offset, 1)])
+
+    def end(self):
+        self._append(['e'])
+
+    def set_loop(self, loop: bool):
+        self._append(['l', loop])
+
+    def reset(self):
+        """
+        The queue changed too much to record it as single mutations. Snapshot it once the change is complete.
+        """
+        if self._compact_handle is None:
+            self._compact_handle = asyncio.get_running_loop().call_soon(self.compact)
+
+    def compact(self):
+        if self._compact_handle is not None:
+            self._compact_handle.cancel()
+            self._compact_handle = None
+        state = self.snapshot()
+        if state['current'] is None and not state['queue']:
+            # Nothing to restore
+            self.discard()
+            return
+        self.journal.write(self.guild_id, json.dumps(['S', state], separators=(',', ':')), replace=True)
+        self.records = 0
+
+    def discard(self):
+        if self._compact_handle is not None:
+            self._compact_handle.cancel()
+            self._compact_handle = None
+        if self.records is not None:
+            self.journal.delete(self.guild_id)
+            self.records = None
+
+
+class SessionJournal:
+    """
+    Journals of every guild in one directory, one file per guild.
+
+    Records are appended by a single writer thread, so mutations never wait for the disk.
+    A crash loses at most the records still queued for the writer.
+    """
+    __slots__ = ('path', '_queue', '_writer', '_lock')
+
+    def __init__(self, path: str = JOURNAL_DIR):
+        self.path = BASE_DIR.joinpath(path)
+        self._queue = queue.SimpleQueue()
+        self._writer = None
+        self._lock = threading.Lock()
+
+    def guild(self, guild_id: int, snapshot) -> GuildJournal:
+        return GuildJournal(self, guild_id, snapshot)
+
+    def delete(self, guild_id: int):
+        self.write(guild_id, None)
+
+    def _file(self, guild_id: int) -> Path:
+        return self.path.joinpath(f'{guild_id}.jsonl')
+
+    def write(self, guild_id: int, line: str or None, replace: bool = False):
+        """
+        Queue a record. `replace` starts the journal over with the line, None deletes the journal.
+        """
+        self._queue.put((guild_id, line, replace))
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self.path.mkdir(parents=True, exist_ok=True)
+                    self._writer = threading.Thread(target=self._write_loop, name='journal-writer', daemon=True)
+                    self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            items = [item]
+            stop = False
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                items.append(item)
+
+            # One open() per guild and batch: guild id -> [replace, lines...], None as line deletes the file
+            batch = {}
+            for guild_id, line, replace in items:
+                if line is None or replace:
+                    batch[guild_id] = [replace, line]
+                else:
+                    batch.setdefault(guild_id, [False]).append(line)
+            for guild_id, (replace, *lines) in batch.items():
+                try:
+                    self._write_file(guild_id, replace, lines)
+                except OSError as ex:
+                    logging.warning(f'Journal: failed to write guild {guild_id}\n{ex}')
+            if stop:
+                break
+
+    def _write_file(self, guild_id: int, replace: bool, lines: list):
+        path = self._file(guild_id)
+        if lines and lines[0] is None:
+            # Deleted, maybe with records appended after the deletion
+            path.unlink(missing_ok=True)
+            lines = lines[1:]
+            if not lines:
+                return
+        if not replace:
+            with open(path, 'a') as f:
+                f.write('\n'.join(lines) + '\n')
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix=f'.{guild_id}.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            os.replace(tmp_path, path)
+        except OSError:
+            os.unlink(tmp_path)
+            raise
+
+    def load(self, guild_ids=None) -> dict:
+        """
+        Blocking replay of every journal (or the ones of `guild_ids`). Returns guild id -> state.
+
+        Journals too old to resume from are deleted.
+        """
+        states = {}
+        now = time.time()
+        try:
+            files = list(os.scandir(self.path))
+        except FileNotFoundError:
+            return states
+        for entry in files:
+            name = entry.name
+            if not name.endswith('.jsonl'):
+                continue
+            guild_id = int(name[:-6])
+            if guild_ids is not None and guild_id not in guild_ids:
+                continue
+            if now - entry.stat().st_mtime > JOURNAL_MAX_AGE:
+                os.unlink(entry.path)
+                continue
+            try:
+                with open(entry.path, 'r') as f:
+                    state = replay(f)
+            except (OSError, LookupError, TypeError, ValueError) as ex:
+                logging.warning(f'Journal: failed to read {name}\n{ex}')
+                continue
+            if state is not None and (state['current'] is not None or state['queue']):
+                states[guild_id] = state
+        return states
+
+    def close(self):
+        """
+        Write queued records and stop the writer thread.
+        """
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+
+
+session_journal = SessionJournal()
+atexit.register(session_journal.close)
@@ -0,0 +1,216 @@
+import asyncio
+import atexit
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from config import METADATA_DB_PATH
+from core.cache import stream_expiry
+from core.utils import canonical_url
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tracks (
+    webpage_url TEXT PRIMARY KEY,
+    uploader TEXT,
+    title TEXT,
+    duration REAL,
+    thumbnail TEXT,
+    updated_at REAL NOT NULL
+)
+'''
+
+# Added after the first release, existing databases get them on connect
+STREAM_COLUMNS = (
+    ('stream_url', 'TEXT'),
+    ('acodec', 'TEXT'),
+    ('stream_expires_at', 'REAL'),
+)
+
+UPSERT = '''
+INSERT INTO tracks (webpage_url, uploader, title, duration, thumbnail, stream_url, acodec, stream_expires_at,
+                    updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (webpage_url) DO UPDATE SET
+    uploader = COALESCE(excluded.uploader, uploader),
+    title = COALESCE(excluded.title, title),
+    duration = COALESCE(excluded.duration, duration),
+    thumbnail = COALESCE(excluded.thumbnail, thumbnail),
+    stream_url = COALESCE(excluded.stream_url, stream_url),
+    acodec = COALESCE(excluded.acodec, acodec),
+    stream_expires_at = COALESCE(excluded.stream_expires_at, stream_expires_at),
+    updated_at = excluded.updated_at
+'''
+
+SELECT_STREAM = '''
+SELECT webpage_url, uploader, title, duration, thumbnail, stream_url, acodec FROM tracks
+WHERE webpage_url = ? AND stream_url IS NOT NULL
+    AND (stream_expires_at IS NULL OR stream_expires_at - COALESCE(duration, 0) - 60 > ?)
+'''
+
+WRITE_BATCH = 500  # Max rows per transaction of the writer thread
+
+
+class MetadataStore:
+    """
+    SQLite-backed track metadata that survives restarts.
+
+    Writes are queued to a single writer thread, reads use a connection per thread.
+    Stream urls are kept as well, so processes sharing the database (sharded mode) share resolved streams.
+    """
+    __slots__ = ('path', '_queue', '_writer', '_local', '_lock')
+
+    def __init__(self, path: str = METADATA_DB_PATH):
+        self.path = str(BASE_DIR.joinpath(path))
+        self._queue = queue.SimpleQueue()
+        self._writer = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(SCHEMA)
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(tracks)')}
+        for name, column_type in STREAM_COLUMNS:
+            if name not in columns:
+                try:
+                    conn.execute(f'ALTER TABLE tracks ADD COLUMN {name} {column_type}')
+                except sqlite3.OperationalError:
+                    # Added by another process in the meantime
+                    pass
+        return conn
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def put(self, info: dict):
+        """
+        Queue metadata of a yt-dlp info dict (full or flat entry) for writing. Never blocks.
+        """
+        webpage_url = info.get('webpage_url') or info.get('url')
+        if not webpage_url or info.get('_type') == 'playlist':
+            return
+        thumbnails = info.get('thumbnails')
+        # Flat playlist entries carry the webpage url in 'url', only resolved infos have a stream
+        stream_url = info.get('url') if info.get('webpage_url') and info.get('acodec') is not None else None
+        self._queue.put((
+            canonical_url(webpage_url),
+            info.get('uploader') or info.get('channel'),
+            info.get('title'),
+            info.get('duration'),
+            thumbnails[-1]['url'] if thumbnails else info.get('thumbnail'),
+            stream_url,
+            info.get('acodec') if stream_url else None,
+            stream_expiry(stream_url) if stream_url else None,
+            time.time()
+        ))
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, name='metadata-writer', daemon=True)
+                    self._writer.start()
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            row = self._queue.get()
+            if row is None:
+                break
+            rows = [row]
+            stop = False
+            while len(rows) < WRITE_BATCH:
+                try:
+                    row = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if row is None:
+                    stop = True
+                    break
+                rows.append(row)
+            try:
+                with conn:
+                    conn.executemany(UPSERT, rows)
+            except sqlite3.Error as ex:
+                logging.warning(f'Metadata store: failed to write {len(rows)} rows\n{ex}')
+            if stop:
+                break
+        conn.close()
+
+    @staticmethod
+    def _to_info(row) -> dict:
+        webpage_url, uploader, title, duration, thumbnail = row
+        return {
+            'webpage_url': webpage_url,
+            'uploader': uploader,
+            'title': title,
+            'duration': duration,
+            'thumbnails': [{'url': thumbnail}] if thumbnail else None,
+        }
+
+    def get(self, webpage_url: str) -> dict or None:
+        row = self._connection().execute(
+            'SELECT webpage_url, uploader, title, duration, thumbnail FROM tracks WHERE webpage_url = ?',
+            (canonical_url(webpage_url),)
+        ).fetchone()
+        return self._to_info(row) if row else None
+
+    def get_stream(self, webpage_url: str) -> dict or None:
+        """
+        Metadata and a stream url that will not expire before the track ends, if one is stored.
+        """
+        row = self._connection().execute(SELECT_STREAM, (canonical_url(webpage_url), time.time())).fetchone()
+        if row is None:
+            return None
+        info = self._to_info(row[:5])
+        info['url'], info['acodec'] = row[5], row[6]
+        return info
+
+    def get_many(self, webpage_urls) -> dict:
+        """
+        Stored metadata for the urls, keyed by canonical url. Unknown urls are left out.
+        """
+        keys = list({canonical_url(url) for url in webpage_urls if url})
+        found = {}
+        conn = self._connection()
+        # Stay below SQLITE_MAX_VARIABLE_NUMBER of old SQLite builds
+        for i in range(0, len(keys), 900):
+            chunk = keys[i:i + 900]
+            rows = conn.execute(
+                f'SELECT webpage_url, uploader, title, duration, thumbnail FROM tracks '
+                f'WHERE webpage_url IN ({",".join("?" * len(chunk))})',
+                chunk
+            ).fetchall()
+            for row in rows:
+                found[row[0]] = self._to_info(row)
+        return found
+
+    async def fetch(self, webpage_url: str) -> dict or None:
+        return await asyncio.get_running_loop().run_in_executor(None, self.get, webpage_url)
+
+    async def fetch_stream(self, webpage_url: str) -> dict or None:
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_stream, webpage_url)
+
+    async def fetch_many(self, webpage_urls) -> dict:
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_many, webpage_urls)
+
+    def close(self):
+        """
+        Flush queued writes and stop the writer thread.
+        """
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+
+
+metadata_store = MetadataStore()
+atexit.register(metadata_store.close)
@@ -0,0 +1,198 @@
+import bisect
+import contextlib
+import logging
+import time
+
+from aiohttp import web
+
+METRIC_PREFIX = 'musicbot_'
+# Seconds, from a cached lookup up to a slow extraction of a long playlist
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Seconds, a healthy loop answers within a millisecond
+LAG_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(labels: tuple, extra: str = '') -> str:
+    pairs = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _le(bound) -> str:
+    return f'le="{bound}"'
+
+
+class Histogram:
+    """
+    Fixed bucket histogram per label set. An observation is one bisect and two additions.
+
+    Observations may come from the audio thread, the GIL keeps a lost increment rare enough for monitoring.
+    """
+    __slots__ = ('name', 'help', 'buckets', '_series')
+
+    def __init__(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self._series = {}  # label pairs -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def count(self, **labels) -> int:
+        series = self._series.get(tuple(sorted(labels.items())))
+        return sum(series[:-1]) if series else 0
+
+    def quantile(self, q: float, **labels) -> float or None:
+        """
+        Estimate by linear interpolation inside the bucket, like Prometheus' histogram_quantile.
+        """
+        series = self._series.get(tuple(sorted(labels.items())))
+        if not series:
+            return None
+        counts = series[:-1]
+        rank = q * sum(counts)
+        seen = 0
+        for i, bucket_count in enumerate(counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return None
+
+    def series(self) -> list:
+        """
+        Label sets observed so far, as dicts.
+        """
+        return [dict(key) for key in self._series]
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for key, series in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, series):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{_labels(key, _le(bound))} {cumulative}')
+            cumulative += series[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{_labels(key, _le("+Inf"))} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(key)} {series[-1]}')
+            lines.append(f'{self.name}_count{_labels(key)} {cumulative}')
+        return lines
+
+
+class Counter:
+    __slots__ = ('name', 'help', '_values')
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values = {}  # label pairs -> value
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def items(self):
+        return self._values.items()
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        lines.extend(f'{self.name}{_labels(key)} {value}' for key, value in self._values.items())
+        return lines
+
+
+class Metrics:
+    """
+    In-process metrics, rendered in Prometheus text format on request.
+
+    Values owned by other modules (cache statistics, CPU usage, ...) are read by collectors at render time
+    instead of being copied on every change.
+    """
+    __slots__ = ('stages', 'events', 'errors', 'gaps', 'lag', '_collectors', '_runner')
+
+    def __init__(self):
+        self.stages = Histogram(METRIC_PREFIX + 'stage_seconds', 'Duration of playback pipeline stages.')
+        self.events = Counter(METRIC_PREFIX + 'events_total', 'Stream and search lookups by where they were answered.')
+        self.errors = Counter(METRIC_PREFIX + 'errors_total', 'Errors by where they happened.')
+        self.gaps = Histogram(METRIC_PREFIX + 'gap_seconds', 'Silence between two consecutive songs.')
+        self.lag = Histogram(METRIC_PREFIX + 'loop_lag_seconds', 'Delay of event loop watchdog pings.', LAG_BUCKETS)
+        self._collectors = []  # functions returning (name, type, help, [(labels dict, value)])
+        self._runner = None
+
+    @contextlib.contextmanager
+    def span(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.observe(time.perf_counter() - start, stage=stage)
+
+    def observe(self, stage: str, seconds: float):
+        self.stages.observe(seconds, stage=stage)
+
+    def event(self, name: str, **labels):
+        self.events.inc(event=name, **labels)
+
+    def error(self, where: str):
+        self.errors.inc(where=where)
+
+    def collector(self, function):
+        """
+        Register a function called at render time. Usable as a decorator.
+        """
+        self._collectors.append(function)
+        return function
+
+    def render(self) -> str:
+        lines = []
+        for metric in (self.stages, self.gaps, self.lag, self.events, self.errors):
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            try:
+                name, metric_type, help_text, samples = collect()
+            except Exception as ex:
+                logging.warning(f'Metrics: collector {collect.__name__} failed\n{ex}')
+                continue
+            name = METRIC_PREFIX + name
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            lines.extend(f'{name}{_labels(tuple(sorted(labels.items())))} {value}' for labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.render(), content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+    async def start_server(self, host: str, port: int):
+        """
+        Serve /metrics. Only meant for a local Prometheus, there is no authentication.
+        """
+        if self._runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        try:
+            await web.TCPSite(self._runner, host, port).start()
+        except OSError as ex:
+            logging.warning(f'Metrics: can not listen on {host}:{port}\n{ex}')
+            await self._runner.cleanup()
+            self._runner = None
+            return
+        logging.info(f'Metrics: serving http://{host}:{port}/metrics')
+
+    async def stop_server(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+metrics = Metrics()
@@ -1,31 +1,99 @@
 import asyncio
-import concurrent.futures
+import logging
+import random
+import time
+from collections import deque
 from urllib.parse import urlparse, parse_qs
 
 import discord
 import yt_dlp
 from discord.ext import commands
 
-from config import MAX_SONG_DURATION, MAX_PRELOAD, MAX_PLAYLIST_LEN, CODE_BLOCK
-from core import utils
+from config import MAX_SONG_DURATION, MAX_PLAYLIST_LEN, MAX_QUEUE_LEN, MAX_PRELOAD, PLAYLIST_SUMMARY_INTERVAL, \
+    GAPLESS, GAPLESS_PREWARM, DEFAULT_TIMEOUT, CODE_BLOCK, RESUME_CONCURRENCY, RESUME_ATTEMPTS, RESUME_JITTER, \
+    RESUME_VOICE_TIMEOUT
+from core.audio import TrackSource, create_source
+from core.audio_cache import audio_cache
+from core.cache import stream_is_fresh
+from core.journal import session_journal, encode_track, decode_track, HISTORY_KEPT
+from core.metadata_store import metadata_store
+from core.metrics import metrics
+from core.outbox import outboxes
 from core.playlist import Playlist
+from core.prefetch import prefetcher
+from core.resolver import resolver
+from core.scheduler import deadlines
+from core.settings import settings_store
 from core.track import Track
 
+END_MARGIN = 5  # Seconds before the end of a track where a stream ending counts as the track ending
+RESUME_PROGRESS = 5  # Seconds a resumed stream has to play to count as recovered
+
+_resume_limit = None
+
+
+def resume_limit() -> asyncio.Semaphore:
+    """
+    Semaphore shared by every guild, a gateway outage interrupts all of them at once.
+
+    Created on first use, before Python 3.10 a semaphore is bound to the event loop current at its creation.
+    """
+    global _resume_limit
+    if _resume_limit is None:
+        _resume_limit = asyncio.Semaphore(RESUME_CONCURRENCY)
+    return _resume_limit
+
 
 class MusicPlayer(object):
-    __slots__ = ('bot', 'playlist', 'current_track', 'next', 'np_message', 'guild', 'channel', 'timer')
+    __slots__ = ('bot', 'playlist', 'current_track', 'source', 'next', 'np_message', 'queue_view', 'guild', 'channel',
+                 'gaps', 'last_used', 'journal', '_prewarmed', '_prewarm_task', '_ingest_task', '_resume_task',
+                 '_resumes', '_stopping', '_ended_at', '_play_started', '_requested_at')
 
     def __init__(self, bot, guild):
         self.bot = bot
         self.playlist = Playlist()
         self.current_track = None
+        self.source = None  # TrackSource of the current track
         self.next = asyncio.Event()
         self.np_message = None
+        self.queue_view = None  # Pages of the last ~queue message
         self.guild = guild
         self.channel = None
-        self.timer = utils.Timer(self.timeout_handler)
+        self.gaps = deque(maxlen=100)  # Seconds of silence between the last tracks
+        self.last_used = time.monotonic()
+        self.journal = session_journal.guild(guild.id, self._journal_state)
+        self.playlist.journal = self.journal
+        self.playlist.on_head_change = self._head_changed
+        self._prewarmed = None
+        self._prewarm_task = None
+        self._ingest_task = None
+        self._resume_task = None
+        self._resumes = 0  # Resumes of the current track that did not get it playing again
+        self._stopping = False  # stop_player() ended the current source, its end is not an interruption
+        self._ended_at = None
+        self._play_started = None  # perf_counter() of the last voice_client.play()
+        self._requested_at = None  # perf_counter() of the request that woke up an idle player
+
+    @property
+    def timeout(self) -> float:
+        """
+        Inactivity timeout configured for the guild.
+        """
+        config = settings_store.get(self.guild.id)
+        return config.get('timeout', DEFAULT_TIMEOUT) if config else DEFAULT_TIMEOUT
+
+    @property
+    def skip_duplicates(self) -> bool:
+        config = settings_store.get(self.guild.id)
+        return bool(config and config.get('skip_duplicates'))
+
+    def reset_timeout(self):
+        deadlines.touch(self.guild.id, self.timeout, self.timeout_handler)
 
     async def timeout_handler(self):
+        if self.guild.voice_client is None:
+            return
+
         # Terminate the player and DC if left alone :(
         if len(self.guild.voice_client.channel.voice_states) == 1:
             await self.stop_player()
@@ -34,67 +102,286 @@ class MusicPlayer(object):
 
         # Reset DC timer if still playing
         if self.guild.voice_client.is_playing():
-            self.timer = utils.Timer(self.timeout_handler)
+            self.reset_timeout()
             return
 
         await self.stop_player()
         await self.guild.voice_client.disconnect(force=True)
 
-    async def play_track(self, track):
+    async def play_track(self, track, source: TrackSource = None, offset: float = 0.0):
+        """
+        Play the track from `offset` seconds, unless `source` says it is already playing (gapless switch).
+        """
 
         if not self.playlist.loop:
-            self.timer.cancel()
-            self.timer = utils.Timer(self.timeout_handler)
+            self.reset_timeout()
 
         self.next.clear()
-        if track.info.duration is None:
-            ytdl = yt_dlp.YoutubeDL({'format': 'bestaudio/best', 'title': True})
-            info = ytdl.extract_info(track.info.webpage_url, download=False)
-            track.url = info.get('url')
-            track.info.uploader = info.get('uploader')
-            track.info.title = info.get('title')
-            track.info.duration = info.get('duration')
-            track.info.webpage_url = info.get('webpage_url')
-            track.info.thumbnail = info.get('thumbnails')[0]['url']
-
+        self._cancel_prewarm()
+        self._resumes = 0
+        self._stopping = False
+        # Taken before the first await, commands arriving meanwhile see the player as busy
         self.current_track = track
+        if source is None and not resolver.is_resolved(track) and not audio_cache.covers(track):
+            try:
+                with metrics.span('resolve'):
+                    await prefetcher.ensure(track)
+            except Exception as ex:
+                metrics.error('play')
+                outboxes.post(self.channel, f'Could not play `{track.info.title or track.info.webpage_url}`.\n'
+                                            f'{CODE_BLOCK}css\n{ex}\n{CODE_BLOCK}', delete_after=15)
+                self.playlist.discard(track)
+                self.next_track(ex)
+                return
+
+        audio_cache.record_play(track)
+        # Songs requested by url or search are resolved before they are queued and never prefetched
+        audio_cache.maybe_fill(track)
 
         self.playlist.play_history.append(self.current_track)
 
-        self.guild.voice_client.play(discord.FFmpegPCMAudio(
-            track.url,
-            before_options='-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'),
-            after=lambda err: self.next_track(err)
-        )
-        self.np_message = await self.channel.send(embed=track.create_embed())
-        self.playlist.play_queue.popleft()
+        if source is None:
+            with metrics.span('ffmpeg_spawn'):
+                source = await create_source(track, offset)
+            source.on_first_frame = self._first_frame
+            self._play_started = time.perf_counter()
+            self.guild.voice_client.play(source, after=self._after)
+        self.source = source
+        self.journal.play(track, self.channel.id if self.channel else None,
+                          self.guild.voice_client.channel.id, source.offset)
+        with metrics.span('np_send'):
+            self.np_message = await self.channel.send(embed=track.create_embed())
+        # Queue edits during the awaits above may have moved the track away from the front
+        self.playlist.discard(track)
+        prefetcher.schedule(self.playlist)
+        self._continue_playlist()
+        if GAPLESS:
+            self._prewarm_task = asyncio.create_task(self._prewarm_next(source))
         await self.next.wait()
+        # Remove "Now Playing" message of the song that ended
+        outboxes.delete_later(self.np_message)
+
+    def _upcoming(self):
+        """
+        Track that will be played after the current one.
+        """
+        if self.playlist.loop:
+            return self.current_track
+        return self.playlist.play_queue[0] if self.playlist.play_queue else None
+
+    async def _prewarm_next(self, playing: TrackSource):
+        """
+        Spawn and buffer ffmpeg of the next track shortly before the current one ends.
+        """
+        while True:
+            remaining = (playing.track.info.duration or 0) - playing.elapsed - GAPLESS_PREWARM
+            if remaining <= 0:
+                break
+            await asyncio.sleep(min(remaining, 5))
+
+        track = self._upcoming()
+        if track is None:
+            return
+        if not resolver.is_resolved(track) and not audio_cache.covers(track):
+            try:
+                await prefetcher.ensure(track)
+            except Exception:
+                # play_track retries and reports it
+                return
+        source = await create_source(track)
+        source.on_first_frame = self._first_frame
         try:
-            # Remove "Now Playing" message of the song that ended
-            await self.np_message.delete()
-        except discord.HTTPException:
-            pass
-        for track in list(self.playlist.play_queue)[1:MAX_PRELOAD + 1]:
-            asyncio.ensure_future(self.preload(track))
-
-    def next_track(self, error):
-        next_track = self.playlist.next()
+            await asyncio.get_running_loop().run_in_executor(None, source.prewarm)
+        except asyncio.CancelledError:
+            source.cleanup()
+            raise
+        if self._upcoming() is not track:
+            source.cleanup()
+            return
+        self._prewarmed = source
+
+    def _head_changed(self):
+        """
+        Called by the playlist when the track after the current one may have changed.
+
+        A prewarmed source of the former next track is dropped here on the event loop,
+        so the audio thread never has to look at the queue.
+        """
+        if self._prewarm_task is None or not self._prewarm_task.done():
+            # Not prewarmed yet, the task checks the upcoming track once it is
+            return
+        self._cancel_prewarm()
+        if GAPLESS and self.source is not None:
+            self._prewarm_task = asyncio.create_task(self._prewarm_next(self.source))
+
+    def _cancel_prewarm(self):
+        if self._prewarm_task is not None:
+            self._prewarm_task.cancel()
+            self._prewarm_task = None
+        source, self._prewarmed = self._prewarmed, None
+        if source is not None:
+            source.cleanup()
+
+    def _first_frame(self, now: float):
+        """
+        Called from the audio thread when a source delivers its first frame.
+        """
+        ended_at, self._ended_at = self._ended_at, None
+        if ended_at is not None:
+            self.gaps.append(now - ended_at)
+            metrics.gaps.observe(now - ended_at)
+        play_started, self._play_started = self._play_started, None
+        if play_started is not None:
+            metrics.observe('first_frame', now - play_started)
+        requested_at, self._requested_at = self._requested_at, None
+        if requested_at is not None:
+            metrics.observe('request_to_audio', now - requested_at)
+
+    def _after(self, error):
+        """
+        Called from the audio thread once the source is exhausted or stopped.
+
+        Switch to the prewarmed source right here, everything else happens on the event loop.
+        The prewarmed source always is the one of the upcoming track, queue edits drop it on the event loop.
+        """
+        ended = self.source
+        if self._interrupted(ended, error):
+            self.bot.loop.call_soon_threadsafe(self._start_resume, ended)
+            return
+        self._ended_at = time.perf_counter()
+        source, self._prewarmed = self._prewarmed, None
+        if source is not None:
+            if error is None:
+                try:
+                    self.guild.voice_client.play(source, after=self._after)
+                except discord.ClientException:
+                    source.cleanup()
+                    source = None
+            else:
+                source.cleanup()
+                source = None
+        self.bot.loop.call_soon_threadsafe(self.next_track, error, source)
+
+    def _interrupted(self, source: TrackSource, error) -> bool:
+        """
+        Whether the source ended before its track: the stream died or voice stayed disconnected for too long.
+        Called from the audio thread.
+        """
+        if self._stopping or source is None or source.track is not self.current_track \
+                or self._resume_task is not None:
+            return False
+        duration = source.track.info.duration
+        if not duration or duration - source.elapsed < END_MARGIN:
+            return False
+        if error is not None or source.exhausted:
+            return True
+        # Stopped before the end is a skip, unless discord.py gave up waiting for voice to reconnect
+        voice_client = self.guild.voice_client
+        return voice_client is not None and not voice_client.is_connected()
+
+    def _start_resume(self, ended: TrackSource):
+        self._resume_task = asyncio.create_task(self._resume(ended))
+
+    async def _wait_voice(self) -> discord.VoiceClient or None:
+        deadline = time.monotonic() + RESUME_VOICE_TIMEOUT
+        while True:
+            voice_client = self.guild.voice_client
+            if voice_client is None or voice_client.is_connected():
+                return voice_client
+            if time.monotonic() > deadline:
+                return None
+            await asyncio.sleep(0.5)
+
+    async def _resume(self, ended: TrackSource):
+        """
+        Respawn the stream of an interrupted track where it stopped, without moving on in the queue.
+
+        The stream url is reused while it lasts for the rest of the track. A track that keeps failing to play
+        is skipped after RESUME_ATTEMPTS, one whose voice connection is gone is put back in the queue.
+        """
+        track = ended.track
+        offset = ended.elapsed
+        self._resumes = 0 if ended.played >= RESUME_PROGRESS else self._resumes + 1
+        metrics.error('stream_interrupted')
+        self._cancel_prewarm()
+        try:
+            if self._resumes >= RESUME_ATTEMPTS:
+                raise RuntimeError(f'interrupted {self._resumes} times in a row')
+            if await self._wait_voice() is None:
+                logging.info(f'Resume: voice connection of {self.guild} is gone, requeued {track.info.title}')
+                self._resume_task = None
+                self._requeue(track)
+                return
+            # Guilds interrupted by the same outage do not all respawn ffmpeg at the same moment
+            await asyncio.sleep(random.uniform(0, RESUME_JITTER))
+            async with resume_limit():
+                with metrics.span('resume'):
+                    if not audio_cache.covers(track) \
+                            and not stream_is_fresh(track.url, track.info.duration - offset):
+                        await resolver.resolve_track(track)
+                    source = await create_source(track, offset)
+            voice_client = self.guild.voice_client
+            if voice_client is None or voice_client.is_playing():
+                source.cleanup()
+                raise RuntimeError('voice client is gone or busy')
+            source.on_first_frame = self._first_frame
+            voice_client.play(source, after=self._after)
+        except Exception as ex:
+            logging.warning(f'Resume: could not resume {track.info.title} in {self.guild}\n{ex}')
+            self._resume_task = None
+            self.next_track(ex)
+            return
+        self._resume_task = None
+        self.source = source
+        self.journal.position(offset)
+        if GAPLESS:
+            self._prewarm_task = asyncio.create_task(self._prewarm_next(source))
+        logging.info(f'Resume: {track.info.title} at {offset:.0f}s in {self.guild}')
+
+    def _cancel_resume(self) -> bool:
+        if self._resume_task is None:
+            return False
+        self._resume_task.cancel()
+        self._resume_task = None
+        return True
+
+    def _requeue(self, track):
+        """
+        Put the track back in front of the queue and stop, the next play starts with it.
+        """
+        self.playlist.requeue(track)
         self.current_track = None
+        self.source = None
+        self.next.set()
+        self.journal.end()
+
+    def next_track(self, error, source: TrackSource = None):
+        self.current_track = None
+        self.source = None
+        next_track = self.playlist.next()
 
         self.next.set()
         if next_track is None:
+            # Nothing left to restore, drops the journal
+            self.journal.compact()
+            if source is not None:
+                self.guild.voice_client.stop()
             return
+        self.journal.end()
 
-        coro = self.play_track(next_track)
+        # The gapless source plays its own track, wherever queue edits since the switch moved it
+        coro = self.play_track(source.track if source is not None else next_track, source)
         self.bot.loop.create_task(coro)
 
     async def prev_track(self):
 
-        self.timer.cancel()
-        self.timer = utils.Timer(self.timeout_handler)
+        self.reset_timeout()
 
         if len(self.playlist.play_history) == 0:
             return
+        if self.current_track is not None and self.source is None:
+            # The current track is still starting
+            return
 
         prev_track = self.playlist.prev(self.current_track)
 
@@ -103,84 +390,124 @@ class MusicPlayer(object):
         else:
             self.guild.voice_client.stop()
 
-    async def process_playlist(self, ctx: commands.Context, search, start_pos: int = 0):
-        composed_msg = f'**Added**'
-        excluded = []
-        with yt_dlp.YoutubeDL(
-                {
-                    'format': 'bestaudio/best',
-                    'extract_flat': True,
-                    'playliststart': start_pos,
-                    'playlistend': start_pos + MAX_PLAYLIST_LEN + 1
-                }
-        ) as ytdl:
-            info = ytdl.extract_info(search, download=False)
-        entries = info.get('entries')
-        for entry in entries:
-            track_duration = entry.get('duration')
-            if track_duration is None or track_duration > MAX_SONG_DURATION:
-                excluded.append(entry.get('title') if track_duration else entry.get('url'))
-                continue
-            track_obj = Track(
-                requester=ctx.author,
-                title=entry.get('title'),
-                webpage_url=entry.get('url')
-            )
-            self.playlist.add(track_obj)
-            composed_msg += f'\n`{track_obj.info.title}`'
-
-        composed_msg = f'{composed_msg} to the Queue.\n\n'
-        if excluded:
-            composed_msg += '\n**Excluded (song is private or too long)**\n'
-            composed_msg += '\n'.join(f'`{track}`' for track in excluded)
-
-        while len(composed_msg) > 2000:
-            part_1 = composed_msg[:2000]
-            slice_index = part_1.rfind('\n')
-            part_1 = part_1[:slice_index]
-            composed_msg = '...' + composed_msg[slice_index:]
-            await ctx.send(part_1, delete_after=25)
-
-        await ctx.send(composed_msg, delete_after=25)
-        for track in list(self.playlist.play_queue)[1:MAX_PRELOAD + 1]:
-            asyncio.ensure_future(self.preload(track))
-
-    async def preload(self, track_obj):
-        if track_obj.info.duration is not None:
-            return
-
-        def download(track):
-            if track.info.webpage_url is None:
-                print(f'{track.info.webpage_url = }')
-                return None
-
-            ytdl = yt_dlp.YoutubeDL({'format': 'bestaudio/best', 'title': True})
-            info = ytdl.extract_info(track.info.webpage_url, download=False)
-            track.url = info.get('url')
-            track.info.uploader = info.get('uploader')
-            track.info.title = info.get('title')
-            track.info.duration = info.get('duration')
-            track.info.webpage_url = info.get('webpage_url')
-            track.info.thumbnail = info.get('thumbnails')[0]['url']
-
-        loop = asyncio.get_event_loop()
-        executor = concurrent.futures.ThreadPoolExecutor(max_workers=5)
-        await asyncio.wait(fs={loop.run_in_executor(executor, download, track_obj)}, return_when=asyncio.ALL_COMPLETED)
+    def _continue_playlist(self):
+        """
+        Enqueue the next window of a long playlist once the queue runs low.
+        """
+        if self.playlist.continuation is None or len(self.playlist) > MAX_PRELOAD:
+            return
+        if self._ingest_task is not None and not self._ingest_task.done():
+            return
+        ctx, search, start = self.playlist.continuation
+        self.playlist.continuation = None
+        self._ingest_task = asyncio.create_task(self.process_playlist(ctx, search, start))
 
-    def search_youtube(self, search: str):
-        with yt_dlp.YoutubeDL({'format': 'bestaudio/best', 'default_search': 'auto', 'noplaylist': True}) as ytdl:
-            info = ytdl.extract_info(search, download=False)
+    async def process_playlist(self, ctx: commands.Context, search, start: int = 0):
+        """
+        Enqueue up to MAX_PLAYLIST_LEN entries from `start` while the extractor pages through the playlist.
 
-        if info is None:
-            return None
+        Playback begins with the first playable entry, the rest is reported in one progressively edited message.
+        """
+        added = []
+        excluded = []
+        duplicates = 0
+        skip_duplicates = self.skip_duplicates
+        playback = None
+        message = None
+        last_edit = 0
+        more = False
+
+        def summary(done: bool) -> str:
+            text = f'**{"Added" if done else "Adding"}** {len(added)} song(s) to the Queue{"." if done else "..."}\n'
+            if len(added) > 10:
+                text += '...\n'
+            text += '\n'.join(f'`{title}`' for title in added[-10:])
+            if duplicates:
+                text += f'\n\n**Skipped {duplicates} already queued**'
+            if excluded:
+                text += '\n\n**Excluded (song is private or too long)**\n'
+                text += '\n'.join(f'`{track}`' for track in excluded)
+            if more:
+                text += '\n\nThe rest of the playlist is added when the queue runs low.'
+            if len(text) > 2000:
+                text = text[:text.rfind('\n', 0, 1996)] + '\n...'
+            return text
+
+        entries = resolver.iter_entries(search, start=start, stop=start + MAX_PLAYLIST_LEN + 1)
+        try:
+            index = start
+            async for entry in entries:
+                if index == start + MAX_PLAYLIST_LEN or self.playlist.is_full:
+                    # One entry past the window tells that the playlist goes on
+                    more = True
+                    break
+                index += 1
+                if entry.get('duration') is None:
+                    # Flat entries of some playlists come without duration, the store may know it
+                    known = await metadata_store.fetch(entry.get('url'))
+                    if known:
+                        entry = {**known, **{key: value for key, value in entry.items() if value is not None}}
+                metadata_store.put(entry)
+                track_duration = entry.get('duration')
+                if track_duration is None or track_duration > MAX_SONG_DURATION:
+                    excluded.append(entry.get('title') if track_duration else entry.get('url'))
+                    continue
+                thumbnails = entry.get('thumbnails')
+                track_obj = Track(
+                    requester=ctx.author,
+                    uploader=entry.get('uploader') or entry.get('channel'),
+                    title=entry.get('title'),
+                    duration=track_duration,
+                    webpage_url=entry.get('url'),
+                    thumbnail=thumbnails[-1]['url'] if thumbnails else None
+                )
+                if not self.playlist.add(track_obj, skip_duplicates):
+                    duplicates += 1
+                    continue
+                added.append(track_obj.info.title)
+
+                if playback is None and self.current_track is None:
+                    # Start playing while the rest of the playlist is still paged in
+                    playback = asyncio.create_task(self.play_track(track_obj))
+                    prefetcher.schedule(self.playlist)
+                    # Entries already waiting are taken without suspending, let the resolve of this one start first
+                    await asyncio.sleep(0)
+
+                if time.monotonic() - last_edit > PLAYLIST_SUMMARY_INTERVAL:
+                    last_edit = time.monotonic()
+                    if message is None:
+                        message = await ctx.send(summary(done=False))
+                    else:
+                        await message.edit(content=summary(done=False))
+        except Exception as ex:
+            metrics.error('process_playlist')
+            await ctx.send(f'There was an error processing your request.\n'
+                           f'{CODE_BLOCK}css\n{ex}\n{CODE_BLOCK}')
+        finally:
+            await entries.aclose()
+
+        if more:
+            self.playlist.continuation = (ctx, search, index)
+        if message is None:
+            message = await ctx.send(summary(done=True))
+        else:
+            await message.edit(content=summary(done=True))
+        outboxes.delete_later(message, 25)
+        prefetcher.schedule(self.playlist)
+        if playback is not None:
+            await playback
 
-        return info['entries'][0]
+    async def search_youtube(self, search: str):
+        return await resolver.search(search)
 
     async def process_track(self, ctx: commands.Context, search: str):
+        started = time.perf_counter()
+        if self.current_track is None:
+            self._requested_at = started
         await ctx.typing()
         result = urlparse(search)
         if 'start_radio' in result.query:
-            await ctx.channel.send('You can\'t request YouTube Mixes. Sorry.', delete_after=15)
+            outboxes.post(ctx.channel, 'You can\'t request YouTube Mixes. Sorry.', delete_after=15)
             return
         if result.path == '/playlist' or 'list=' in result.query:
             link_params = parse_qs(search)
@@ -193,29 +520,31 @@ class MusicPlayer(object):
             id_list = link_params.get('list') \
                       or [val for key, val in link_params.items() if 'list' in key][0]  # Scuffed fix for youtu.be
             search = f'https://www.youtube.com/playlist?list={id_list[0]}'
+            metrics.observe('parse', time.perf_counter() - started)
 
-            await self.process_playlist(ctx, search, start_pos)
-            if self.current_track is None:
-                await self.play_track(self.playlist.play_queue[0])
-                return
-        if not result.scheme:
-            info = self.search_youtube(search)
-            if info is None:
-                await ctx.channel.send('Could not find anything on YouTube. Sorry.')
-                return
-        else:
-            try:
-                ytdl = yt_dlp.YoutubeDL({'format': 'bestaudio/best', 'title': True})
-
+            # 'index' counts from 1
+            await self.process_playlist(ctx, search, max(start_pos - 1, 0))
+            return
+        metrics.observe('parse', time.perf_counter() - started)
+        try:
+            if not result.scheme:
+                with metrics.span('search'):
+                    info = await self.search_youtube(search)
+                if info is None:
+                    await ctx.channel.send('Could not find anything on YouTube. Sorry.')
+                    return
+            else:
                 try:
-                    info = ytdl.extract_info(search, download=False)
-                except Exception as ex:
-                    await self.channel.send(f'There was an error processing your request.\n'
-                                            f'{CODE_BLOCK}css\n{ex}\n{CODE_BLOCK}')
-                    return None
-            except Exception as ex:
-                ytdl = yt_dlp.YoutubeDL({'title': True})
-                info = ytdl.extract_info(search, download=False)
+                    with metrics.span('lookup'):
+                        info = await resolver.lookup(search)
+                except yt_dlp.utils.DownloadError:
+                    # No audio-only format, let yt-dlp pick whatever is available
+                    info = await resolver.resolve(search, profile='fallback')
+        except Exception as ex:
+            metrics.error('process_track')
+            await self.channel.send(f'There was an error processing your request.\n'
+                                    f'{CODE_BLOCK}css\n{ex}\n{CODE_BLOCK}')
+            return None
 
         if info.get('thumbnails') is not None:
             thumbnail = info.get('thumbnails')[len(info.get('thumbnails')) - 1]['url']
@@ -226,6 +555,7 @@ class MusicPlayer(object):
             return
         track_obj = Track(
             url=info.get('url'),
+            codec=info.get('acodec'),
             requester=ctx.author,
             uploader=info.get('uploader'),
             title=info.get('title'),
@@ -234,18 +564,103 @@ class MusicPlayer(object):
             thumbnail=thumbnail
         )
 
-        self.playlist.add(track_obj)
+        if self.playlist.is_full:
+            outboxes.post(ctx.channel, f'The queue is full, it holds up to {MAX_QUEUE_LEN} songs.', delete_after=15)
+            return
+        if not self.playlist.add(track_obj, self.skip_duplicates):
+            position = self.playlist.positions_of(track_obj.info.webpage_url)[0] + 1
+            outboxes.post(ctx.channel, f'`{track_obj.info.title}` is already queued at position {position}.',
+                          delete_after=15)
+            return
+        prefetcher.schedule(self.playlist)
         composed_msg = f'**Added** '
         composed_msg += f'`{track_obj.info.title}`'
-        await ctx.send(f'{composed_msg} to the Queue.', delete_after=15)
+        outboxes.post(ctx.channel, f'{composed_msg} to the Queue.', delete_after=15)
 
         if self.current_track is None:
             await self.play_track(self.playlist.play_queue[0])
 
         return
 
+    def _journal_state(self) -> dict:
+        """
+        Snapshot of everything a restart needs to continue where the player is now.
+        """
+        voice_client = self.guild.voice_client
+        playing = self.current_track is not None and self.source is not None
+        return {
+            'text': self.channel.id if self.channel else None,
+            'voice': voice_client.channel.id if voice_client else None,
+            'loop': self.playlist.loop,
+            'current': encode_track(self.current_track) if playing else None,
+            'offset': round(self.source.elapsed, 1) if playing else 0.0,
+            'queue': [encode_track(track) for track in self.playlist.play_queue],
+            'history': [encode_track(track) for track in list(self.playlist.play_history)[-HISTORY_KEPT:]],
+        }
+
+    async def restore(self, state: dict):
+        """
+        Rebuild the queue from a journal replay and resume the track that was playing at its last recorded position.
+
+        Tracks keep the metadata and stream url they were journaled with, nothing is resolved up front.
+        """
+        guild = self.guild
+        current = decode_track(state['current'], guild) if state['current'] else None
+        # The current track is the last one of the history, play_track adds it again
+        history = state['history'][:-1] if current is not None else state['history']
+
+        self.playlist.journal = None
+        for fields in history:
+            self.playlist.play_history.append(decode_track(fields, guild))
+        if current is not None:
+            self.playlist.add(current)
+        for fields in state['queue']:
+            self.playlist.add(decode_track(fields, guild))
+        self.playlist.loop = state['loop']
+        self.playlist.journal = self.journal
+        self.journal.compact()
+
+        self.channel = guild.get_channel(state['text']) if state['text'] else None
+        voice_channel = guild.get_channel(state['voice']) if state['voice'] else None
+        if current is None or self.channel is None or voice_channel is None or guild.voice_client is not None:
+            return
+        if not any(not member.bot for member in voice_channel.members):
+            # Everyone left while the bot was down, keep the queue for the next ~play
+            return
+        try:
+            await voice_channel.connect()
+        except (asyncio.TimeoutError, discord.ClientException) as ex:
+            logging.warning(f'Journal: could not rejoin {voice_channel} in {guild}\n{ex}')
+            return
+        asyncio.create_task(self.play_track(current, offset=state['offset']))
+
+    def is_idle(self) -> bool:
+        return self.guild.voice_client is None and self.current_track is None and len(self.playlist) == 0
+
+    def close(self):
+        """
+        Release tasks and subprocesses of the player before dropping it.
+        """
+        deadlines.cancel(self.guild.id)
+        self._cancel_resume()
+        self._cancel_prewarm()
+        prefetcher.cancel(self.playlist)
+        if self._ingest_task is not None:
+            self._ingest_task.cancel()
+            self._ingest_task = None
+        if self.queue_view is not None:
+            self.queue_view.stop()
+            self.queue_view = None
+
     async def stop_player(self):
+        resuming = self._cancel_resume()
+        self._cancel_prewarm()
         self.playlist.loop = False
         self.playlist.next()
         self.playlist.clear()
+        # Set before stopping, ~leave and the inactivity timeout disconnect before the after callback runs
+        self._stopping = True
         self.guild.voice_client.stop()
+        if resuming:
+            # Nothing is playing, no after callback ends the track
+            self.next_track(None)
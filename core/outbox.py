@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import re
+import time
+
+import discord
+
+from config import OUTBOX_COALESCE_WINDOW, OUTBOX_EDIT_WINDOW, OUTBOX_DELETE_SLACK, OUTBOX_BACKOFF
+
+MESSAGE_LIMIT = 2000
+BULK_DELETE_LIMIT = 100
+BULK_DELETE_MAX_AGE = 14 * 24 * 60 * 60 - 60  # Discord refuses to bulk delete messages older than two weeks
+
+_CHANNEL_ROUTE = re.compile(r'/channels/(\d+)/')
+
+
+def _split(content: str) -> list:
+    """
+    Message sized chunks of the content, cut at line breaks where possible.
+    """
+    chunks = []
+    while len(content) > MESSAGE_LIMIT:
+        cut = content.rfind('\n', 0, MESSAGE_LIMIT)
+        if cut <= 0:
+            cut = MESSAGE_LIMIT
+        chunks.append(content[:cut])
+        content = content[cut:].lstrip('\n')
+    if content:
+        chunks.append(content)
+    return chunks
+
+
+class Outbox:
+    """
+    Outbound status messages of one channel.
+
+    Messages posted within the coalescing window go out as one message, or as an edit of the previous one
+    while it is still fresh. Scheduled deletions that fall due together are sent as one bulk delete.
+    """
+    __slots__ = ('channel', 'window', 'on_idle', 'sent', 'edited', 'merged', 'deleted', 'rate_limited',
+                 '_pending', '_flush_task', '_last', '_deletions', '_delete_task', '_wakeup', '_backoff_until')
+
+    def __init__(self, channel, window: float = OUTBOX_COALESCE_WINDOW, on_idle=None):
+        self.channel = channel
+        self.window = window
+        self.on_idle = on_idle
+        self.sent = 0
+        self.edited = 0
+        self.merged = 0
+        self.deleted = 0
+        self.rate_limited = 0
+        self._pending = []  # (content, delete_after)
+        self._flush_task = None
+        self._last = None  # (message, content, delete_after, sent at) of the latest status message
+        self._deletions = {}  # message id -> (deadline, message)
+        self._delete_task = None
+        self._wakeup = asyncio.Event()  # Set when a deletion falls due earlier than the one waited for
+        self._backoff_until = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending) + len(self._deletions)
+
+    @property
+    def idle(self) -> bool:
+        return self._flush_task is None and self._delete_task is None
+
+    def post(self, content: str, delete_after: float = None):
+        """
+        Queue a status message. Returns right away, the message is sent after the coalescing window.
+        """
+        self._pending.append((content, delete_after))
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush())
+
+    def delete_later(self, message: discord.Message, delay: float = 0):
+        deadline = time.monotonic() + delay
+        self._deletions[message.id] = (deadline, message)
+        if self._delete_task is None:
+            self._delete_task = asyncio.create_task(self._delete_due())
+        else:
+            self._wakeup.set()
+
+    def record_rate_limit(self):
+        self.rate_limited += 1
+        self._backoff_until = time.monotonic() + OUTBOX_BACKOFF
+
+    async def _flush(self):
+        try:
+            while self._pending:
+                # Wait longer for more messages to merge while Discord is throttling the channel
+                backoff = time.monotonic() < self._backoff_until
+                await asyncio.sleep(self.window * (4 if backoff else 1))
+                pending, self._pending = self._pending, []
+                # Temporary and permanent messages are never merged into each other
+                for temporary in (True, False):
+                    batch = [(content, delete_after) for content, delete_after in pending
+                             if (delete_after is not None) == temporary]
+                    if batch:
+                        self.merged += len(batch) - 1
+                        await self._send('\n'.join(content for content, _ in batch),
+                                         max(delete_after for _, delete_after in batch) if temporary else None)
+        except Exception as ex:
+            logging.warning(f'Outbox: failed to send to {self.channel}\n{ex}')
+        finally:
+            self._flush_task = None
+            self._maybe_idle()
+
+    async def _send(self, content: str, delete_after: float or None):
+        now = time.monotonic()
+        if self._last is not None:
+            message, last_content, last_delete_after, sent_at = self._last
+            combined = f'{last_content}\n{content}'
+            if now - sent_at < OUTBOX_EDIT_WINDOW and len(combined) <= MESSAGE_LIMIT \
+                    and (last_delete_after is None) == (delete_after is None):
+                try:
+                    await message.edit(content=combined)
+                except discord.NotFound:
+                    pass
+                else:
+                    self.edited += 1
+                    self._last = (message, combined, delete_after, sent_at)
+                    if delete_after is not None:
+                        self.delete_later(message, delete_after)
+                    return
+
+        for chunk in _split(content):
+            message = await self.channel.send(chunk)
+            self.sent += 1
+            self._last = (message, chunk, delete_after, time.monotonic())
+            if delete_after is not None:
+                self.delete_later(message, delete_after)
+
+    async def _delete_due(self):
+        try:
+            while self._deletions:
+                deadline = min(deadline for deadline, _ in self._deletions.values())
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.0, deadline - time.monotonic()))
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+                # Take whatever falls due shortly after as well, one bulk delete instead of several
+                horizon = time.monotonic() + OUTBOX_DELETE_SLACK
+                due = [message for deadline, message in self._deletions.values() if deadline <= horizon]
+                for message in due:
+                    del self._deletions[message.id]
+                    if self._last is not None and self._last[0].id == message.id:
+                        self._last = None
+                await self._delete(due)
+        finally:
+            self._delete_task = None
+            self._maybe_idle()
+
+    def _can_bulk_delete(self) -> bool:
+        guild = getattr(self.channel, 'guild', None)
+        if guild is None or not hasattr(self.channel, 'delete_messages'):
+            return False
+        return self.channel.permissions_for(guild.me).manage_messages
+
+    async def _delete(self, messages: list):
+        single = messages
+        if len(messages) > 1 and self._can_bulk_delete():
+            cutoff = discord.utils.utcnow().timestamp() - BULK_DELETE_MAX_AGE
+            recent = [message for message in messages if message.created_at.timestamp() > cutoff]
+            single = [message for message in messages if message.created_at.timestamp() <= cutoff]
+            for start in range(0, len(recent), BULK_DELETE_LIMIT):
+                chunk = recent[start:start + BULK_DELETE_LIMIT]
+                try:
+                    await self.channel.delete_messages(chunk)
+                    self.deleted += len(chunk)
+                except discord.HTTPException:
+                    # E.g. one of them is gone already, fall back to deleting one by one
+                    single.extend(chunk)
+
+        for message in single:
+            try:
+                await message.delete()
+                self.deleted += 1
+            except discord.HTTPException:
+                pass
+
+    def _maybe_idle(self):
+        if self.idle and not self._pending and self.on_idle is not None:
+            self.on_idle(self)
+
+
+class Outboxes:
+    """
+    Outbox of every channel the bot currently talks to, created on first use and dropped once it has
+    nothing left to send or delete.
+    """
+    __slots__ = ('_boxes', 'rate_limited', '_totals')
+
+    def __init__(self):
+        self._boxes = {}  # channel id -> Outbox
+        self.rate_limited = 0
+        self._totals = {'sent': 0, 'edited': 0, 'merged': 0, 'deleted': 0}
+
+    def get(self, channel) -> Outbox:
+        outbox = self._boxes.get(channel.id)
+        if outbox is None:
+            outbox = self._boxes[channel.id] = Outbox(channel, on_idle=self._release)
+        return outbox
+
+    def post(self, channel, content: str, delete_after: float = None):
+        self.get(channel).post(content, delete_after)
+
+    def delete_later(self, message: discord.Message, delay: float = 0):
+        self.get(message.channel).delete_later(message, delay)
+
+    def _release(self, outbox: Outbox):
+        if self._boxes.get(outbox.channel.id) is not outbox:
+            return
+        del self._boxes[outbox.channel.id]
+        for key in self._totals:
+            self._totals[key] += getattr(outbox, key)
+
+    def record_rate_limit(self, channel_id: int or None):
+        self.rate_limited += 1
+        outbox = self._boxes.get(channel_id)
+        if outbox is not None:
+            outbox.record_rate_limit()
+
+    def stats(self) -> dict:
+        stats = {'channels': len(self._boxes), 'depth': 0, 'rate_limited': self.rate_limited, **self._totals}
+        for outbox in self._boxes.values():
+            stats['depth'] += outbox.depth
+            for key in self._totals:
+                stats[key] += getattr(outbox, key)
+        return stats
+
+
+class RateLimitCounter(logging.Handler):
+    """
+    Counts the 429 responses discord.py reports, per channel where the route names one.
+    """
+
+    def __init__(self, outboxes: Outboxes):
+        super().__init__(logging.WARNING)
+        self.outboxes = outboxes
+
+    def emit(self, record: logging.LogRecord):
+        if not str(record.msg).startswith('We are being rate limited'):
+            return
+        match = _CHANNEL_ROUTE.search(str(record.args[1])) if record.args and len(record.args) > 1 else None
+        self.outboxes.record_rate_limit(int(match[1]) if match else None)
+
+
+outboxes = Outboxes()
+logging.getLogger('discord.http').addHandler(RateLimitCounter(outboxes))
@@ -1,27 +1,140 @@
 import itertools
-import random
-from collections import deque
 
 import discord
 
+from config import MAX_QUEUE_LEN
+from core.prefetch import prefetcher
+from core.track_queue import TrackQueue, TrackHistory
+from core.utils import canonical_url
+
+SONGS_PER_PAGE = 15
+
 
 class Playlist:
-    __slots__ = ('play_queue', 'play_history', 'loop')
+    __slots__ = ('play_queue', 'play_history', 'continuation', 'journal', 'on_head_change', 'version', '_loop',
+                 '_by_requester', '_by_video', '_pages', '_history_page')
 
     def __init__(self):
-        self.play_queue = deque()
-        self.play_history = deque()
-        self.loop = False
+        self.play_queue = TrackQueue()
+        self.play_history = TrackHistory()
+        self._loop = False
+        self.continuation = None  # (ctx, playlist url, index) of the playlist window to enqueue next
+        self.journal = None  # GuildJournal recording every change of the queue
+        self.on_head_change = None  # Called when the track to play next may have changed
+        # Secondary indexes of queued tracks: key -> {queue node: None}
+        self._by_requester = {}
+        self._by_video = {}
+        # Rendered queue pages: page index -> description, dropped by edits at or before the page
+        self.version = 0
+        self._pages = {}
+        self._history_page = None  # (history version, description)
 
     def __len__(self):
         return len(self.play_queue)
 
-    def add(self, track):
-        self.play_queue.append(track)
+    @property
+    def loop(self) -> bool:
+        return self._loop
+
+    @loop.setter
+    def loop(self, loop: bool):
+        changed = loop != self._loop
+        self._loop = loop
+        if changed and self.journal is not None:
+            self.journal.set_loop(loop)
+        if changed and self.on_head_change is not None:
+            self.on_head_change()
+
+    @staticmethod
+    def _keys(track) -> tuple:
+        requester_id = getattr(track.requester, 'id', None)
+        video_key = canonical_url(track.info.webpage_url) if track.info.webpage_url else None
+        return requester_id, video_key
+
+    def _index(self, node):
+        # Resolving the track rewrites its url, unindexing goes by the keys it was filed under
+        node.keys = requester_id, video_key = self._keys(node.value)
+        self._by_requester.setdefault(requester_id, {})[node] = None
+        if video_key is not None:
+            self._by_video.setdefault(video_key, {})[node] = None
+
+    def _unindex(self, node):
+        requester_id, video_key = node.keys
+        for index, key in ((self._by_requester, requester_id), (self._by_video, video_key)):
+            nodes = index.get(key)
+            if nodes is None:
+                continue
+            nodes.pop(node, None)
+            if not nodes:
+                del index[key]
+
+    def _touch(self, start: int = 0, stop: int = None):
+        """
+        Forget rendered pages showing positions start..stop (inclusive, None for the end of the queue).
+        """
+        self.version += 1
+        if start == 0 and self.on_head_change is not None:
+            self.on_head_change()
+        first = start // SONGS_PER_PAGE
+        last = None if stop is None else stop // SONGS_PER_PAGE
+        for page in [page for page in self._pages if page >= first and (last is None or page <= last)]:
+            del self._pages[page]
+
+    def _insert(self, pos, track):
+        self._index(self.play_queue.insert(pos, track))
+        self._touch(min(max(pos, 0), len(self.play_queue) - 1))
+        if self.journal is not None:
+            self.journal.insert(pos, track)
+
+    def _remove(self, pos):
+        node = self.play_queue.pop_node(pos)
+        self._touch(pos if pos >= 0 else pos + len(self.play_queue) + 1)
+        self._unindex(node)
+        if self.journal is not None:
+            self.journal.remove(pos)
+        return node.value
+
+    def _reset_journal(self):
+        # Bulk changes are journaled as a new snapshot instead of one record per track
+        if self.journal is not None:
+            self.journal.reset()
+
+    @property
+    def is_full(self) -> bool:
+        return len(self.play_queue) >= MAX_QUEUE_LEN
+
+    def add(self, track, skip_duplicates: bool = False) -> bool:
+        """
+        Enqueue the track, unless the queue is full.
+        With `skip_duplicates` a track that is already queued is not added again.
+        """
+        if self.is_full or skip_duplicates and self.is_queued(track.info.webpage_url):
+            return False
+        self._insert(len(self.play_queue), track)
+        return True
+
+    def requeue(self, track):
+        """
+        Put the track back in front of the queue.
+        """
+        self._insert(0, track)
+        prefetcher.schedule(self)
+
+    def discard(self, track) -> bool:
+        """
+        Remove the track object itself from the queue, wherever edits moved it. Returns whether it was queued.
+        """
+        # The requester, unlike the url, stays the same when the track is resolved
+        nodes = self._by_requester.get(getattr(track.requester, 'id', None), {})
+        ranks = self.play_queue.ranks(node for node in nodes if node.value is track)
+        if not ranks:
+            return False
+        self._remove(min(ranks.values()))
+        return True
 
     def next(self):
         if self.loop:
-            self.play_queue.appendleft(self.play_history[-1])
+            self._insert(0, self.play_history[-1])
 
         if len(self.play_queue) == 0:
             return None
@@ -32,54 +145,134 @@ class Playlist:
         return self.play_queue[0]
 
     def delete(self, pos):
-        track = self.play_queue[pos]
-        del self.play_queue[pos]
+        track = self._remove(pos)
+        prefetcher.schedule(self)
         return track
 
+    def move(self, src, dst):
+        self.play_queue.move(src, dst)
+        # Only positions between the two indexes shift
+        self._touch(min(src, dst), max(src, dst))
+        if self.journal is not None:
+            self.journal.move(src, dst)
+        prefetcher.schedule(self)
+        return self.play_queue[dst]
+
+    def jump(self, pos):
+        """
+        Make the track at pos the next one to play.
+        """
+        return self.move(pos, 0)
+
+    def is_queued(self, webpage_url: str) -> bool:
+        return bool(webpage_url) and canonical_url(webpage_url) in self._by_video
+
+    def positions_of(self, webpage_url: str) -> list:
+        nodes = self._by_video.get(canonical_url(webpage_url), {}) if webpage_url else {}
+        return sorted(self.play_queue.ranks(nodes).values())
+
+    def positions_by_requester(self, requester_id: int) -> list:
+        return sorted(self.play_queue.ranks(self._by_requester.get(requester_id, {})).values())
+
+    def remove_by_requester(self, requester_id: int) -> int:
+        """
+        Remove every queued track of the user. Returns amount of removed tracks.
+        """
+        nodes = list(self._by_requester.get(requester_id, {}))
+        if nodes:
+            self._touch(min(self.play_queue.ranks(nodes).values()))
+        self.play_queue.remove_nodes(nodes)
+        for node in nodes:
+            self._unindex(node)
+        if nodes:
+            prefetcher.schedule(self)
+            self._reset_journal()
+        return len(nodes)
+
+    def dedupe(self) -> int:
+        """
+        Keep only the first queued copy of every track. Returns amount of removed tracks.
+        """
+        copies = [nodes for nodes in self._by_video.values() if len(nodes) > 1]
+        ranks = self.play_queue.ranks(node for nodes in copies for node in nodes)
+        duplicates = [node for nodes in copies for node in sorted(nodes, key=ranks.get)[1:]]
+        if duplicates:
+            self._touch(min(ranks[node] for node in duplicates))
+        self.play_queue.remove_nodes(duplicates)
+        for node in duplicates:
+            self._unindex(node)
+        if duplicates:
+            prefetcher.schedule(self)
+            self._reset_journal()
+        return len(duplicates)
+
     def prev(self, current_track):
         if current_track is None:
-            self.play_queue.appendleft(self.play_history[-1])
+            self._insert(0, self.play_history[-1])
             return self.play_queue[0]
 
-        np_index = self.play_history.index(current_track)
-        self.play_queue.appendleft(self.play_history[np_index - 1])
-
-        if current_track is not None:
-            self.play_queue.insert(1, current_track)
+        # The latest entry is the current track, looped plays of it repeat it further back
+        pos = self.play_history.index(current_track) - 1
+        while pos >= 0 and self.play_history[pos] is current_track:
+            pos -= 1
+        if pos >= 0:
+            self._insert(0, self.play_history[pos])
+        self._insert(1 if pos >= 0 else 0, current_track)
 
     def shuffle(self):
-        random.shuffle(self.play_queue)
+        self.play_queue.shuffle()
+        self._touch()
+        prefetcher.schedule(self)
+        self._reset_journal()
 
     def clear(self):
         self.play_queue.clear()
         self.play_history.clear()
+        self._by_requester.clear()
+        self._by_video.clear()
+        self.continuation = None
+        self._touch()
+        prefetcher.cancel(self)
+        self._reset_journal()
 
-    def create_embed(self, title: str, page_num: int = 0) -> discord.Embed or None:
-        songs_per_page = 15
+    @property
+    def pages(self) -> int:
+        return -(-len(self.play_queue) // SONGS_PER_PAGE)
+
+    def _render_page(self, page: int) -> str:
+        text = self._pages.get(page)
+        if text is None:
+            start = page * SONGS_PER_PAGE
+            tracks = self.play_queue.slice(start, start + SONGS_PER_PAGE)
+            text = self._pages[page] = '\n'.join(f'{i}.  {track}' for i, track in enumerate(tracks, start=start + 1))
+        return text
 
+    def _render_history(self) -> str:
+        version = self.play_history.version
+        if self._history_page is None or self._history_page[0] != version:
+            tracks = itertools.islice(self.play_history, SONGS_PER_PAGE)
+            self._history_page = (version, '\n'.join(f'{i}.  {track}' for i, track in enumerate(tracks, start=1)))
+        return self._history_page[1]
+
+    def create_embed(self, title: str, page_num: int = 0) -> discord.Embed or None:
         if title == 'Recently played':
-            playlist = self.play_history
-            playlist_len = len(playlist)
-            pages_max = 1
-        else:
-            playlist = self.play_queue
-            playlist_len = len(playlist)
-            pages_max = playlist_len // songs_per_page + (playlist_len % songs_per_page > 0)
-
-            # Prioritize the first page
-            if page_num is None or page_num <= 0:
-                page_num = 0
-            elif pages_max < page_num:
-                page_num = pages_max - 1
-            else:
-                page_num = page_num - 1
-
-        if playlist_len == 0:
+            if len(self.play_history) == 0:
+                return None
+            return discord.Embed(title=title, description=self._render_history())
+
+        pages_max = self.pages
+        if pages_max == 0:
             return None
 
-        queue = list(itertools.islice(playlist, page_num * songs_per_page, songs_per_page + page_num * songs_per_page))
+        # Prioritize the first page
+        if page_num is None or page_num <= 0:
+            page_num = 0
+        elif pages_max < page_num:
+            page_num = pages_max - 1
+        else:
+            page_num = page_num - 1
 
-        fmt = '\n'.join(f'{i}.  {track}' for i, track in enumerate(queue, start=page_num * songs_per_page + 1))
+        fmt = self._render_page(page_num)
         if pages_max > 1:
             title += f' page {page_num + 1}/{pages_max}'
         return discord.Embed(title=title, description=fmt)
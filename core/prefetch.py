@@ -0,0 +1,200 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from config import MAX_PRELOAD, PREFETCH_WORKERS, PREFETCH_MAX_LOOKAHEAD
+from core.audio_cache import audio_cache
+from core.resolver import resolver
+from core.utils import canonical_url
+
+
+class PrefetchJob:
+    __slots__ = ('url', 'waiters', 'priority', 'task', 'started', 'cancelled')
+
+    def __init__(self, url: str, priority: int):
+        self.url = url
+        self.waiters = {}  # track -> playlist it is queued in, None for tracks waiting in ensure()
+        self.priority = priority
+        self.task = None
+        self.started = None
+        self.cancelled = False
+
+
+class PrefetchScheduler:
+    """
+    Resolves upcoming tracks of every guild ahead of playback.
+
+    One job per video at most, shared by every queued copy of it in any guild, a global budget of workers
+    and jobs ordered by queue position, so the next song of any guild goes before the fifth song of another one.
+    Jobs for tracks that leave the lookahead window (shuffle, delete, clear) are cancelled.
+    """
+    __slots__ = ('workers', 'resolve_time', 'stats', '_heap', '_jobs', '_ready', '_tasks', '_seq')
+
+    def __init__(self, workers: int = PREFETCH_WORKERS):
+        self.workers = workers
+        self.resolve_time = 2.0  # Moving average of seconds per resolution
+        self.stats = {'resolved': 0, 'failed': 0, 'cancelled': 0, 'skipped': 0}
+        self._heap = []  # (priority, seq, job)
+        self._jobs = {}  # canonical webpage url -> PrefetchJob
+        self._ready = None
+        self._tasks = []
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def _ensure_workers(self) -> bool:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        if self._ready is None:
+            self._ready = asyncio.Event()
+        self._tasks = [task for task in self._tasks if not task.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._worker()))
+        return True
+
+    def lookahead(self, playlist) -> int:
+        """
+        Amount of upcoming tracks to keep resolved.
+
+        The window has to cover the time a resolution takes with the current backlog,
+        so a queue of short songs or slow lookups gets a longer window than MAX_PRELOAD.
+        """
+        horizon = self.resolve_time * (1 + len(self._heap) / self.workers) * 2
+        covered = 0
+        count = 0
+        for track in itertools.islice(playlist.play_queue, 0, PREFETCH_MAX_LOOKAHEAD):
+            if covered >= horizon:
+                break
+            covered += track.info.duration or 0
+            count += 1
+        return max(MAX_PRELOAD, min(count, PREFETCH_MAX_LOOKAHEAD))
+
+    def schedule(self, playlist):
+        """
+        (Re)compute the lookahead window of the playlist and queue what is missing.
+        """
+        window = itertools.islice(playlist.play_queue, 0, self.lookahead(playlist))
+        wanted = {track: pos for pos, track in enumerate(window)}
+
+        self._drop(playlist, keep=wanted)
+
+        if not self._ensure_workers():
+            return
+
+        for track, pos in wanted.items():
+            if track.info.webpage_url is None or resolver.is_resolved(track) or audio_cache.covers(track):
+                continue
+            key = canonical_url(track.info.webpage_url)
+            job = self._jobs.get(key)
+            if job is None:
+                job = self._jobs[key] = PrefetchJob(track.info.webpage_url, pos)
+                job.waiters[track] = playlist
+            else:
+                job.waiters[track] = playlist
+                # The copy nearest to playback in any guild sets the priority
+                if job.task is not None or job.priority <= pos:
+                    continue
+                job.priority = pos
+            heapq.heappush(self._heap, (job.priority, next(self._seq), job))
+        if self._heap:
+            self._ready.set()
+
+    def cancel(self, playlist):
+        """
+        Drop every job of the playlist.
+        """
+        self._drop(playlist)
+
+    def _drop(self, playlist, keep=()):
+        """
+        Forget the playlist's tracks that are not in `keep`, cancelling jobs nobody else waits for.
+        """
+        for job in list(self._jobs.values()):
+            for track in [track for track, owner in job.waiters.items() if owner is playlist and track not in keep]:
+                del job.waiters[track]
+            if not job.waiters:
+                self._cancel(job)
+
+    def _cancel(self, job: PrefetchJob):
+        job.cancelled = True
+        if self._jobs.get(canonical_url(job.url)) is job:
+            del self._jobs[canonical_url(job.url)]
+        if job.task is not None and not job.task.done():
+            job.task.cancel()
+        self.stats['cancelled'] += 1
+
+    def _start(self, job: PrefetchJob):
+        job.started = time.perf_counter()
+        job.task = asyncio.create_task(self._resolve(job))
+        job.task.add_done_callback(lambda task: self._finished(job))
+
+    @staticmethod
+    async def _resolve(job: PrefetchJob):
+        info = await resolver.resolve(job.url)
+        # Tracks that started waiting during the lookup get the result as well
+        for track in job.waiters:
+            track.update_info(info)
+
+    def _finished(self, job: PrefetchJob):
+        if self._jobs.get(canonical_url(job.url)) is job:
+            del self._jobs[canonical_url(job.url)]
+        if job.task.cancelled():
+            return
+        if job.task.exception() is not None:
+            self.stats['failed'] += 1
+            logging.warning(f'Prefetch: {job.url}\n{job.task.exception()}')
+            return
+        self.stats['resolved'] += 1
+        if job.waiters:
+            audio_cache.maybe_fill(next(iter(job.waiters)))
+        elapsed = time.perf_counter() - job.started
+        if elapsed > 0.05:
+            # Cache hits say nothing about extraction time
+            self.resolve_time = 0.8 * self.resolve_time + 0.2 * elapsed
+
+    async def ensure(self, track):
+        """
+        Resolve the track now, joining the in-flight or queued job of its video if there is one.
+        """
+        url = track.info.webpage_url
+        job = self._jobs.get(canonical_url(url)) if url else None
+        if job is not None:
+            job.waiters.setdefault(track, None)
+            if job.task is None:
+                # Not started yet, take it over
+                self._start(job)
+            try:
+                await asyncio.shield(job.task)
+            except asyncio.CancelledError:
+                # Only swallow cancellation of the job itself
+                if not job.task.cancelled():
+                    raise
+            except Exception:
+                # Retry below and let the caller see the error
+                pass
+            if resolver.is_resolved(track):
+                return track
+        return await resolver.resolve_track(track)
+
+    async def _worker(self):
+        while True:
+            while not self._heap:
+                self._ready.clear()
+                await self._ready.wait()
+            priority, _, job = heapq.heappop(self._heap)
+            if job.cancelled or job.task is not None or job.priority != priority:
+                continue
+            if all(resolver.is_resolved(track) for track in job.waiters):
+                self._jobs.pop(canonical_url(job.url), None)
+                self.stats['skipped'] += 1
+                continue
+            self._start(job)
+            await asyncio.wait({job.task})
+
+
+prefetcher = PrefetchScheduler()
@@ -0,0 +1,81 @@
+import discord
+
+
+class QueueView(discord.ui.View):
+    """
+    Page buttons under a queue message. Paging and refreshes edit the message in place
+    and are skipped when neither the page nor the playlist changed since the last render.
+    """
+
+    def __init__(self, playlist, title: str = 'Playlist', page: int = 0, timeout: float = 180):
+        super().__init__(timeout=timeout)
+        self.playlist = playlist
+        self.title = title
+        self.page = page
+        self.message = None
+        self._rendered = None  # (page, playlist version) currently shown
+
+    def _clamp(self):
+        self.page = max(0, min(self.page, self.playlist.pages - 1))
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= self.playlist.pages - 1
+
+    def render(self) -> discord.Embed or None:
+        self._clamp()
+        self._rendered = (self.page, self.playlist.version)
+        return self.playlist.create_embed(title=self.title, page_num=self.page + 1)
+
+    @property
+    def stale(self) -> bool:
+        return self._rendered != (self.page, self.playlist.version)
+
+    async def send(self, destination: discord.abc.Messageable) -> discord.Message or None:
+        embed = self.render()
+        if embed is None:
+            return None
+        self.message = await destination.send(embed=embed, view=self if self.playlist.pages > 1 else None)
+        return self.message
+
+    async def refresh(self):
+        """
+        Bring the existing message up to date.
+        """
+        if self.message is None or not self.stale:
+            return
+        embed = self.render()
+        try:
+            if embed is None:
+                await self.message.edit(content='There are currently no more queued songs.', embed=None, view=None)
+                self.stop()
+            else:
+                await self.message.edit(embed=embed, view=self if self.playlist.pages > 1 else None)
+        except discord.HTTPException:
+            self.message = None
+            self.stop()
+
+    async def _turn(self, interaction: discord.Interaction, page: int):
+        self.page = page
+        if not self.stale:
+            return await interaction.response.defer()
+        embed = self.render()
+        if embed is None:
+            self.stop()
+            return await interaction.response.edit_message(content='There are currently no more queued songs.',
+                                                           embed=None, view=None)
+        await interaction.response.edit_message(embed=embed, view=self)
+
+    @discord.ui.button(label='◀', style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._turn(interaction, self.page - 1)
+
+    @discord.ui.button(label='▶', style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._turn(interaction, self.page + 1)
+
+    async def on_timeout(self):
+        if self.message is None:
+            return
+        try:
+            await self.message.edit(view=None)
+        except discord.HTTPException:
+            pass
@@ -0,0 +1,285 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import itertools
+import logging
+import queue
+import threading
+
+import yt_dlp
+
+from config import RESOLVER_BACKEND, RESOLVER_WORKERS, RESOLVER_TIMEOUT, YTDL_POOL_SIZE
+from core.cache import stream_cache, search_cache, stream_is_fresh
+from core.metadata_store import metadata_store
+from core.metrics import metrics
+
+YTDL_PROFILES = {
+    'track': {'format': 'bestaudio/best', 'title': True},
+    'playlist': {'format': 'bestaudio/best', 'extract_flat': True},
+    'search': {'format': 'bestaudio/best', 'default_search': 'auto', 'noplaylist': True},
+    'fallback': {'title': True},
+}
+
+_MISSING = object()
+_DONE = object()
+
+
+class YoutubeDLPool:
+    """
+    Pre-warmed YoutubeDL instances per option profile.
+
+    Building a YoutubeDL redoes the extractor setup every time,
+    so instances are checked out for a single lookup and returned afterwards.
+    Per-call options (e.g. playlist bounds) are applied on checkout and reverted on return.
+    """
+    __slots__ = ('size', '_idle', 'created')
+
+    def __init__(self, size: int = YTDL_POOL_SIZE):
+        self.size = size
+        self._idle = {profile: queue.SimpleQueue() for profile in YTDL_PROFILES}
+        self.created = 0
+
+    def _create(self, profile: str) -> yt_dlp.YoutubeDL:
+        self.created += 1
+        return yt_dlp.YoutubeDL(dict(YTDL_PROFILES[profile]))
+
+    def warm_up(self, profiles=YTDL_PROFILES, count: int = 1):
+        for profile in profiles:
+            for _ in range(min(count, self.size) - self._idle[profile].qsize()):
+                self._idle[profile].put(self._create(profile))
+
+    @contextlib.contextmanager
+    def checkout(self, profile: str, overrides: dict = None):
+        try:
+            ytdl = self._idle[profile].get_nowait()
+        except queue.Empty:
+            ytdl = self._create(profile)
+
+        overrides = overrides or {}
+        saved = {key: ytdl.params.get(key, _MISSING) for key in overrides}
+        ytdl.params.update(overrides)
+        try:
+            yield ytdl
+        finally:
+            for key, value in saved.items():
+                if value is _MISSING:
+                    ytdl.params.pop(key, None)
+                else:
+                    ytdl.params[key] = value
+            if self._idle[profile].qsize() < self.size:
+                self._idle[profile].put(ytdl)
+            else:
+                ytdl.close()
+
+    def close(self):
+        for idle in self._idle.values():
+            while True:
+                try:
+                    idle.get_nowait().close()
+                except queue.Empty:
+                    break
+
+
+ytdl_pool = YoutubeDLPool()
+
+
+def _extract(profile: str, url: str, overrides: dict) -> dict:
+    """
+    Blocking yt-dlp lookup. Runs inside a worker, never on the event loop.
+    """
+    with ytdl_pool.checkout(profile, overrides) as ytdl:
+        info = ytdl.extract_info(url, download=False)
+        if RESOLVER_BACKEND == 'process':
+            # Info dicts have to be pickled to leave the worker process
+            info = ytdl.sanitize_info(info)
+    return info
+
+
+def _stream_entries(profile: str, url: str, start: int, stop: int or None, emit, cancelled: threading.Event):
+    """
+    Blocking walk over playlist entries, handing each one to `emit` as soon as the extractor yields it.
+
+    Unprocessed extraction keeps `entries` lazy, so further playlist pages are only requested when reached.
+    """
+    with ytdl_pool.checkout(profile) as ytdl:
+        info = ytdl.extract_info(url, download=False, process=False)
+        while info.get('_type') in ('url', 'url_transparent'):
+            info = ytdl.extract_info(info['url'], download=False, process=False)
+        for entry in itertools.islice(info.get('entries') or (), start, stop):
+            if cancelled.is_set():
+                break
+            if entry is not None:
+                emit(entry)
+
+
+def _warm_up():
+    # Extractor setup is the slow part of the first lookup in a fresh process
+    ytdl_pool.warm_up()
+
+
+class Resolver:
+    """
+    Shared async front for yt-dlp lookups.
+
+    Every extraction goes through one bounded worker pool,
+    so a slow lookup in one guild never stalls the event loop for the others.
+    """
+    __slots__ = ('backend', 'max_workers', 'timeout', '_executor')
+
+    def __init__(self, backend: str = RESOLVER_BACKEND, max_workers: int = RESOLVER_WORKERS,
+                 timeout: float = RESOLVER_TIMEOUT):
+        self.backend = backend
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = None
+
+    @property
+    def executor(self) -> concurrent.futures.Executor:
+        if self._executor is None:
+            if self.backend == 'process':
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    initializer=_warm_up
+                )
+            else:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='resolver'
+                )
+        return self._executor
+
+    async def extract_info(self, url: str, profile: str = 'track', timeout: float = None, **overrides) -> dict:
+        """
+        Run `extract_info` for the url with one of YTDL_PROFILES options.
+
+        Raises asyncio.TimeoutError if the lookup takes longer than `timeout` seconds.
+        Cancelling the awaiting task drops the request if a worker has not picked it up yet.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, _extract, profile, url, overrides)
+        try:
+            with metrics.span(f'extract_{profile}'):
+                return await asyncio.wait_for(future, timeout=timeout or self.timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f'Resolver: {profile} lookup timed out for {url}')
+            metrics.error('resolver_timeout')
+            raise
+
+    async def iter_entries(self, url: str, start: int = 0, stop: int = None, profile: str = 'playlist',
+                           timeout: float = None):
+        """
+        Flat entries `start` to `stop` (exclusive) of a playlist, yielded while the extractor is still paging.
+
+        `timeout` applies to the wait for each entry. Closing the generator stops the walk after the current entry.
+        """
+        if self.backend == 'process':
+            # Generators can not leave a worker process, page in one go
+            info = await self.extract_info(url, profile=profile, timeout=timeout,
+                                           playliststart=start + 1, playlistend=stop)
+            for entry in info.get('entries') or ():
+                yield entry
+            return
+
+        loop = asyncio.get_running_loop()
+        entries = asyncio.Queue()
+        cancelled = threading.Event()
+
+        def emit(entry):
+            loop.call_soon_threadsafe(entries.put_nowait, entry)
+
+        future = loop.run_in_executor(self.executor, _stream_entries, profile, url, start, stop, emit, cancelled)
+        # Queued behind every entry the worker emitted
+        future.add_done_callback(lambda f: entries.put_nowait(_DONE))
+        try:
+            while True:
+                entry = await asyncio.wait_for(entries.get(), timeout=timeout or self.timeout)
+                if entry is _DONE:
+                    break
+                yield entry
+            await future
+        finally:
+            cancelled.set()
+
+    async def resolve(self, url: str, profile: str = 'track', timeout: float = None) -> dict:
+        """
+        Stream url and metadata for a single video, served from the stream cache when possible.
+        """
+        info = stream_cache.get(url)
+        if info is not None:
+            metrics.event('stream_cache_hit')
+            return info
+        # Resolved by an earlier run or another shard process
+        info = await metadata_store.fetch_stream(url)
+        if info is not None:
+            metrics.event('stream_store_hit')
+            stream_cache.put(info)
+            return info
+        metrics.event('stream_miss')
+        info = await self.extract_info(url, profile=profile, timeout=timeout)
+        stream_cache.put(info)
+        metadata_store.put(info)
+        return info
+
+    async def lookup(self, url: str, timeout: float = None) -> dict:
+        """
+        Metadata for a single video without a network round trip if it was ever resolved before.
+
+        The result may lack the stream url, in which case it is resolved right before playback.
+        """
+        info = stream_cache.get(url)
+        if info is None:
+            info = await metadata_store.fetch(url)
+        if info is None or info.get('duration') is None:
+            info = await self.resolve(url, timeout=timeout)
+        return info
+
+    async def resolve_track(self, track, timeout: float = None):
+        """
+        Fill stream url and metadata of the track.
+        """
+        info = await self.resolve(track.info.webpage_url, timeout=timeout)
+        track.update_info(info)
+        return track
+
+    @staticmethod
+    def is_resolved(track) -> bool:
+        """
+        Whether the track has metadata and a stream url that will not expire before it ends.
+        """
+        return track.info.duration is not None and stream_is_fresh(track.url, track.info.duration)
+
+    async def search(self, query: str, timeout: float = None) -> dict or None:
+        webpage_url = search_cache.get(query)
+        if webpage_url is not None:
+            metrics.event('search_cache_hit')
+            return await self.resolve(webpage_url, timeout=timeout)
+        metrics.event('search_miss')
+
+        info = await self.extract_info(query, profile='search', timeout=timeout)
+        if info is None or not info.get('entries'):
+            return None
+        entry = info['entries'][0]
+        stream_cache.put(entry)
+        metadata_store.put(entry)
+        search_cache.put(query, entry.get('webpage_url'))
+        return entry
+
+    def warm_up(self):
+        """
+        Build pooled YoutubeDL instances ahead of the first request.
+        """
+        if self.backend == 'process':
+            # Worker processes warm their own pool in the initializer
+            for _ in range(self.max_workers):
+                self.executor.submit(int)
+        else:
+            self.executor.submit(_warm_up)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        ytdl_pool.close()
+
+
+resolver = Resolver()
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import time
+
+from config import SCHEDULER_RESOLUTION, SCHEDULER_SLOTS
+
+
+class DeadlineScheduler:
+    """
+    Hashed timing wheel of per-key deadlines, driven by a single task.
+
+    Touching a key only updates its deadline; a key is moved to the right slot lazily,
+    when the slot it sits in comes up. The driver task exists only while deadlines are pending.
+    """
+    __slots__ = ('resolution', '_wheel', '_slot_of', '_deadlines', '_callbacks', '_tick', '_task')
+
+    def __init__(self, resolution: float = SCHEDULER_RESOLUTION, slots: int = SCHEDULER_SLOTS):
+        self.resolution = resolution
+        self._wheel = [set() for _ in range(slots)]
+        self._slot_of = {}  # key -> wheel slot index
+        self._deadlines = {}  # key -> time.monotonic() deadline
+        self._callbacks = {}  # key -> coroutine function
+        self._tick = None
+        self._task = None
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    @property
+    def pending(self) -> int:
+        return len(self._deadlines)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def _place(self, key, deadline: float):
+        # Never into a slot the driver has already passed in this turn
+        slot = max(int(deadline / self.resolution), self._tick + 1) % len(self._wheel)
+        old = self._slot_of.get(key)
+        if old == slot:
+            return
+        if old is not None:
+            self._wheel[old].discard(key)
+        self._wheel[slot].add(key)
+        self._slot_of[key] = slot
+
+    def touch(self, key, delay: float, callback):
+        """
+        (Re)set the deadline of the key to `delay` seconds from now.
+        """
+        now = time.monotonic()
+        if self._task is None or self._task.done():
+            self._tick = int(now / self.resolution)
+            self._task = asyncio.create_task(self._run())
+        deadline = now + delay
+        old = self._deadlines.get(key)
+        self._deadlines[key] = deadline
+        self._callbacks[key] = callback
+        if old is None or deadline < old:
+            # Later deadlines are re-bucketed when their current slot comes up
+            self._place(key, deadline)
+
+    def cancel(self, key):
+        if self._deadlines.pop(key, None) is None:
+            return
+        self._callbacks.pop(key, None)
+        self._wheel[self._slot_of.pop(key)].discard(key)
+
+    def remaining(self, key) -> float or None:
+        deadline = self._deadlines.get(key)
+        return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+    async def _run(self):
+        while self._deadlines:
+            await asyncio.sleep(self.resolution)
+            now = time.monotonic()
+            current = int(now / self.resolution)
+            # Catch up on every tick missed while the loop was busy, at most one full turn
+            for tick in range(max(self._tick + 1, current - len(self._wheel) + 1), current + 1):
+                self._tick = tick
+                self._expire(tick % len(self._wheel), now)
+
+    def _expire(self, slot: int, now: float):
+        bucket = self._wheel[slot]
+        if not bucket:
+            return
+        for key in list(bucket):
+            deadline = self._deadlines[key]
+            if deadline > now:
+                self._place(key, deadline)
+                continue
+            callback = self._callbacks.pop(key)
+            del self._deadlines[key]
+            del self._slot_of[key]
+            bucket.discard(key)
+            asyncio.create_task(self._fire(key, callback))
+
+    @staticmethod
+    async def _fire(key, callback):
+        try:
+            await callback()
+        except Exception as ex:
+            logging.warning(f'Scheduler: deadline callback of {key} failed\n{ex}')
+
+
+deadlines = DeadlineScheduler()
@@ -1,57 +1,167 @@
+import asyncio
+import atexit
 import json
+import logging
+import os
+import tempfile
 from pathlib import Path
 
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks on Windows, sharing the file between processes is unsupported there
+    fcntl = None
+
 import discord
-from discord.ext.commands import Bot
 
-from core.music_player import MusicPlayer
+from config import SETTINGS_FLUSH_DELAY, DEFAULT_TIMEOUT
 
 BASE_DIR = Path(__file__).resolve().parent.parent
+SETTINGS_PATH = f'{BASE_DIR}/config/generated/settings.json'
 
 
-def settings_setup(bot: Bot, guild: discord.Guild, guild_to_settings: dict, guild_to_audioplayer: dict):
+class SettingsStore:
     """
-    Add guild to settings and audio player
+    Settings of every guild, read from disk once and indexed by guild id.
+
+    Changes are kept in memory and written back by a debounced flush,
+    which replaces the file atomically (temporary file + rename).
+    A flush merges only the changed guilds into what is on disk, under a file lock,
+    so shard processes owning different guilds can share the file.
     """
-    guild_to_settings[guild] = Settings(guild)
-    guild_to_audioplayer[guild] = MusicPlayer(bot, guild)
+    __slots__ = ('path', 'delay', '_data', '_dirty', '_flush_handle')
+
+    def __init__(self, path: str = SETTINGS_PATH, delay: float = SETTINGS_FLUSH_DELAY):
+        self.path = path
+        self.delay = delay
+        self._data = None  # guild id -> settings dict
+        self._dirty = set()
+        self._flush_handle = None
+
+    def __len__(self):
+        return len(self._index())
+
+    def _index(self) -> dict:
+        if self._data is None:
+            self.load()
+        return self._data
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                json_data = json.load(f)
+        except FileNotFoundError:
+            json_data = {}
+        self._data = {int(guild_settings['id']): guild_settings for guild_settings in json_data.values()}
+        self._dirty.clear()
+
+    def get(self, guild_id: int) -> dict or None:
+        return self._index().get(guild_id)
+
+    def set(self, guild_id: int, guild_settings: dict):
+        self._index()[guild_id] = guild_settings
+        self.mark_dirty(guild_id)
+
+    def mark_dirty(self, guild_id: int):
+        self._dirty.add(guild_id)
+        if self._flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop to debounce with, changes are written by flush() or at exit
+            return
+        self._flush_handle = loop.call_later(self.delay, self._schedule_flush)
+
+    def _schedule_flush(self):
+        self._flush_handle = None
+        asyncio.ensure_future(self.flush_async())
+
+    def _take_changes(self) -> dict:
+        """
+        Copies of the changed guild settings, taken on the event loop.
+        """
+        data = self._index()
+        changes = {str(guild_id): dict(data[guild_id]) for guild_id in self._dirty if guild_id in data}
+        self._dirty.clear()
+        return changes
+
+    def _write(self, changes: dict):
+        directory = os.path.dirname(self.path)
+        with open(f'{self.path}.lock', 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.path, 'r') as f:
+                    content = json.load(f)
+            except FileNotFoundError:
+                content = {}
+            content.update(changes)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.settings.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(content, f, indent=2)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+    def flush(self):
+        """
+        Write pending changes right now. Blocking.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._dirty:
+            return
+        self._write(self._take_changes())
+
+    async def flush_async(self):
+        if not self._dirty:
+            return
+        # Snapshot on the loop, disk I/O in a worker
+        changes = self._take_changes()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, changes)
+        except (OSError, ValueError) as ex:
+            logging.warning(f'Settings: failed to write {self.path}\n{ex}')
+            # Retried by the next debounced flush
+            for guild_id in changes:
+                self.mark_dirty(int(guild_id))
+
+
+settings_store = SettingsStore()
+atexit.register(settings_store.flush)
 
 
 class Settings:
-    def __init__(self, guild):
+    def __init__(self, guild, store: SettingsStore = settings_store):
         self.guild = guild
-        self.json_data = None
+        self.store = store
         self.config = None
-        self.path = f'{BASE_DIR}/config/generated/settings.json'
 
         self.settings_template = {
             "id": 0,
-            "timeout": 5 * 60,
+            "timeout": DEFAULT_TIMEOUT,
+            "skip_duplicates": False,
         }
         self.load()
         self.update()
 
     def load(self):
-        data = open(self.path, 'r')
-        self.json_data = json.load(data)
-        for guild in self.json_data:
-            guild_settings = self.json_data[guild]
-
-            if guild_settings['id'] == self.guild.id:
-                self.config = guild_settings
+        self.config = self.store.get(self.guild.id)
 
         if self.config is None:
             self.create()
             return
 
     def create(self):
-        self.json_data[self.guild.id] = self.settings_template
-        self.json_data[self.guild.id]['id'] = self.guild.id
-
-        with open(self.path, 'w') as f:
-            json.dump(self.json_data, f, indent=2)
-
-        self.load()
+        self.config = dict(self.settings_template)
+        self.config['id'] = self.guild.id
+        self.store.set(self.guild.id, self.config)
 
     def update(self):
         upd_flag = False
@@ -61,9 +171,7 @@ class Settings:
                 upd_flag = True
 
         if upd_flag:
-            with open(self.path, 'w') as f:
-                json.dump(self.json_data, f)
-            self.load()
+            self.store.mark_dirty(self.guild.id)
 
     async def create_embed(self) -> discord.Embed:
         embed = discord.Embed(title='Settings', description=self.guild.name)
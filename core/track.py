@@ -4,11 +4,12 @@ import discord
 
 
 class Track:
-    __slots__ = ('url', 'requester', 'info')
+    __slots__ = ('url', 'codec', 'requester', 'info')
 
     def __init__(self, url=None, requester=None, uploader=None, title=None, duration=None, webpage_url=None,
-                 thumbnail=None):
+                 thumbnail=None, codec=None):
         self.url = url
+        self.codec = codec
         self.requester = requester
         self.info = self.TrackInfo(uploader, title, duration, webpage_url, thumbnail)
 
@@ -25,6 +26,16 @@ class Track:
             self.webpage_url = webpage_url
             self.thumbnail = thumbnail
 
+    def update_info(self, info: dict):
+        self.url = info.get('url')
+        self.codec = info.get('acodec')
+        self.info.uploader = info.get('uploader')
+        self.info.title = info.get('title')
+        self.info.duration = info.get('duration')
+        self.info.webpage_url = info.get('webpage_url')
+        thumbnails = info.get('thumbnails')
+        self.info.thumbnail = thumbnails[-1]['url'] if thumbnails else None
+
     def create_embed(self):
         embed = discord.Embed(title='Now playing',
                               description=f'[{self.info.title}]({self.info.webpage_url})')
@@ -0,0 +1,222 @@
+import random
+from collections import deque
+from itertools import islice
+
+
+class Node:
+    """
+    Handle of one queued entry, stays valid while the entry moves around the queue.
+    """
+    __slots__ = ('value', 'keys')
+
+    def __init__(self, value):
+        self.value = value
+        self.keys = None  # Index keys the owner filed the entry under
+
+
+class TrackQueue:
+    """
+    Sequence of tracks kept as a deque of node handles.
+
+    Positional edits and rank lookups are O(n): memmoves and identity scans in C, which beat a balanced tree
+    in Python up to the MAX_QUEUE_LEN entries Playlist.add allows. Handles let indexes point at queued entries.
+    Mirrors the parts of the deque API the player uses.
+    """
+    __slots__ = ('_nodes',)
+
+    def __init__(self, iterable=()):
+        self._nodes = deque(Node(value) for value in iterable)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __bool__(self):
+        return bool(self._nodes)
+
+    def __iter__(self):
+        for node in self._nodes:
+            yield node.value
+
+    def nodes(self):
+        return iter(self._nodes)
+
+    def __repr__(self):
+        return f'TrackQueue({list(self)!r})'
+
+    def _index(self, pos: int) -> int:
+        size = len(self._nodes)
+        if pos < 0:
+            pos += size
+        if not 0 <= pos < size:
+            raise IndexError('TrackQueue index out of range')
+        return pos
+
+    def node_at(self, pos: int) -> Node:
+        return self._nodes[self._index(pos)]
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            start, stop, step = pos.indices(len(self))
+            if step != 1:
+                return list(self)[pos]
+            return list(self.slice(start, stop))
+        return self.node_at(pos).value
+
+    def slice(self, start: int, stop: int) -> list:
+        """
+        Values from start to stop (exclusive), walked from the nearer end of the queue.
+        """
+        size = len(self._nodes)
+        stop = min(stop, size)
+        if start >= stop:
+            return []
+        if start > size - stop:
+            nodes = list(islice(reversed(self._nodes), size - stop, size - start))
+            nodes.reverse()
+        else:
+            nodes = islice(self._nodes, start, stop)
+        return [node.value for node in nodes]
+
+    def rank(self, node: Node) -> int:
+        """
+        Current position of a node handle.
+        """
+        return self._nodes.index(node)
+
+    def ranks(self, nodes) -> dict:
+        """
+        Current positions of several node handles: node -> position.
+        """
+        nodes = list(nodes)
+        if len(nodes) <= 8:
+            return {node: self._nodes.index(node) for node in nodes}
+        wanted = set(nodes)
+        return {node: pos for pos, node in enumerate(self._nodes) if node in wanted}
+
+    def insert(self, pos: int, value) -> Node:
+        pos = max(0, min(pos if pos >= 0 else pos + len(self), len(self)))
+        node = Node(value)
+        self._nodes.insert(pos, node)
+        return node
+
+    def append(self, value) -> Node:
+        node = Node(value)
+        self._nodes.append(node)
+        return node
+
+    def appendleft(self, value) -> Node:
+        node = Node(value)
+        self._nodes.appendleft(node)
+        return node
+
+    def extend(self, values):
+        self._nodes.extend(Node(value) for value in values)
+
+    def pop_node(self, pos: int = -1) -> Node:
+        pos = self._index(pos)
+        node = self._nodes[pos]
+        del self._nodes[pos]
+        return node
+
+    def pop(self, pos: int = -1):
+        return self.pop_node(pos).value
+
+    def popleft(self):
+        if not self._nodes:
+            raise IndexError('pop from an empty TrackQueue')
+        return self._nodes.popleft().value
+
+    def __delitem__(self, pos: int):
+        self.pop_node(pos)
+
+    def remove_node(self, node: Node):
+        self._nodes.remove(node)
+
+    def remove_nodes(self, nodes):
+        """
+        Remove several node handles in one pass.
+        """
+        removed = set(nodes)
+        if not removed:
+            return
+        self._nodes = deque(node for node in self._nodes if node not in removed)
+
+    def move(self, src: int, dst: int):
+        """
+        Move the value at src so it ends up at position dst.
+        """
+        node = self.pop_node(src)
+        dst = max(0, min(dst, len(self._nodes)))
+        self._nodes.insert(dst, node)
+
+    def shuffle(self):
+        """
+        O(n) reshuffle through a list, deque indexing is not O(1). Node handles stay valid.
+        """
+        nodes = list(self._nodes)
+        random.shuffle(nodes)
+        self._nodes = deque(nodes)
+
+    def clear(self):
+        self._nodes.clear()
+
+
+class TrackHistory(deque):
+    """
+    Bounded play history with O(1) position lookup of a track (its latest occurrence).
+    `version` changes with every edit.
+    """
+
+    def __init__(self, iterable=(), maxlen: int = None):
+        super().__init__(maxlen=maxlen)
+        self.version = 0
+        self._seq = {}  # id(track) -> sequence number of latest append
+        self._head = 0  # sequence number of the leftmost entry
+        self._tail = 0  # sequence number the next append gets
+        self.extend(iterable)
+
+    def append(self, track):
+        if self.maxlen is not None and len(self) == self.maxlen:
+            self.popleft()
+        super().append(track)
+        self.version += 1
+        self._seq[id(track)] = self._tail
+        self._tail += 1
+
+    def extend(self, tracks):
+        for track in tracks:
+            self.append(track)
+
+    def popleft(self):
+        track = super().popleft()
+        self.version += 1
+        if self._seq.get(id(track)) == self._head:
+            del self._seq[id(track)]
+        self._head += 1
+        return track
+
+    def appendleft(self, track):
+        super().appendleft(track)
+        self.version += 1
+        self._head -= 1
+        self._seq.setdefault(id(track), self._head)
+
+    def pop(self):
+        track = super().pop()
+        self.version += 1
+        self._tail -= 1
+        if self._seq.get(id(track)) == self._tail:
+            del self._seq[id(track)]
+        return track
+
+    def clear(self):
+        super().clear()
+        self.version += 1
+        self._seq.clear()
+        self._head = self._tail = 0
+
+    def index(self, track, *args) -> int:
+        seq = self._seq.get(id(track))
+        if seq is None or args:
+            return super().index(track, *args)
+        return seq - self._head
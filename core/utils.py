@@ -1,17 +1,6 @@
-import asyncio
-
-
-class Timer:
-    def __init__(self, callback):
-        self._callback = callback
-        self._task = asyncio.create_task(self._timer())
-
-    async def _timer(self):
-        await asyncio.sleep(60 * 5)
-        await self._callback()
-
-    def cancel(self):
-        self._task.cancel()
+import sys
+from collections import deque
+from urllib.parse import urlparse, parse_qs
 
 
 def get_similarity_coefficient(s1, s2) -> float:
@@ -23,3 +12,72 @@ def get_similarity_coefficient(s1, s2) -> float:
         if symbol in s2:
             c += 1
     return c / (a + b - c)
+
+
+def youtube_video_id(url: str) -> str or None:
+    """
+    Extract video id from any of the common YouTube link formats.
+    """
+    if not url:
+        return None
+    parsed = urlparse(url)
+    host = parsed.netloc.lower()
+    if host.endswith('youtu.be'):
+        return parsed.path.lstrip('/').split('/')[0] or None
+    if host.endswith('youtube.com') or host.endswith('youtube-nocookie.com'):
+        if parsed.path == '/watch':
+            return parse_qs(parsed.query).get('v', [None])[0]
+        for prefix in ('/shorts/', '/embed/', '/live/', '/v/'):
+            if parsed.path.startswith(prefix):
+                return parsed.path[len(prefix):].split('/')[0] or None
+    return None
+
+
+def canonical_url(url: str) -> str:
+    """
+    Bring YouTube video links to a single form, so they can be used as cache keys.
+    """
+    video_id = youtube_video_id(url)
+    if video_id is None:
+        return url
+    return f'https://www.youtube.com/watch?v={video_id}'
+
+
+def deep_sizeof(obj, exclude: tuple = (), _seen: set = None) -> int:
+    """
+    Approximate memory used by an object and everything it references.
+
+    Objects of `exclude` types (shared ones like the bot or discord models) are not counted.
+    """
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen or isinstance(obj, exclude) or isinstance(obj, type):
+        return 0
+    _seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, exclude, _seen) + deep_sizeof(v, exclude, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(deep_sizeof(item, exclude, _seen) for item in obj)
+    else:
+        for cls in type(obj).__mro__:
+            for slot in getattr(cls, '__slots__', ()):
+                if hasattr(obj, slot):
+                    size += deep_sizeof(getattr(obj, slot), exclude, _seen)
+        if hasattr(obj, '__dict__'):
+            size += deep_sizeof(vars(obj), exclude, _seen)
+    return size
+
+
+def process_rss() -> int or None:
+    """
+    Resident memory of this process in bytes. Linux only.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
@@ -0,0 +1,88 @@
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from config import LOOP_STALL_THRESHOLD, LOOP_WATCHDOG_INTERVAL
+from core.metrics import metrics
+
+
+def _running_context(frame) -> str:
+    """
+    Guild and command of the innermost coroutine on the stack that has a command context or a music player.
+    """
+    while frame is not None:
+        local_vars = frame.f_locals
+        ctx = local_vars.get('ctx')
+        if ctx is not None and hasattr(ctx, 'command') and hasattr(ctx, 'guild'):
+            guild = getattr(ctx.guild, 'id', None)
+            return f'guild {guild}, command {getattr(ctx.command, "qualified_name", None)!r}'
+        owner = local_vars.get('self')
+        if owner is not None and hasattr(owner, 'playlist') and hasattr(owner, 'guild'):
+            return f'guild {getattr(owner.guild, "id", None)}, {frame.f_code.co_name}'
+        frame = frame.f_back
+    return 'no guild or command on the stack'
+
+
+class LoopWatchdog:
+    """
+    Helper thread that pings the event loop and reports when it does not answer in time.
+
+    A late ping means a coroutine ran blocking code, so the loop thread's stack is logged while it is still stuck.
+    Every ping's delay goes into the loop lag histogram.
+    """
+    __slots__ = ('threshold', 'interval', 'stalls', '_loop', '_loop_thread', '_thread', '_pong', '_stop')
+
+    def __init__(self, threshold: float = LOOP_STALL_THRESHOLD, interval: float = LOOP_WATCHDOG_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = 0
+        self._loop = None
+        self._loop_thread = None
+        self._thread = None
+        self._pong = threading.Event()
+        self._stop = threading.Event()
+
+    def start(self, loop):
+        """
+        Watch the loop. Call from the loop's own thread.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._loop = loop
+        self._loop_thread = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='loop-watchdog', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._pong.clear()
+            sent = time.perf_counter()
+            try:
+                self._loop.call_soon_threadsafe(self._pong.set)
+            except RuntimeError:
+                # Loop closed
+                return
+            if not self._pong.wait(self.threshold):
+                self._report(time.perf_counter() - sent)
+                self._pong.wait()
+                logging.warning(f'Watchdog: event loop was blocked for {time.perf_counter() - sent:.2f}s')
+            metrics.lag.observe(time.perf_counter() - sent)
+
+    def _report(self, lag: float):
+        self.stalls += 1
+        metrics.error('loop_stall')
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return
+        stack = ''.join(traceback.format_stack(frame))
+        logging.warning(f'Watchdog: event loop blocked for {lag:.2f}s and counting ({_running_context(frame)})\n'
+                        f'{stack}')
+
+
+watchdog = LoopWatchdog()
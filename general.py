@@ -1,19 +1,35 @@
+import asyncio
 import logging
 import os
+import time
 from pathlib import Path
 
 import discord
 from discord.ext import commands
 
-from config import BOT_CMD_PREFIX
-from core.settings import settings_setup
+from config import BOT_CMD_PREFIX, PLAYER_IDLE_TIMEOUT, METRICS_HOST, METRICS_PORT, LOOP_STALL_THRESHOLD, \
+    JOURNAL_POSITION_INTERVAL, RESUME_CONCURRENCY
+from core import utils
+from core.audio import cpu_usage
+from core.audio_cache import audio_cache
+from core.cache import stream_cache, search_cache
+from core.helpers import index_commands, get_owner_id
+from core.journal import session_journal
+from core.metrics import metrics
+from core.music_player import MusicPlayer
+from core.outbox import outboxes
+from core.prefetch import prefetcher
+from core.resolver import resolver
+from core.scheduler import deadlines
+from core.settings import Settings, settings_store
+from core.watchdog import watchdog
 
 BASE_DIR = Path(__file__).resolve().parent
 COG_FOLDER = "bot_cogs"
 COG_LIST = [cog[:-3] for cog in os.listdir(BASE_DIR.joinpath(COG_FOLDER)) if not cog.startswith('_')]
 
-guild_to_audioplayer = {}
-guild_to_settings = {}
+guild_to_audioplayer = {}  # guild id -> MusicPlayer, only for guilds that used music commands recently
+guild_to_settings = {}  # guild id -> Settings
 
 logging.basicConfig(
     format='%(asctime)-s %(levelname)-8s %(message)s',
@@ -21,10 +37,147 @@ logging.basicConfig(
     datefmt='%d.%m.%Y %H:%M:%S')
 
 
+def get_settings(guild: discord.Guild) -> Settings:
+    settings = guild_to_settings.get(guild.id)
+    if settings is None:
+        settings = guild_to_settings[guild.id] = Settings(guild)
+    return settings
+
+
+def get_player(bot: commands.Bot, guild: discord.Guild) -> MusicPlayer:
+    """
+    Music player of the guild, created on first use.
+    """
+    player = guild_to_audioplayer.get(guild.id)
+    if player is None:
+        get_settings(guild)
+        player = guild_to_audioplayer[guild.id] = MusicPlayer(bot, guild)
+    player.last_used = time.monotonic()
+    return player
+
+
+async def evict_idle_players():
+    """
+    Drop players that are not connected and have not been used for PLAYER_IDLE_TIMEOUT.
+    """
+    while True:
+        await asyncio.sleep(PLAYER_IDLE_TIMEOUT / 4)
+        deadline = time.monotonic() - PLAYER_IDLE_TIMEOUT
+        idle = [guild_id for guild_id, player in guild_to_audioplayer.items()
+                if player.last_used < deadline and player.is_idle()]
+        for guild_id in idle:
+            guild_to_audioplayer.pop(guild_id).close()
+            guild_to_settings.pop(guild_id, None)
+        if idle:
+            await settings_store.flush_async()
+            logging.info(f'Evicted {len(idle)} idle players, {len(guild_to_audioplayer)} left')
+
+
+async def record_positions():
+    """
+    Journal the playback position of every playing guild, so a restart resumes close to where it stopped.
+    """
+    while True:
+        await asyncio.sleep(JOURNAL_POSITION_INTERVAL)
+        for player in guild_to_audioplayer.values():
+            voice_client = player.guild.voice_client
+            if player.source is not None and voice_client is not None and voice_client.is_playing():
+                player.journal.position(player.source.elapsed)
+
+
+async def restore_sessions(bot: commands.Bot):
+    """
+    Restore queues journaled before the last restart and resume the tracks that were playing.
+    """
+    started = time.perf_counter()
+    guild_ids = {guild.id for guild in bot.guilds}
+    states = await asyncio.get_running_loop().run_in_executor(None, session_journal.load, guild_ids)
+    if not states:
+        return
+    # Voice connections go through the gateway, do not flood it
+    limit = asyncio.Semaphore(RESUME_CONCURRENCY)
+
+    async def restore(guild_id: int, state: dict):
+        async with limit:
+            try:
+                await get_player(bot, bot.get_guild(guild_id)).restore(state)
+            except Exception as ex:
+                logging.warning(f'Journal: failed to restore guild {guild_id}\n{ex}')
+
+    await asyncio.gather(*(restore(guild_id, state) for guild_id, state in states.items()))
+    logging.info(f'Restored {len(states)} queues in {time.perf_counter() - started:.2f}s')
+
+
+def memory_report() -> dict:
+    """
+    Memory and task usage of music players, to check that it grows with active guilds only.
+    """
+    shared = (commands.Bot, discord.Guild, discord.abc.Messageable, discord.abc.User, discord.Message,
+              asyncio.Task, asyncio.AbstractEventLoop)
+    player_bytes = sum(utils.deep_sizeof(player, exclude=shared) for player in guild_to_audioplayer.values())
+    players = len(guild_to_audioplayer)
+    return {
+        'players': players,
+        'settings': len(guild_to_settings),
+        'tasks': len(asyncio.all_tasks()),
+        'deadlines': deadlines.pending,
+        'rss': utils.process_rss(),
+        'player_bytes': player_bytes,
+        'bytes_per_player': player_bytes // players if players else 0,
+    }
+
+
+@metrics.collector
+def collect_players() -> tuple:
+    playing = sum(1 for player in guild_to_audioplayer.values() if player.current_track is not None)
+    return 'players', 'gauge', 'Music players in memory and how many of them are playing.', [
+        ({'state': 'loaded'}, len(guild_to_audioplayer)),
+        ({'state': 'playing'}, playing),
+    ]
+
+
+@metrics.collector
+def collect_caches() -> tuple:
+    samples = []
+    for name, stats in (('stream', stream_cache.stats()), ('search', search_cache.stats()),
+                        ('audio', audio_cache.stats())):
+        for key, value in stats.items():
+            if key != 'hit_ratio':
+                samples.append(({'cache': name, 'stat': key}, value))
+    return 'cache', 'gauge', 'Cache statistics: sizes and cumulative hit/miss/eviction counts.', samples
+
+
+@metrics.collector
+def collect_prefetch() -> tuple:
+    return 'preloads_total', 'counter', 'Preload outcomes.', [
+        ({'outcome': outcome}, count) for outcome, count in prefetcher.stats.items()
+    ]
+
+
+@metrics.collector
+def collect_cpu() -> tuple:
+    samples = []
+    for mode, usage in cpu_usage.items():
+        samples.extend((
+            ({'mode': mode, 'kind': 'audio'}, usage.audio),
+            ({'mode': mode, 'kind': 'encoder'}, usage.encoder),
+            ({'mode': mode, 'kind': 'ffmpeg'}, usage.ffmpeg),
+        ))
+    return 'cpu_seconds', 'counter', 'Seconds of audio played and CPU seconds spent on it by playback mode.', samples
+
+
+@metrics.collector
+def collect_outbox() -> tuple:
+    return 'outbox', 'gauge', 'Outbound message queue depth and counts.', [
+        ({'stat': key}, value) for key, value in outboxes.stats().items()
+    ]
+
+
 def setup(bot):
     @bot.event
     async def on_ready():
         await bot.change_presence(activity=discord.Game(name=f'{BOT_CMD_PREFIX}play'))
+        resolver.warm_up()
         for cog in COG_LIST:
             try:
                 await bot.load_extension(f'{COG_FOLDER}.{cog}')
@@ -33,13 +186,19 @@ def setup(bot):
                 logging.info(f'[   ] {cog}')
             except commands.errors.ExtensionFailed as ex:
                 logging.warning(f'[ X ] {cog}\n{ex}')
-        for guild in bot.guilds:
-            settings_setup(
-                bot=bot,
-                guild=guild,
-                guild_to_settings=guild_to_settings,
-                guild_to_audioplayer=guild_to_audioplayer
-            )
+        index_commands(bot)
+        await get_owner_id(bot)
+        if METRICS_PORT:
+            # Every shard process needs a port of its own
+            shard_ids = getattr(bot, 'shard_ids', None)
+            await metrics.start_server(METRICS_HOST, METRICS_PORT + (shard_ids[0] if shard_ids else 0))
+        if LOOP_STALL_THRESHOLD:
+            watchdog.start(asyncio.get_running_loop())
+        # Players and settings are created on first use, on_ready runs again after every reconnect
+        if not any(task.get_name() == 'evict_idle_players' for task in asyncio.all_tasks()):
+            asyncio.create_task(evict_idle_players(), name='evict_idle_players')
+            asyncio.create_task(record_positions(), name='record_positions')
+            asyncio.create_task(restore_sessions(bot), name='restore_sessions')
         logging.info(f'{bot.user.name} - Ready!')
 
     @bot.event
@@ -49,12 +208,15 @@ def setup(bot):
 
         :param guild: (Guild) – The guild that was joined.
         """
-        settings_setup(
-            bot=bot,
-            guild=guild,
-            guild_to_settings=guild_to_settings,
-            guild_to_audioplayer=guild_to_audioplayer
-        )
+        get_settings(guild)
+
+    @bot.event
+    async def on_guild_remove(guild):
+        player = guild_to_audioplayer.pop(guild.id, None)
+        if player is not None:
+            player.close()
+        session_journal.delete(guild.id)
+        guild_to_settings.pop(guild.id, None)
 
     @bot.event
     async def on_connect():
@@ -0,0 +1,137 @@
+"""
+Run the bot sharded across several processes, so voice encoding and yt-dlp work use every CPU core.
+
+    python launcher.py [--processes N] [--shard-count N]
+
+Each process runs an AutoShardedBot (run.py) for its own contiguous range of shards.
+The processes share config/generated: the settings file, the metadata/stream database and the audio cache.
+Crashed processes are restarted after SHARD_RESTART_DELAY seconds.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import discord
+from dotenv import load_dotenv
+
+from config import SHARD_PROCESSES, SHARD_COUNT, SHARD_RESTART_DELAY
+
+BASE_DIR = Path(__file__).resolve().parent
+IDENTIFY_INTERVAL = 5  # Seconds Discord wants between identifies of one concurrency bucket
+
+logging.basicConfig(
+    format='%(asctime)-s %(levelname)-8s %(message)s',
+    level=logging.INFO,
+    datefmt='%d.%m.%Y %H:%M:%S')
+
+
+async def recommended_shards(token: str) -> tuple:
+    """
+    Shard count Discord recommends for the bot and how many shards may identify at once.
+    """
+    http = discord.http.HTTPClient(asyncio.get_running_loop())
+    try:
+        await http.static_login(token)
+        shards, _, session_start_limit = await http.get_bot_gateway()
+    finally:
+        await http.close()
+    return shards, session_start_limit.get('max_concurrency', 1)
+
+
+def split_shards(shard_count: int, processes: int) -> list:
+    """
+    Contiguous shard id ranges, as even as possible, one per process.
+    """
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    ranges = []
+    start = 0
+    for i in range(processes):
+        stop = start + size + (i < extra)
+        ranges.append(list(range(start, stop)))
+        start = stop
+    return ranges
+
+
+class Worker:
+    __slots__ = ('shard_ids', 'shard_count', 'process', 'restarts')
+
+    def __init__(self, shard_ids: list, shard_count: int):
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.process = None
+        self.restarts = 0
+
+    def start(self):
+        self.process = subprocess.Popen([
+            sys.executable, str(BASE_DIR.joinpath('run.py')),
+            '--shard-count', str(self.shard_count),
+            '--shard-ids', ','.join(map(str, self.shard_ids)),
+        ], cwd=BASE_DIR)
+        logging.info(f'Launcher: shards {self.shard_ids[0]}-{self.shard_ids[-1]} started, pid {self.process.pid}')
+
+    def running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+
+def main(processes: int = SHARD_PROCESSES, shard_count: int = SHARD_COUNT):
+    load_dotenv()
+    token = os.getenv('DISCORDBOT_TOKEN')
+    recommended, max_concurrency = asyncio.run(recommended_shards(token))
+    shard_count = shard_count or recommended
+    workers = [Worker(shard_ids, shard_count) for shard_ids in split_shards(shard_count, processes or os.cpu_count())]
+    logging.info(f'Launcher: {shard_count} shards in {len(workers)} processes')
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for worker in workers:
+            if worker.running():
+                worker.process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for worker in workers:
+        if stopping:
+            break
+        worker.start()
+        # Every shard identifies on start, keep the processes from exceeding the identify rate together
+        time.sleep(IDENTIFY_INTERVAL * len(worker.shard_ids) / max_concurrency)
+
+    crashed_at = {}  # worker -> time it exited
+    while not stopping:
+        time.sleep(1)
+        for worker in workers:
+            if worker.running() or stopping:
+                continue
+            if worker not in crashed_at:
+                logging.warning(f'Launcher: shards {worker.shard_ids[0]}-{worker.shard_ids[-1]} exited '
+                                f'with code {worker.process.returncode}')
+                crashed_at[worker] = time.monotonic()
+            elif time.monotonic() - crashed_at[worker] > SHARD_RESTART_DELAY:
+                del crashed_at[worker]
+                worker.restarts += 1
+                worker.start()
+
+    for worker in workers:
+        if worker.process is not None:
+            worker.process.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the music bot sharded across processes.')
+    parser.add_argument('--processes', type=int, default=SHARD_PROCESSES,
+                        help='bot processes to start, 0 for one per CPU core')
+    parser.add_argument('--shard-count', type=int, default=SHARD_COUNT,
+                        help="total shards, 0 for Discord's recommendation")
+    args = parser.parse_args()
+    main(args.processes, args.shard_count)
@@ -1,3 +1,4 @@
+import argparse
 import os
 
 import discord
@@ -11,10 +12,36 @@ intents = discord.Intents.default()
 intents.members = True
 intents.message_content = True
 
-bot = commands.Bot(command_prefix=commands.when_mentioned_or(BOT_CMD_PREFIX), intents=intents)
-setup(bot)
+
+def create_bot(sharded: bool = False, shard_ids: list = None, shard_count: int = None) -> commands.Bot:
+    """
+    Single connection bot, or an AutoShardedBot running `shard_ids` of `shard_count` shards
+    (every shard, with Discord's recommended count, if not given).
+    """
+    if sharded or shard_ids:
+        bot = commands.AutoShardedBot(command_prefix=commands.when_mentioned_or(BOT_CMD_PREFIX), intents=intents,
+                                      shard_ids=shard_ids, shard_count=shard_count)
+    else:
+        bot = commands.Bot(command_prefix=commands.when_mentioned_or(BOT_CMD_PREFIX), intents=intents)
+    setup(bot)
+    return bot
+
+
+def parse_args(args: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Run the music bot.')
+    parser.add_argument('--sharded', action='store_true', help='run every shard in this process')
+    parser.add_argument('--shard-count', type=int, help='total amount of shards across all processes')
+    parser.add_argument('--shard-ids', type=lambda value: [int(shard_id) for shard_id in value.split(',')],
+                        help='comma separated shards of this process, requires --shard-count')
+    parsed = parser.parse_args(args)
+    if parsed.shard_ids and not parsed.shard_count:
+        parser.error('--shard-ids requires --shard-count')
+    return parsed
+
 
 if __name__ == '__main__':
     load_dotenv()
     token = os.getenv('DISCORDBOT_TOKEN')
+    args = parse_args()
+    bot = create_bot(args.sharded, args.shard_ids, args.shard_count)
     bot.run(token, reconnect=True)